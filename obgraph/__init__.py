@@ -1,4 +1,4 @@
 from .graph import Graph, VariantNotFoundException
-from .dummy_node_adder import DummyNodeAdder
-from .mutable_graph import MutableGraph
+from .dummy_node_adder import DummyNodeAdder, ArrayDummyNodeAdder
+from .mutable_graph import MutableGraph, ArrayMutableGraph
 from .genotype_matrix import GenotypeFrequencies, MostSimilarVariantLookup
\ No newline at end of file
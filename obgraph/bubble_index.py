@@ -0,0 +1,179 @@
+import logging
+import numpy as np
+from npstructures import RaggedArray
+from .cython_traversing import traverse_graph_by_following_nodes
+
+# Haplotypes only differ from the reference path at bubbles. A bubble is one of the alternative ways out of a node
+# on the reference path (the path followed when no nodes are followed, through linear ref nodes and dummy nodes):
+# the entry node, the node chosen at the entry (choice node), the alt nodes walked through before getting back to the
+# reference path, and the exit node where the reference path is reached again. Bubbles are stored in linear ref order.
+#
+# A haplotype path is made by splicing the alt nodes of the bubbles chosen by the haplotype into the reference path,
+# which gives the same path as traverse_graph_by_following_nodes. Bubbles where an alt node has more than one
+# way out are marked as complex; haplotypes choosing these are traversed the normal way.
+
+
+class BubbleIndex:
+    properties = {"ref_path", "entry_positions", "exit_positions", "choice_nodes", "edge_ranks", "ref_edge_ranks", "alt_nodes", "is_complex"}
+
+    def __init__(self, ref_path, entry_positions, exit_positions, choice_nodes, edge_ranks, ref_edge_ranks, alt_nodes, is_complex, graph=None):
+        # entry_positions and exit_positions are indexes in ref_path. edge_ranks is the index of the choice node in the
+        # edge list of the entry node, and ref_edge_ranks the index of the next node on the reference path
+        # (when several of the nodes out of an entry node are followed, the last one is used)
+        self.ref_path = ref_path
+        self.entry_positions = entry_positions
+        self.exit_positions = exit_positions
+        self.choice_nodes = choice_nodes
+        self.edge_ranks = edge_ranks
+        self.ref_edge_ranks = ref_edge_ranks
+        self.alt_nodes = alt_nodes
+        self.is_complex = is_complex
+        self._n_nodes = int(max(np.max(ref_path, initial=0), np.max(choice_nodes, initial=0))) + 1
+        # the graph is only needed for haplotypes choosing complex bubbles
+        self._graph = graph
+
+    def __len__(self):
+        return len(self.entry_positions)
+
+    @property
+    def entry_nodes(self):
+        return self.ref_path[self.entry_positions]
+
+    @property
+    def exit_nodes(self):
+        exit_nodes = np.full(len(self), -1, dtype=np.int64)
+        has_exit = self.exit_positions >= 0
+        exit_nodes[has_exit] = self.ref_path[self.exit_positions[has_exit]]
+        return exit_nodes
+
+    def get_ref_nodes(self, bubble):
+        # the reference path nodes skipped by the bubble
+        return self.ref_path[self.entry_positions[bubble] + 1:self.exit_positions[bubble]]
+
+    @classmethod
+    def from_graph(cls, graph):
+        logging.info("Finding reference path")
+        ref_path = traverse_graph_by_following_nodes(graph, np.zeros(len(graph.nodes), dtype=np.uint8)).astype(np.uint32)
+        ref_positions = np.full(len(graph.nodes), -1, dtype=np.int64)
+        ref_positions[ref_path] = np.arange(len(ref_path))
+
+        # all edges out of reference path nodes, except the ones following the reference path
+        n_edges = graph.edges.lengths
+        entry_positions = np.flatnonzero(n_edges[ref_path] > 1)
+        out_edges = graph.edges[ref_path[entry_positions]]
+        choice_nodes = out_edges.ravel()
+        edge_entries = np.repeat(np.arange(len(entry_positions)), out_edges.lengths)
+        edge_ranks = np.arange(len(choice_nodes)) - np.repeat(np.cumsum(out_edges.lengths) - out_edges.lengths, out_edges.lengths)
+        is_bubble = ref_positions[choice_nodes] != entry_positions[edge_entries] + 1
+        ref_edge_ranks = np.zeros(len(entry_positions), dtype=np.int64)
+        ref_edge_ranks[edge_entries[~is_bubble]] = edge_ranks[~is_bubble]
+        ref_edge_ranks = ref_edge_ranks[edge_entries[is_bubble]]
+        entry_positions = entry_positions[edge_entries[is_bubble]]
+        edge_ranks = edge_ranks[is_bubble]
+        choice_nodes = choice_nodes[is_bubble]
+        n_bubbles = len(choice_nodes)
+        logging.info("Found %d bubbles" % n_bubbles)
+
+        # walk all bubbles one node at a time until they reach the reference path
+        exit_positions = np.full(n_bubbles, -1, dtype=np.int64)
+        is_complex = np.zeros(n_bubbles, dtype=bool)
+        alt_bubbles = []
+        alt_nodes = []
+        walking = np.arange(n_bubbles)
+        current_nodes = choice_nodes.astype(np.int64)
+        while len(walking) > 0:
+            is_on_ref_path = ref_positions[current_nodes] >= 0
+            exit_positions[walking[is_on_ref_path]] = ref_positions[current_nodes[is_on_ref_path]]
+            walking = walking[~is_on_ref_path]
+            current_nodes = current_nodes[~is_on_ref_path]
+            alt_bubbles.append(walking)
+            alt_nodes.append(current_nodes)
+
+            has_one_edge = n_edges[current_nodes] == 1
+            is_complex[walking[~has_one_edge]] = True
+            walking = walking[has_one_edge]
+            current_nodes = graph.edges[current_nodes[has_one_edge]].ravel().astype(np.int64)
+
+        is_complex |= exit_positions <= entry_positions
+        # alt nodes were found one step at a time for all bubbles, a stable sort gives them per bubble in walk order
+        alt_bubbles = np.concatenate(alt_bubbles)
+        sorting = np.argsort(alt_bubbles, kind="stable")
+        alt_nodes = RaggedArray(np.concatenate(alt_nodes)[sorting].astype(np.uint32), np.bincount(alt_bubbles, minlength=n_bubbles))
+        logging.info("%d bubbles are complex" % np.sum(is_complex))
+
+        return cls(ref_path, entry_positions, exit_positions, choice_nodes.astype(np.uint32), edge_ranks, ref_edge_ranks,
+                   alt_nodes, is_complex, graph)
+
+    def _get_chosen_bubbles(self, follow_nodes):
+        # Bubbles chosen by a haplotype following the given nodes, in linear ref order
+        is_followed = np.zeros(self._n_nodes, dtype=bool)
+        is_followed[follow_nodes[follow_nodes < self._n_nodes]] = True
+        chosen = np.flatnonzero(is_followed[self.choice_nodes])
+
+        # The ref path is chosen instead if the next ref path node is followed and comes later in the edge list
+        ref_next = self.ref_path[self.entry_positions[chosen] + 1]
+        chosen = chosen[~is_followed[ref_next] | (self.edge_ranks[chosen] > self.ref_edge_ranks[chosen])]
+
+        # bubbles are sorted by entry position and edge order, so the last bubble for each entry is used
+        entry_positions = self.entry_positions[chosen]
+        is_last = np.append(entry_positions[1:] != entry_positions[:-1], True)
+        return chosen[is_last]
+
+    def _remove_unreachable_bubbles(self, chosen):
+        # a bubble starting inside a chosen bubble is never reached
+        entry_positions = self.entry_positions[chosen]
+        exit_positions = self.exit_positions[chosen]
+        previous_exits = np.maximum.accumulate(np.concatenate([[-1], exit_positions[:-1]]))
+        if np.all(entry_positions >= previous_exits):
+            return chosen
+
+        keep = np.zeros(len(chosen), dtype=bool)
+        previous_exit = -1
+        for i in range(len(chosen)):
+            if entry_positions[i] >= previous_exit:
+                keep[i] = True
+                previous_exit = exit_positions[i]
+        return chosen[keep]
+
+    def get_haplotype_path(self, follow_nodes):
+        # Same path as traverse_graph_by_following_nodes gives with these nodes as the follow nodes
+        follow_nodes = np.asarray(follow_nodes, dtype=np.int64)
+        chosen = self._get_chosen_bubbles(follow_nodes)
+        if np.any(self.is_complex[chosen]):
+            assert self._graph is not None, "Graph is needed to traverse haplotypes choosing complex bubbles"
+            logging.info("Haplotype chooses complex bubbles, traversing")
+            nodes_to_follow = np.zeros(len(self._graph.nodes), dtype=np.uint8)
+            nodes_to_follow[follow_nodes] = 1
+            return traverse_graph_by_following_nodes(self._graph, nodes_to_follow).astype(np.uint32)
+
+        chosen = self._remove_unreachable_bubbles(chosen)
+        entry_positions = self.entry_positions[chosen]
+        exit_positions = self.exit_positions[chosen]
+
+        # remove the ref path nodes inside the chosen bubbles, and insert the alt nodes after the entry nodes
+        is_skipped = np.zeros(len(self.ref_path) + 1, dtype=np.int64)
+        np.add.at(is_skipped, entry_positions + 1, 1)
+        np.add.at(is_skipped, exit_positions, -1)
+        is_kept = np.cumsum(is_skipped[:-1]) == 0
+        alt_nodes = self.alt_nodes[chosen]
+        insert_positions = np.cumsum(is_kept)[entry_positions]
+        return np.insert(self.ref_path[is_kept], np.repeat(insert_positions, alt_nodes.lengths), alt_nodes.ravel())
+
+    def get_haplotype_path_from_alleles(self, variant_to_nodes, alleles):
+        # alleles has one element per variant in variant_to_nodes, nonzero where the haplotype has the variant allele
+        return self.get_haplotype_path(variant_to_nodes.var_nodes[np.asarray(alleles) != 0])
+
+    def to_file(self, file_name):
+        np.savez(file_name, ref_path=self.ref_path, entry_positions=self.entry_positions, exit_positions=self.exit_positions,
+                 choice_nodes=self.choice_nodes, edge_ranks=self.edge_ranks, ref_edge_ranks=self.ref_edge_ranks, alt_nodes=self.alt_nodes.ravel(),
+                 alt_nodes_lengths=self.alt_nodes.lengths, is_complex=self.is_complex)
+
+    @classmethod
+    def from_file(cls, file_name, graph=None):
+        try:
+            data = np.load(file_name)
+        except FileNotFoundError:
+            data = np.load(file_name + ".npz")
+
+        return cls(data["ref_path"], data["entry_positions"], data["exit_positions"], data["choice_nodes"], data["edge_ranks"], data["ref_edge_ranks"],
+                   RaggedArray(data["alt_nodes"], data["alt_nodes_lengths"]), data["is_complex"], graph)
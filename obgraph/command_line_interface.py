@@ -2,35 +2,56 @@ import logging
 import pickle
 
 logging.basicConfig(level=logging.INFO, format='%(module)s %(asctime)s %(levelname)s: %(message)s')
-from obgraph.cython_traversing import traverse_graph_by_following_nodes
+from obgraph.cython_traversing import traverse_graph_by_following_nodes, traverse_graph_by_following_nodes_batch, make_follow_mask, traverse_many, traverse_graph_in_chunks
 import pyximport; pyximport.install()
 import sys
 import argparse
 from . import Graph
 from .util import add_indel_dummy_nodes
-from .variants import VcfVariants
+from .variants import VcfVariants, get_vcf_chromosome_offsets
 from .haplotype_nodes import HaplotypeToNodes, NodeToHaplotypes
-from .dummy_node_adder import DummyNodeAdder
+from .dummy_node_adder import DummyNodeAdder, ArrayDummyNodeAdder
 from .haplotype_nodes import NodeToHaplotypes
 from .genotype_matrix import GenotypeMatrix, GenotypeMatrixAnalyser, GenotypeFrequencies
 from pyfaidx import Fasta
-from .graph_construction import GraphConstructor
+from .graph_construction import GraphConstructor, make_chromosome_graph, make_genome_graph, get_n_graph_construction_workers
 from .graph_merger import merge_graphs
+from .variant_insertion import VariantInserter
 import numpy as np
 from shared_memory_wrapper import from_shared_memory, to_shared_memory, SingleSharedArray, remove_shared_memory_in_session, to_file, from_file, get_shared_pool, close_shared_pool
 from multiprocessing import Pool
 import time
 from itertools import repeat
-from .util import create_coordinate_map
-from .util import fill_zeros_with_last
 from .variant_to_nodes import VariantToNodes
 from npstructures import RaggedArray
 import bionumpy as bnp
 
 
 
+def _get_index_cache(args):
+    if getattr(args, "index_cache", None) is None:
+        return None
+    from .index_cache import IndexCache
+    return IndexCache(args.index_cache, max_size=int(args.index_cache_max_size_gb * 1024**3))
+
+
+def _read_graph(file_name, args, mmap=True):
+    graph = Graph.from_file(file_name, mmap=mmap)
+    index_cache = _get_index_cache(args)
+    if index_cache is not None:
+        graph.use_index_cache(index_cache)
+    return graph
+
+
+def _add_index_cache_arguments(subparser):
+    subparser.add_argument("--index-cache", required=False,
+                           help="Directory where indexes derived from the graph are cached, so that they are only made once")
+    subparser.add_argument("--index-cache-max-size-gb", type=float, default=10.0, required=False,
+                           help="Least recently used indexes are removed from the index cache when it grows beyond this size")
+
+
 def merge_graphs_command(args):
-    graphs = [Graph.from_file(graph) for graph in args.graphs]
+    graphs = [Graph.from_file(graph, mmap=True) for graph in args.graphs]
     logging.info("Done reading graphs")
 
     merged_graph = merge_graphs(graphs)
@@ -38,14 +59,16 @@ def merge_graphs_command(args):
 
 
 def _assert_vcf_and_fasta_are_compatible(fasta_file_name, vcf_file_name):
+    # returns the offset of each chromosome in the vcf, in the order the chromosomes are in the vcf
     logging.info(f"Checking that fasta {fasta_file_name} and vcf {vcf_file_name} are compatible")
     genome = bnp.Genome.from_file(fasta_file_name)
     chromosomes = genome.get_genome_context().chrom_sizes.keys()
 
-    for chunk in bnp.open(vcf_file_name).read_chunks():
-        unique_chromosomes = set([c.chromosome.to_string() for c in chunk])
-        assert all(c in chromosomes for c in unique_chromosomes), \
-            "VCF contains chromosomes %s. Some chromosomes are not in fasta which contains chromosomes %s" % (unique_chromosomes, chromosomes)
+    vcf_offsets = get_vcf_chromosome_offsets(vcf_file_name)
+    unique_chromosomes = list(vcf_offsets)
+    assert all(c in chromosomes for c in unique_chromosomes), \
+        "VCF contains chromosomes %s. Some chromosomes are not in fasta which contains chromosomes %s" % (unique_chromosomes, chromosomes)
+    return vcf_offsets
 
 
 def _assert_chromosome_is_in_reference(fasta_file_name, chromosome):
@@ -55,33 +78,21 @@ def _assert_chromosome_is_in_reference(fasta_file_name, chromosome):
 
 
 def make(args):
-    if args.vcf is not None:
-        if args.chromosome is not None:
-            _assert_chromosome_is_in_reference(args.reference_fasta_file, args.chromosome)
-        else:
-            _assert_vcf_and_fasta_are_compatible(args.reference_fasta_file, args.vcf)
-
+    if args.vcf is not None and args.chromosome is None:
+        # whole genome, one graph per chromosome made in parallel
+        vcf_offsets = _assert_vcf_and_fasta_are_compatible(args.reference_fasta_file, args.vcf)
+        chromosomes = list(vcf_offsets)
+        chromosome_sizes = bnp.Genome.from_file(args.reference_fasta_file).get_genome_context().chrom_sizes
+        n_workers = args.n_threads
+        if n_workers is None:
+            n_workers = get_n_graph_construction_workers([chromosome_sizes[chromosome] for chromosome in chromosomes])
+
+        logging.info("Will create graph for %d chromosomes using %d workers" % (len(chromosomes), n_workers))
+        make_genome_graph(args.reference_fasta_file, args.vcf, chromosomes, args.out_file_name, n_workers, vcf_offsets)
+    elif args.vcf is not None:
+        _assert_chromosome_is_in_reference(args.reference_fasta_file, args.chromosome)
         logging.info("Will create from vcf file")
-        reference = Fasta(args.reference_fasta_file)
-
-        chromosome = args.chromosome
-        """
-        numeric_chromosome = chromosome
-        
-        if chromosome == "X":
-            numeric_chromosome = "23"
-        elif chromosome == "Y":
-            numeric_chromosome = "24"
-        """
-
-        ref_sequence = str(reference[args.chromosome])
-        logging.info("Extracted sequence for chromosome %s. Length is: %d" % (chromosome, len(ref_sequence)))
-        variants = VcfVariants.from_vcf(args.vcf, limit_to_chromosome=chromosome, dont_encode_chromosomes=True)
-        logging.info("There are %d variants in chromosome" % len(variants))
-        assert len(variants) > 0, "Did not find any variants in VCF when limiting to chromosome %s" % chromosome
-
-        constructor = GraphConstructor(ref_sequence, variants)
-        graph = constructor.get_graph_with_dummy_nodes()
+        graph = make_chromosome_graph(args.reference_fasta_file, args.vcf, args.chromosome)
         graph.to_file(args.out_file_name)
     else:
         logging.info("Will create from files %s" % args.vg_json_files)
@@ -91,23 +102,45 @@ def make(args):
 
 def add_indel_nodes(args):
     variants = VcfVariants.from_vcf(args.vcf_file_name)
-    graph = Graph.from_file(args.graph_file_name)
-    adder = DummyNodeAdder(graph, variants)
+    graph = _read_graph(args.graph_file_name, args, mmap=False)
+    adder = ArrayDummyNodeAdder(graph, variants)
     new_graph = adder.create_new_graph_with_dummy_nodes()
-    edge_mapping = adder.get_edge_mapping()
     new_graph.to_file(args.out_file_name)
     logging.info("Chromosome start nodes in new graph: %s" % new_graph.chromosome_start_nodes)
     logging.info("Wrote new graph to file %s" % args.out_file_name)
-    with open(args.out_file_name + ".edge_mapping", "wb") as f:
-        pickle.dump(edge_mapping, f)
-        logging.info("Wrote edge mapping from old edges to new dummy nodes to file %s.edge_mapping" % args.out_file_name)
+    adder.edge_mapping_to_file(args.out_file_name + ".edge_mapping.npz")
+    logging.info("Wrote edge mapping from old edges to new dummy nodes to file %s.edge_mapping.npz" % args.out_file_name)
+
+def add_variants(args):
+    variants = VcfVariants.from_vcf(args.vcf_file_name, dont_encode_chromosomes=True)
+    graph = _read_graph(args.graph_file_name, args, mmap=False)
+    inserter = VariantInserter(graph, variants)
+    new_graph = inserter.create_new_graph()
+    new_graph.to_file(args.out_file_name)
+    logging.info("Wrote new graph to file %s" % args.out_file_name)
+    inserter.node_remap_to_file(args.out_file_name + ".node_remap.npz")
+    logging.info("Wrote node ids that were split or removed to file %s.node_remap.npz" % args.out_file_name)
+
+
+def _read_graph_or_chromosome(file_name, chromosome, mmap=True):
+    # With a chromosome, only that chromosome is loaded from sharded graphs. Node ids are the same as in the full graph
+    if chromosome is None:
+        return Graph.from_file(file_name, mmap=mmap)
+    return Graph.open(file_name, mmap=mmap).chromosome(chromosome)
+
 
 def add_allele_frequencies(args):
     logging.info("Reading graph")
-    graph = Graph.from_file(args.graph_file_name)
+    sharded_graph = Graph.open(args.graph_file_name, mmap=False)
+    only_chromosome = args.chromosome is not None and sharded_graph.is_sharded
+    graph = sharded_graph.chromosome(args.chromosome) if only_chromosome else sharded_graph.load_all()
     variants = VcfVariants.from_vcf(args.vcf_file_name, limit_to_chromosome=args.chromosome, skip_index=True, dont_encode_chromosomes=True)
     graph.set_allele_frequencies_from_variants(variants, use_chromosome=args.chromosome)
-    graph.to_file(args.graph_file_name)
+    if only_chromosome:
+        # only the shard of the chromosome is changed
+        sharded_graph.set_chromosome_array(args.chromosome, "allele_frequencies", graph.allele_frequencies, default_value=1)
+    else:
+        graph.to_file(args.graph_file_name)
     logging.info("Wrote modified graph to the same file %s" % args.graph_file_name)
 
 
@@ -141,15 +174,26 @@ def run_argument_parser(args):
     subparser.add_argument("-j", "--vg-json-files", nargs='+', required=False)
     subparser.add_argument("-v", "--vcf", required=False)
     subparser.add_argument("-r", "--reference_fasta_file", required=False)
-    subparser.add_argument("-c", "--chromosome", required=False)
+    subparser.add_argument("-c", "--chromosome", required=False,
+                           help="If not set, a sharded graph with all chromosomes in the vcf is made (one chromosome per worker)")
+    subparser.add_argument("-t", "--n-threads", type=int, required=False,
+                           help="Number of chromosomes made in parallel. Default is chosen from available cores and memory")
     subparser.set_defaults(func=make)
 
     subparser = subparsers.add_parser("add_indel_nodes")
     subparser.add_argument("-o", "--out_file_name", required=True)
     subparser.add_argument("-g", "--graph-file-name", required=True)
     subparser.add_argument("-v", "--vcf-file-name", required=True)
+    _add_index_cache_arguments(subparser)
     subparser.set_defaults(func=add_indel_nodes)
 
+    subparser = subparsers.add_parser("add_variants", help="Add new variants to a graph made by make, without making the whole graph again")
+    subparser.add_argument("-o", "--out_file_name", required=True)
+    subparser.add_argument("-g", "--graph-file-name", required=True)
+    subparser.add_argument("-v", "--vcf-file-name", required=True)
+    _add_index_cache_arguments(subparser)
+    subparser.set_defaults(func=add_variants)
+
     subparser = subparsers.add_parser("add_allele_frequencies")
     subparser.add_argument("-g", "--graph-file-name", required=True)
     subparser.add_argument("-v", "--vcf-file-name", required=True)
@@ -309,25 +353,29 @@ def run_argument_parser(args):
 
 
     def traverse(args):
-        g = Graph.from_file(args.graph)
+        g = Graph.from_file(args.graph, mmap=True)
         haplotype_to_nodes = HaplotypeToNodes.from_file(args.haplotype_nodes)
         #from .traversing import traverse_graph_by_following_nodes
 
-        for haplotype in range(0, args.n_haplotypes):
-
-            nodes_to_follow = np.zeros(len(g.nodes), dtype=np.uint8)
-            nodes_to_follow[haplotype_to_nodes.get_nodes(haplotype)] = 1
+        for batch_start in range(0, args.n_haplotypes, args.batch_size):
+            haplotypes = range(batch_start, min(batch_start + args.batch_size, args.n_haplotypes))
             start_time = time.time()
-            new_nodes = traverse_graph_by_following_nodes(g, nodes_to_follow)
-            logging.info("Got %d nodes" % len(new_nodes))
+            follow_mask = make_follow_mask(len(g.nodes), [haplotype_to_nodes.get_nodes(haplotype) for haplotype in haplotypes])
+            if args.n_threads > 1:
+                paths = traverse_many(g, follow_mask, args.n_threads, n_haplotypes=len(haplotypes))
+            else:
+                paths = traverse_graph_by_following_nodes_batch(g, follow_mask, len(haplotypes))
             end_time = time.time()
-            logging.info("Time spent on haplotype %d: %.5f" % (haplotype, end_time - start_time))
+            logging.info("Got %d nodes in total for haplotypes %d-%d" % (paths.size, haplotypes[0], haplotypes[-1]))
+            logging.info("Time spent on haplotypes %d-%d: %.5f" % (haplotypes[0], haplotypes[-1], end_time - start_time))
 
     subparser = subparsers.add_parser("traverse")
     subparser.add_argument("-g", "--graph", required=True)
     subparser.add_argument("-T", "--type", required=False, default="correct_haplotype_nodes")
     subparser.add_argument("-H", "--haplotype_nodes", required=False)
     subparser.add_argument("-n", "--n_haplotypes", type=int, default=1, required=False)
+    subparser.add_argument("-b", "--batch-size", type=int, default=64, required=False, help="Number of haplotypes to traverse together")
+    subparser.add_argument("-t", "--n-threads", type=int, default=1, required=False, help="Number of threads to use")
     subparser.add_argument("-o", "--out_file_name", required=True)
     subparser.set_defaults(func=traverse)
 
@@ -370,13 +418,10 @@ def run_argument_parser(args):
 
     def validate_graph(args):
         variants = VcfVariants.from_vcf(args.vcf)
-        graph = Graph.from_file(args.graph)
-
-        for i, variant in enumerate(variants):
-            if i % 10000 == 0:
-                logging.info("%d variants processed" % i)
-
-            ref_node, var_node = graph.get_variant_nodes(variant)
+        graph = Graph.from_file(args.graph, mmap=True)
+        from .variant_locator import BatchVariantLocator
+        BatchVariantLocator(graph).locate_variants(variants)
+        logging.info("All %d variants were found in the graph" % len(variants))
 
     subparser = subparsers.add_parser("validate_graph")
     subparser.add_argument("-g", "--graph", required=True)
@@ -391,8 +436,8 @@ def run_argument_parser(args):
 
     def make_variant_to_nodes(args):
         from .variant_to_nodes import VariantToNodes
-        graph = Graph.from_file(args.graph)
-        variants = VcfVariants.from_vcf(args.vcf, skip_index=True, dont_encode_chromosomes=True)
+        graph = _read_graph_or_chromosome(args.graph, args.chromosome)
+        variants = VcfVariants.from_vcf(args.vcf, skip_index=True, dont_encode_chromosomes=True, limit_to_chromosome=args.chromosome)
         variant_to_nodes = VariantToNodes.from_graph_and_variants(graph, variants)
         variant_to_nodes.to_file(args.out_file_name)
         logging.info("Wrote to file %s" % args.out_file_name)
@@ -401,28 +446,35 @@ def run_argument_parser(args):
     subparser.add_argument("-g", "--graph", required=True)
     subparser.add_argument("-v", "--vcf", required=True)
     subparser.add_argument("-o", "--out_file_name", required=True)
+    subparser.add_argument("-c", "--chromosome", required=False,
+                           help="Only find nodes of variants on this chromosome. Only this chromosome is loaded from sharded graphs")
     subparser.set_defaults(func=make_variant_to_nodes)
 
     def make_node_to_variants(args):
         from .variant_to_nodes import NodeToVariants, VariantToNodes
         variant_to_nodes = VariantToNodes.from_file(args.variant_to_nodes)
-        node_to_variants = NodeToVariants.from_variant_to_nodes(variant_to_nodes)
+        index_cache = _get_index_cache(args)
+        if index_cache is not None:
+            node_to_variants = index_cache.get_node_to_variants(variant_to_nodes)
+        else:
+            node_to_variants = NodeToVariants.from_variant_to_nodes(variant_to_nodes)
         node_to_variants.to_file(args.out_file_name)
 
     subparser = subparsers.add_parser("make_node_to_variants")
     subparser.add_argument("-v", "--variant_to_nodes", required=True)
     subparser.add_argument("-o", "--out_file_name", required=True)
+    _add_index_cache_arguments(subparser)
     subparser.set_defaults(func=make_node_to_variants)
 
     def create_coordinate_converter(args):
-        from .coordinate_converter import CoordinateConverter
-        converter = CoordinateConverter.from_graph(Graph.from_file(args.graph))
+        converter = _read_graph(args.graph, args).get_index("coordinate_converter")
         converter.to_file(args.out_file_name)
         logging.info("Wrote to file %s" % args.out_file_name)
 
     subparser = subparsers.add_parser("create_coordinate_converter")
     subparser.add_argument("-g", "--graph", required=True)
     subparser.add_argument("-o", "--out_file_name", required=True)
+    _add_index_cache_arguments(subparser)
     subparser.set_defaults(func=create_coordinate_converter)
 
     def intersect_vcfs(args):
@@ -451,91 +503,94 @@ def run_argument_parser(args):
 
 
     def make_position_id(args):
-        from .position_id import PositionId
-        graph = Graph.from_file(args.graph)
-        position_id = PositionId.from_graph(graph)
+        position_id = _read_graph(args.graph, args).get_index("position_id")
         to_file(position_id, args.out_file_name)
 
 
     subparser = subparsers.add_parser("make_position_id")
     subparser.add_argument("-g", "--graph", required=True)
     subparser.add_argument("-o", "--out-file-name", required=True)
+    _add_index_cache_arguments(subparser)
     subparser.set_defaults(func=make_position_id)
 
 
+    def make_bubble_index(args):
+        from .bubble_index import BubbleIndex
+        bubble_index = BubbleIndex.from_graph(Graph.from_file(args.graph, mmap=True))
+        bubble_index.to_file(args.out_file_name)
+        logging.info("Wrote bubble index to %s" % args.out_file_name)
+
+    subparser = subparsers.add_parser("make_bubble_index")
+    subparser.add_argument("-g", "--graph", required=True)
+    subparser.add_argument("-o", "--out-file-name", required=True)
+    subparser.set_defaults(func=make_bubble_index)
+
+
     def get_haplotype_sequence(args):
         # will traverse graph and follow these nodes
         # gets sequence for each chromosome in graph
         # writes fasta with sequences
+        # The path is traversed in chunks of nodes, and each chunk is written before the next is traversed
+        from .haplotype_sequence_writer import HaplotypeSequenceWriter
+        graph = _read_graph_or_chromosome(args.graph, args.chromosome)
+        if args.chromosome is not None:
+            # the graph has all chromosomes if it is not sharded
+            graph.chromosome_start_nodes = {args.chromosome: graph.chromosome_start_nodes[args.chromosome]}
         variant_nodes = np.load(args.nodes)
-        nodes_to_follow = np.zeros(len(args.graph.nodes), dtype=np.uint8)
-        nodes_to_follow[variant_nodes] = 1
-        path_nodes, chromosome_indexes = traverse_graph_by_following_nodes(args.graph, nodes_to_follow, True)
-
-        chromosome_indexes.append(len(path_nodes))
-
-        chromosome_chunks = list(zip(chromosome_indexes[0:-1], chromosome_indexes[1:]))
-        logging.info("Chromosome chunks: %s" % chromosome_chunks)
-
-        chromosome_id = 1  # assume chromosomes are sorted
-        fasta_lines = []
-        coordinate_maps = {}
-        refpos_to_node_maps = {}  # mapping from a ref pos in the haplotype coordinate space to node
-
-        chromosome_index = 0
-        for start_index, end_index in chromosome_chunks:
-            nodes = path_nodes[start_index:end_index]
-            fasta_lines.append(">" + str(chromosome_id) + "\n")
-            haplotype_sequence = args.graph.get_nodes_sequence(nodes)
-            fasta_lines.append(haplotype_sequence)
-            fasta_lines.append("\n")
-
-            # create a coordinate-map, a lookup from path pos to approx linear ref pos in graph
-            coordinate_maps[str(chromosome_id)] = create_coordinate_map(nodes, args.graph, chromosome_index)
-
-            refpos_to_node = np.zeros(len(haplotype_sequence), np.uint32)
-            offsets = np.cumsum(args.graph.nodes[nodes])
-            refpos_to_node[0] = nodes[0]
-            refpos_to_node[offsets[:-1]] = nodes[1:]
-            refpos_to_node = fill_zeros_with_last(refpos_to_node)
-            refpos_to_node_maps[str(chromosome_id)] = refpos_to_node
-
-            chromosome_index += 1
-            chromosome_id += 1
-
-        # write all sequences to fasta
-        with open(args.out_file_name + ".fa", "w") as f:
-            f.writelines(fasta_lines)
-            logging.info("Wrote sequences to %s" % (args.out_file_name + ".fa"))
-
-        # also write nodes in path to file
-        np.save(args.out_file_name + ".nodes", path_nodes)
-        logging.info("Wrote nodes in haplotype path to %s" % args.out_file_name + ".nodes.npy")
-
-        to_file(coordinate_maps, args.out_file_name + ".coordinate_maps")
-        logging.info("Wrote coordinate maps to %s" % args.out_file_name + ".coordinate_maps")
+        variant_nodes = variant_nodes[variant_nodes < len(graph.nodes)]
+        follow_mask = make_follow_mask(len(graph.nodes), [variant_nodes])
 
-        to_file(refpos_to_node_maps, args.out_file_name + ".refpos_to_node")
-        logging.info("Wrote refpos to node map to %s" % args.out_file_name + ".refpos_to_node")
+        writer = HaplotypeSequenceWriter(graph, args.out_file_name)
+        current_chromosome_index = -1
+        for chromosome_index, nodes in traverse_graph_in_chunks(graph, follow_mask, chunk_size=args.chunk_size):
+            if chromosome_index != current_chromosome_index:
+                # assume chromosomes are sorted
+                chromosome_id = args.chromosome if args.chromosome is not None else chromosome_index + 1
+                writer.start_chromosome(chromosome_id, chromosome_index)
+                current_chromosome_index = chromosome_index
+            writer.add_nodes(nodes)
 
+        writer.close()
 
     subparser = subparsers.add_parser("get_haplotype_sequence")
     subparser.add_argument("-n", "--nodes", required=True)
-    subparser.add_argument("-g", "--graph", required=True, type=Graph.from_file)
+    subparser.add_argument("-g", "--graph", required=True)
     subparser.add_argument("-o", "--out-file-name", required=True)
+    subparser.add_argument("-c", "--chunk-size", type=int, default=1000000, required=False,
+                           help="Number of nodes to traverse before writing the sequence of those nodes")
+    subparser.add_argument("--chromosome", required=False,
+                           help="Only write the sequence of this chromosome. Only this chromosome is loaded from sharded graphs")
     subparser.set_defaults(func=get_haplotype_sequence)
 
     def from_gfa(args):
-        from .gfa import create_graph_from_gfa_file
-        graph = create_graph_from_gfa_file(args.gfa)
+        from .gfa import create_graph_and_id_map_from_gfa_file
+        graph, id_map = create_graph_and_id_map_from_gfa_file(args.gfa, args.chunk_size)
         graph.to_file(args.out_file_name)
+        if id_map is not None:
+            id_map.to_file(args.out_file_name + ".id_map.npz")
+            logging.info("Wrote segment names of the node ids to %s" % (args.out_file_name + ".id_map.npz"))
 
-    subparser = subparsers.add_parser("from_gfa")
+    subparser = subparsers.add_parser("from_gfa", help="Make a graph from a gfa. If segment names are not integers, "
+                                                       "the names of the node ids are written to <out-file-name>.id_map.npz")
     subparser.add_argument("-g", "--gfa", required=True)
     subparser.add_argument("-o", "--out-file-name", required=True)
+    subparser.add_argument("-c", "--chunk-size", type=int, default=64 * 1024 * 1024, required=False,
+                           help="Number of bytes of the gfa to read at a time")
     subparser.set_defaults(func=from_gfa)
 
 
+    def to_gfa(args):
+        graph = Graph.from_file(args.graph, mmap=True)
+        graph.to_gfa(args.out_file_name, args.chunk_size)
+        logging.info("Wrote gfa to %s" % args.out_file_name)
+
+    subparser = subparsers.add_parser("to_gfa", help="Write a graph as gfa, with one path for the linear reference of each chromosome")
+    subparser.add_argument("-g", "--graph", required=True)
+    subparser.add_argument("-o", "--out-file-name", required=True)
+    subparser.add_argument("-c", "--chunk-size", type=int, default=64 * 1024 * 1024, required=False,
+                           help="Approximate number of bytes of the gfa to make at a time")
+    subparser.set_defaults(func=to_gfa)
+
     def convert_gfa_ids_to_numeric_command(args):
         from .gfa import convert_gfa_ids_to_numeric
         convert_gfa_ids_to_numeric(args.gfa, args.out_base_name)
@@ -546,6 +601,26 @@ def run_argument_parser(args):
     subparser.add_argument("-o", "--out-base-name")
     subparser.set_defaults(func=convert_gfa_ids_to_numeric_command)
 
+    def convert_graph(args):
+        graph = Graph.from_file(args.graph)
+        graph.to_file(args.out_file_name, native=not args.legacy)
+        logging.info("Wrote graph to %s" % args.out_file_name)
+
+    def shard_graph(args):
+        graph = Graph.from_file(args.graph, mmap=True)
+        graph.to_sharded_file(args.out_file_name)
+
+    subparser = subparsers.add_parser("shard_graph", help="Write a graph as one shard per chromosome, so that single chromosomes can be loaded")
+    subparser.add_argument("-g", "--graph", required=True)
+    subparser.add_argument("-o", "--out-file-name", required=True)
+    subparser.set_defaults(func=shard_graph)
+
+    subparser = subparsers.add_parser("convert_graph", help="Convert a graph to the native memory-mappable format (or back with --legacy)")
+    subparser.add_argument("-g", "--graph", required=True)
+    subparser.add_argument("-o", "--out-file-name", required=True)
+    subparser.add_argument("-l", "--legacy", action="store_true", default=False, help="Write to the old shared_memory_wrapper format")
+    subparser.set_defaults(func=convert_graph)
+
     if len(args) == 0:
         parser.print_help()
         sys.exit(1)
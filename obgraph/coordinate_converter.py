@@ -8,7 +8,8 @@ class CoordinateConverter:
 
     @classmethod
     def from_graph(cls, graph):
-        chromosome_start_offsets = graph.node_to_ref_offset[graph.chromosome_start_nodes]
+        chromosome_start_nodes = np.array(list(graph.chromosome_start_nodes.values()), dtype=np.int64)
+        chromosome_start_offsets = graph.node_to_ref_offset[chromosome_start_nodes]
         return cls(chromosome_start_offsets)
 
     def convert_chromosome_offset(self, chromosome, offset):
@@ -2,7 +2,11 @@ import logging
 import numpy as np
 cimport numpy as np
 cimport cython
+from cython.parallel cimport prange
+from libc.stdlib cimport malloc, calloc, realloc, free
+from libc.string cimport memcpy
 import time
+from npstructures import RaggedArray
 
 def fill_zeros_increasingly(np.int64_t[:] array):
     cdef int i = 0
@@ -12,7 +16,7 @@ def fill_zeros_increasingly(np.int64_t[:] array):
 
 
 @cython.wraparound(False)
-def traverse_graph_by_following_nodes(graph, np.uint8_t[:] follow_nodes, split_into_chromosomes=False):
+def traverse_graph_by_following_nodes(graph, const np.uint8_t[:] follow_nodes, split_into_chromosomes=False):
     logging.info("Traversing with cython")
 
     #assert type(follow_nodes) == np.ndarray
@@ -23,13 +27,13 @@ def traverse_graph_by_following_nodes(graph, np.uint8_t[:] follow_nodes, split_i
     cdef int node_index = 0
 
     # accessing RaggedArray internal stuff to speed things up later
-    cdef np.uint32_t[:] edges = graph.edges.ravel()
-    cdef np.int64_t[:] node_to_n_edges = graph.edges._shape.lengths
-    cdef np.int64_t[:] node_to_edge_index = graph.edges._shape.starts
+    cdef const np.uint32_t[:] edges = graph.edges.ravel()
+    cdef const np.int64_t[:] node_to_n_edges = graph.edges._shape.lengths
+    cdef const np.int64_t[:] node_to_edge_index = graph.edges._shape.starts
 
-    cdef np.uint8_t[:] linear_nodes_index = graph.linear_ref_nodes_and_dummy_nodes_index
+    cdef const np.uint8_t[:] linear_nodes_index = graph.linear_ref_nodes_and_dummy_nodes_index
 
-    cdef np.uint32_t[:] next_nodes
+    cdef const np.uint32_t[:] next_nodes
     cdef int edge_i = 0
     cdef int next_node = -1
     cdef int j
@@ -81,3 +85,406 @@ def traverse_graph_by_following_nodes(graph, np.uint8_t[:] follow_nodes, split_i
         return nodes_found[0:node_index], chromosome_index_positions
 
     return nodes_found[0:node_index]
+
+
+def make_follow_mask(n_nodes, nodes_per_haplotype):
+    # Bit-packed follow mask for a batch of haplotypes: bit h % 8 of mask[node, h // 8] is set
+    # if haplotype h (index in nodes_per_haplotype) follows node
+    n_haplotypes = len(nodes_per_haplotype)
+    mask = np.zeros((n_nodes, (n_haplotypes + 7) // 8), dtype=np.uint8)
+    nodes = [np.asarray(haplotype_nodes, dtype=np.int64) for haplotype_nodes in nodes_per_haplotype]
+    haplotypes = np.repeat(np.arange(n_haplotypes), [len(haplotype_nodes) for haplotype_nodes in nodes])
+    if len(haplotypes) > 0:
+        np.bitwise_or.at(mask, (np.concatenate(nodes), haplotypes >> 3), (1 << (haplotypes & 7)).astype(np.uint8))
+    return mask
+
+
+def _make_var_node_index(var_nodes, n_nodes):
+    # CSR lookup from node to the variants having that node as variant node
+    var_nodes = np.asarray(var_nodes, dtype=np.int64)
+    variants = np.argsort(var_nodes, kind="stable").astype(np.int64)
+    starts = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(var_nodes, minlength=n_nodes)[:n_nodes], out=starts[1:])
+    return starts, variants
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline bint _has_variant_node(np.int64_t node, const np.int64_t[:] var_node_starts, const np.int64_t[:] var_node_variants,
+                                   const np.uint8_t[:, :] genotypes, np.int64_t individual, np.uint8_t allele_bit) noexcept nogil:
+    # genotypes are phased genotypes as in PhasedGenotypeMatrix: 2 means the first haplotype has the variant,
+    # 1 the second and 3 both (see util.phased_genotype_matrix_to_haplotype_matrix)
+    cdef np.int64_t i
+    for i in range(var_node_starts[node], var_node_starts[node + 1]):
+        if genotypes[var_node_variants[i], individual] & allele_bit:
+            return True
+    return False
+
+
+# Empty arrays given to the traversal kernel for the way of choosing nodes that is not used
+_no_follow_mask = np.zeros((1, 1), dtype=np.uint8)
+_no_var_node_index = (np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64))
+_no_genotypes = np.zeros((1, 1), dtype=np.uint8)
+cdef const np.int64_t[:] _no_var_node_starts = _no_var_node_index[0]
+cdef const np.int64_t[:] _no_var_node_variants = _no_var_node_index[1]
+cdef const np.uint8_t[:, :] _no_genotypes_view = _no_genotypes
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline bint _is_followed(np.int64_t node, np.int64_t haplotype, const np.uint8_t[:, :] follow_mask, bint use_genotypes,
+                              const np.int64_t[:] var_node_starts, const np.int64_t[:] var_node_variants,
+                              const np.uint8_t[:, :] genotypes) noexcept nogil:
+    # whether the haplotype follows the node: its bit in follow_mask (see make_follow_mask), or if use_genotypes is True,
+    # whether the haplotype has a variant with the node as variant node (haplotypes 2i and 2i+1 are individual i)
+    if use_genotypes:
+        return _has_variant_node(node, var_node_starts, var_node_variants, genotypes, haplotype // 2, 2 if haplotype % 2 == 0 else 1)
+    return (follow_mask[node, haplotype >> 3] & (1 << (haplotype & 7))) != 0
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef np.int64_t _follow_path(const np.uint32_t[:] edges, const np.int64_t[:] node_to_n_edges, const np.int64_t[:] node_to_edge_index,
+                             const np.uint8_t[:] linear_nodes_index, const np.uint8_t[:, :] follow_mask, bint use_genotypes,
+                             const np.int64_t[:] var_node_starts, const np.int64_t[:] var_node_variants, const np.uint8_t[:, :] genotypes,
+                             np.int64_t haplotype, np.int64_t start_node, np.uint32_t[:] out, np.int64_t out_start, bint write,
+                             np.int64_t max_length=0, np.int64_t *resume_node=NULL) noexcept nogil:
+    # Follows the path of one haplotype (see _is_followed) from start_node to a node without edges.
+    # Returns the number of nodes in the path, or -1 - node if no next node could be found from node.
+    # The nodes are written to out from out_start if write is True.
+    # If max_length > 0, at most max_length nodes are followed, and resume_node is set to the node to continue
+    # from (-1 if the path ended)
+    cdef np.int64_t current_node = start_node
+    cdef np.int64_t next_node, candidate, edge_i, n_edges, j
+    cdef np.int64_t length = 0
+
+    while True:
+        if write:
+            out[out_start + length] = current_node
+        length += 1
+
+        n_edges = node_to_n_edges[current_node]
+        if n_edges == 0:
+            if resume_node != NULL:
+                resume_node[0] = -1
+            return length
+
+        edge_i = node_to_edge_index[current_node]
+        if n_edges == 1:
+            next_node = edges[edge_i]
+        else:
+            next_node = -1
+            for j in range(n_edges):
+                candidate = edges[edge_i + j]
+                if _is_followed(candidate, haplotype, follow_mask, use_genotypes, var_node_starts, var_node_variants, genotypes) or \
+                        (next_node == -1 and linear_nodes_index[candidate] == 1):
+                    next_node = candidate
+
+            if next_node == -1:
+                return -1 - current_node
+
+        current_node = next_node
+        if length == max_length:
+            if resume_node != NULL:
+                resume_node[0] = current_node
+            return length
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _follow_paths(const np.uint32_t[:] edges, const np.int64_t[:] node_to_n_edges, const np.int64_t[:] node_to_edge_index,
+                        const np.uint8_t[:] linear_nodes_index, const np.uint8_t[:, :] follow_mask, bint use_genotypes,
+                        const np.int64_t[:] var_node_starts, const np.int64_t[:] var_node_variants, const np.uint8_t[:, :] genotypes,
+                        const np.int64_t[:] start_nodes, np.int64_t[:] lengths, np.uint32_t[:] out, const np.int64_t[:] out_starts,
+                        bint write, int n_threads) noexcept nogil:
+    # one task per haplotype and chromosome. Task i is haplotype i // n_chromosomes on chromosome i % n_chromosomes
+    cdef np.int64_t n_chromosomes = start_nodes.shape[0]
+    cdef np.int64_t task
+    for task in prange(lengths.shape[0], num_threads=n_threads, schedule="dynamic"):
+        lengths[task] = _follow_path(edges, node_to_n_edges, node_to_edge_index, linear_nodes_index, follow_mask, use_genotypes,
+                                     var_node_starts, var_node_variants, genotypes, task // n_chromosomes,
+                                     start_nodes[task % n_chromosomes], out, out_starts[task], write)
+
+
+def _traverse_paths(graph, n_haplotypes, follow_mask, use_genotypes, var_node_index, genotypes, n_threads, split_into_chromosomes):
+    # Traverses all haplotypes on all chromosomes with _follow_paths. The first pass finds the length of every path,
+    # so that the second pass can write the paths directly to the output
+    start_nodes = np.array(list(graph.chromosome_start_nodes.values()), dtype=np.int64)
+    n_chromosomes = len(start_nodes)
+    edges = graph.edges.ravel()
+    node_to_n_edges = graph.edges._shape.lengths
+    node_to_edge_index = graph.edges._shape.starts
+    linear_nodes_index = graph.linear_ref_nodes_and_dummy_nodes_index
+    var_node_starts, var_node_variants = var_node_index
+
+    lengths = np.zeros(n_haplotypes * n_chromosomes, dtype=np.int64)
+    out_starts = np.zeros(len(lengths), dtype=np.int64)
+    _follow_paths(edges, node_to_n_edges, node_to_edge_index, linear_nodes_index, follow_mask, use_genotypes, var_node_starts,
+                  var_node_variants, genotypes, start_nodes, lengths, np.zeros(0, dtype=np.uint32), out_starts, False, n_threads)
+
+    if np.any(lengths < 0):
+        task = np.flatnonzero(lengths < 0)[0]
+        raise Exception("Could not find next node from node %d for haplotype %d" % (-1 - lengths[task], task // n_chromosomes))
+
+    out_starts[1:] = np.cumsum(lengths)[:-1]
+    out = np.zeros(np.sum(lengths), dtype=np.uint32)
+    _follow_paths(edges, node_to_n_edges, node_to_edge_index, linear_nodes_index, follow_mask, use_genotypes, var_node_starts,
+                  var_node_variants, genotypes, start_nodes, lengths, out, out_starts, True, n_threads)
+
+    return _paths_to_ragged_array(out, lengths.reshape(n_haplotypes, n_chromosomes), split_into_chromosomes)
+
+
+def _paths_to_ragged_array(out, lengths, split_into_chromosomes):
+    # lengths is n_haplotypes x n_chromosomes, the paths in out are ordered by haplotype and then chromosome
+    paths = RaggedArray(out, np.sum(lengths, axis=1))
+    if split_into_chromosomes:
+        return paths, np.cumsum(lengths, axis=1) - lengths
+
+    return paths
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline bint _append_node(np.uint32_t **paths, np.int64_t *capacities, np.int64_t[:] path_lengths, np.int64_t haplotype,
+                              np.int64_t node) noexcept nogil:
+    # appends the node to the path of the haplotype, which is grown when it is full. Returns False if it could not be grown
+    cdef np.uint32_t *grown
+    if path_lengths[haplotype] == capacities[haplotype]:
+        grown = <np.uint32_t *> realloc(paths[haplotype], 2 * capacities[haplotype] * sizeof(np.uint32_t))
+        if grown == NULL:
+            return False
+        paths[haplotype] = grown
+        capacities[haplotype] *= 2
+    paths[haplotype][path_lengths[haplotype]] = node
+    path_lengths[haplotype] += 1
+    return True
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline np.int64_t _choose_next_node(const np.uint32_t[:] edges, const np.int64_t[:] node_to_n_edges, const np.int64_t[:] node_to_edge_index,
+                                         const np.uint8_t[:] linear_nodes_index, const np.uint8_t[:, :] follow_mask,
+                                         np.int64_t haplotype, np.int64_t node) noexcept nogil:
+    # next node of the haplotype after node, as in _follow_path. -1 if the node has no edges and -2 if no next node is found
+    cdef np.int64_t n_edges = node_to_n_edges[node]
+    cdef np.int64_t edge_i = node_to_edge_index[node]
+    cdef np.int64_t next_node = -1
+    cdef np.int64_t j, candidate
+    if n_edges == 0:
+        return -1
+    if n_edges == 1:
+        return edges[edge_i]
+    for j in range(n_edges):
+        candidate = edges[edge_i + j]
+        if _is_followed(candidate, haplotype, follow_mask, False, _no_var_node_starts, _no_var_node_variants, _no_genotypes_view) or \
+                (next_node == -1 and linear_nodes_index[candidate] == 1):
+            next_node = candidate
+    return next_node if next_node != -1 else -2
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _follow_paths_through_bubbles(const np.uint32_t[:] edges, const np.int64_t[:] node_to_n_edges, const np.int64_t[:] node_to_edge_index,
+                                       const np.uint8_t[:] linear_nodes_index, const np.uint8_t[:, :] follow_mask,
+                                       const np.uint32_t[:] ref_path, const np.int64_t[:] ref_positions, np.int64_t ref_start,
+                                       np.int64_t[:] positions, np.int64_t[:] group, np.int64_t[:] next_nodes,
+                                       np.uint32_t **paths, np.int64_t *capacities, np.int64_t[:] path_lengths) except -1:
+    # Follows all haplotypes in the follow mask on one chromosome, from the reference path node at ref_start, and
+    # appends the nodes to their paths. Haplotypes are kept together on the reference path (the path followed when no
+    # nodes are followed): positions has the position on the reference path where each haplotype is, or will get
+    # back to after a bubble (-1 when its path has ended). The group of haplotypes at the first of these positions
+    # is advanced together, so that the edges of the reference path node are read once for the whole group.
+    # A haplotype leaving the reference path is followed on its own through the bubble, until it is back on the
+    # reference path after the node where it left
+    cdef np.int64_t n_haplotypes = positions.shape[0]
+    cdef np.int64_t h, g, j, n_group, node, bubble_node, n_edges, edge_i, candidate, next_node, next_position
+    cdef np.int64_t position = ref_start if n_haplotypes > 0 else -1
+    cdef bint is_linear
+    for h in range(n_haplotypes):
+        positions[h] = ref_start
+
+    while position != -1:
+        # the group is found in the same pass as the first position of the other haplotypes
+        node = ref_path[position]
+        n_group = 0
+        next_position = -1
+        for h in range(n_haplotypes):
+            if positions[h] == position:
+                group[n_group] = h
+                n_group += 1
+                if not _append_node(paths, capacities, path_lengths, h, node):
+                    raise MemoryError()
+            elif positions[h] >= 0 and (next_position == -1 or positions[h] < next_position):
+                next_position = positions[h]
+
+        n_edges = node_to_n_edges[node]
+        edge_i = node_to_edge_index[node]
+        if n_edges == 0:
+            for g in range(n_group):
+                positions[group[g]] = -1
+            position = next_position
+            continue
+
+        for g in range(n_group):
+            next_nodes[g] = edges[edge_i] if n_edges == 1 else -1
+        if n_edges > 1:
+            for j in range(n_edges):
+                candidate = edges[edge_i + j]
+                is_linear = linear_nodes_index[candidate] == 1
+                for g in range(n_group):
+                    if _is_followed(candidate, group[g], follow_mask, False, _no_var_node_starts, _no_var_node_variants, _no_genotypes_view) or \
+                            (next_nodes[g] == -1 and is_linear):
+                        next_nodes[g] = candidate
+
+        for g in range(n_group):
+            h = group[g]
+            next_node = next_nodes[g]
+            if next_node == -1:
+                raise Exception("Could not find next node from node %d for haplotype %d" % (node, h))
+
+            while ref_positions[next_node] <= position:
+                # in a bubble
+                if not _append_node(paths, capacities, path_lengths, h, next_node):
+                    raise MemoryError()
+                bubble_node = next_node
+                next_node = _choose_next_node(edges, node_to_n_edges, node_to_edge_index, linear_nodes_index, follow_mask, h, bubble_node)
+                if next_node == -2:
+                    raise Exception("Could not find next node from node %d for haplotype %d" % (bubble_node, h))
+                if next_node == -1:
+                    break
+            if next_node == -1:
+                positions[h] = -1
+            else:
+                positions[h] = ref_positions[next_node]
+                if next_position == -1 or positions[h] < next_position:
+                    next_position = positions[h]
+
+        position = next_position
+    return 0
+
+
+def traverse_graph_by_following_nodes_batch(graph, const np.uint8_t[:, :] follow_mask, int n_haplotypes, split_into_chromosomes=False):
+    # Same traversal as traverse_graph_by_following_nodes, but for a batch of haplotypes given by a follow mask
+    # (see make_follow_mask). The haplotypes are kept together on the reference path and only followed one by one
+    # through the bubbles they choose (see _follow_paths_through_bubbles), and the paths are written in one pass.
+    # Returns a RaggedArray with one path per haplotype (and the start index of each chromosome in each path
+    # as a n_haplotypes x n_chromosomes array if split_into_chromosomes is True)
+    assert follow_mask.shape[1] * 8 >= n_haplotypes, "Follow mask has room for %d haplotypes" % (follow_mask.shape[1] * 8)
+    logging.info("Traversing %d haplotypes in batch" % n_haplotypes)
+    ref_path, ref_starts = _traverse_paths(graph, 1, np.zeros((len(graph.nodes), 1), dtype=np.uint8), False, _no_var_node_index,
+                                           _no_genotypes, 1, True)
+    ref_path = ref_path.ravel()
+    ref_positions = np.full(len(graph.nodes), -1, dtype=np.int64)
+    ref_positions[ref_path] = np.arange(len(ref_path))
+    ref_starts = ref_starts[0]
+
+    edges = graph.edges.ravel()
+    node_to_n_edges = graph.edges._shape.lengths
+    node_to_edge_index = graph.edges._shape.starts
+    linear_nodes_index = graph.linear_ref_nodes_and_dummy_nodes_index
+    positions = np.zeros(n_haplotypes, dtype=np.int64)
+    group = np.zeros(n_haplotypes, dtype=np.int64)
+    next_nodes = np.zeros(n_haplotypes, dtype=np.int64)
+    path_lengths = np.zeros(n_haplotypes, dtype=np.int64)
+    lengths = np.zeros((n_haplotypes, len(ref_starts)), dtype=np.int64)
+
+    # one growable buffer per haplotype, starting with room for the reference path
+    cdef np.uint32_t **paths = <np.uint32_t **> calloc(max(n_haplotypes, 1), sizeof(np.uint32_t *))
+    cdef np.int64_t *capacities = <np.int64_t *> calloc(max(n_haplotypes, 1), sizeof(np.int64_t))
+    cdef np.uint32_t[:] out_view
+    cdef np.int64_t h, out_start
+    if paths == NULL or capacities == NULL:
+        free(paths)
+        free(capacities)
+        raise MemoryError()
+    try:
+        for h in range(n_haplotypes):
+            capacities[h] = len(ref_path) + 16
+            paths[h] = <np.uint32_t *> malloc(capacities[h] * sizeof(np.uint32_t))
+            if paths[h] == NULL:
+                raise MemoryError()
+
+        for chromosome_index, ref_start in enumerate(ref_starts):
+            previous_lengths = path_lengths.copy()
+            _follow_paths_through_bubbles(edges, node_to_n_edges, node_to_edge_index, linear_nodes_index, follow_mask, ref_path,
+                                          ref_positions, ref_start, positions, group, next_nodes, paths, capacities, path_lengths)
+            lengths[:, chromosome_index] = path_lengths - previous_lengths
+
+        out = np.zeros(np.sum(path_lengths), dtype=np.uint32)
+        out_view = out
+        out_start = 0
+        for h in range(n_haplotypes):
+            if path_lengths[h] > 0:
+                memcpy(&out_view[out_start], paths[h], path_lengths[h] * sizeof(np.uint32_t))
+            out_start += path_lengths[h]
+    finally:
+        for h in range(n_haplotypes):
+            free(paths[h])
+        free(paths)
+        free(capacities)
+
+    return _paths_to_ragged_array(out, lengths, split_into_chromosomes)
+
+
+def traverse_many(graph, const np.uint8_t[:, :] follow_masks, int n_threads=1, n_haplotypes=None, split_into_chromosomes=False):
+    # Traverses all haplotypes in a bit-packed follow mask (see make_follow_mask), with the haplotypes and chromosomes
+    # split between n_threads threads. The GIL is released while traversing.
+    # Gives the same paths as traverse_graph_by_following_nodes_batch: A RaggedArray with one path per haplotype
+    # (and the start index of each chromosome in each path if split_into_chromosomes is True)
+    if n_haplotypes is None:
+        n_haplotypes = follow_masks.shape[1] * 8
+    assert follow_masks.shape[1] * 8 >= n_haplotypes, "Follow mask has room for %d haplotypes" % (follow_masks.shape[1] * 8)
+    logging.info("Traversing %d haplotypes on %d chromosomes using %d threads" % (n_haplotypes, len(graph.chromosome_start_nodes), n_threads))
+    return _traverse_paths(graph, n_haplotypes, follow_masks, False, _no_var_node_index, _no_genotypes, n_threads, split_into_chromosomes)
+
+
+def traverse_graph_in_chunks(graph, const np.uint8_t[:, :] follow_mask, int haplotype=0, int chunk_size=1000000):
+    # Yields (chromosome index, nodes) with the path of one haplotype in the follow mask (see make_follow_mask),
+    # chunk_size nodes at a time, so that the path can be processed while it is traversed
+    cdef const np.uint32_t[:] edges = graph.edges.ravel()
+    cdef const np.int64_t[:] node_to_n_edges = graph.edges._shape.lengths
+    cdef const np.int64_t[:] node_to_edge_index = graph.edges._shape.starts
+    cdef const np.uint8_t[:] linear_nodes_index = graph.linear_ref_nodes_and_dummy_nodes_index
+    cdef const np.int64_t[:] var_node_starts = _no_var_node_index[0]
+    cdef const np.int64_t[:] var_node_variants = _no_var_node_index[1]
+    cdef const np.uint8_t[:, :] no_genotypes = _no_genotypes
+    cdef np.int64_t current_node, length
+    cdef np.uint32_t[:] out_view
+
+    for chromosome_index, start_node in enumerate(graph.chromosome_start_nodes.values()):
+        current_node = start_node
+        while current_node != -1:
+            out = np.zeros(chunk_size, dtype=np.uint32)
+            out_view = out
+            with nogil:
+                length = _follow_path(edges, node_to_n_edges, node_to_edge_index, linear_nodes_index, follow_mask, False,
+                                      var_node_starts, var_node_variants, no_genotypes, haplotype, current_node, out_view, 0, True,
+                                      chunk_size, &current_node)
+            if length < 0:
+                raise Exception("Could not find next node from node %d for haplotype %d" % (-1 - length, haplotype))
+            yield chromosome_index, out[:length]
+
+
+def traverse_graph_by_following_genotypes(graph, variant_to_nodes, genotypes, int n_threads=1, split_into_chromosomes=False, var_node_index=None):
+    # Traverses the haplotypes of the individuals in a block of phased genotype matrix columns (n_variants x n_individuals,
+    # or a single column), choosing the variant node at each variant the haplotype has. Haplotypes 2i and 2i+1 are the
+    # haplotypes of individual i. Gives the same paths as traverse_graph_by_following_nodes with the variant nodes of each
+    # haplotype as follow nodes, without making any per-haplotype node lists or follow arrays.
+    # var_node_index can be given to avoid making it for every block (see traverse_genotype_matrix)
+    genotypes = np.asarray(genotypes, dtype=np.uint8)
+    if genotypes.ndim == 1:
+        genotypes = genotypes.reshape(-1, 1)
+    assert genotypes.shape[0] == len(variant_to_nodes.var_nodes), "Genotypes must have one row per variant"
+    if var_node_index is None:
+        var_node_index = _make_var_node_index(variant_to_nodes.var_nodes, len(graph.nodes))
+
+    return _traverse_paths(graph, genotypes.shape[1] * 2, _no_follow_mask, True, var_node_index, genotypes, n_threads, split_into_chromosomes)
+
+
+def traverse_genotype_matrix(graph, variant_to_nodes, genotype_matrix, int individuals_per_block=16, int n_threads=1):
+    # Yields (first haplotype, paths) for blocks of individuals in a phased genotype matrix, so that all
+    # individuals can be traversed with memory use given by the block size
+    var_node_index = _make_var_node_index(variant_to_nodes.var_nodes, len(graph.nodes))
+    for start in range(0, genotype_matrix.shape[1], individuals_per_block):
+        block = genotype_matrix[:, start:start + individuals_per_block]
+        yield start * 2, traverse_graph_by_following_genotypes(graph, variant_to_nodes, block, n_threads, var_node_index=var_node_index)
@@ -1,8 +1,11 @@
 from .variants import VcfVariants
 # Modifies a graph so that deletions/insertions has parallel dummy nodes
 import logging
+import numpy as np
 from itertools import product
 from .graph import Graph, VariantNotFoundException
+from .mutable_graph import MutableGraph, ArrayMutableGraph
+from .packed_sequences import PackedSequences
 
 
 class DummyNodeAdder:
@@ -18,7 +21,7 @@ class DummyNodeAdder:
     def create_new_graph_with_dummy_nodes(self, use_mutable_graph=None):
         if use_mutable_graph is None:
             logging.info("Creating a mutable graph that can be changed")
-            self.mutable_graph = self.graph.to_mutable_graph()
+            self.mutable_graph = ArrayMutableGraph.from_graph(self.graph)
         else:
             self.mutable_graph = use_mutable_graph
 
@@ -30,13 +33,7 @@ class DummyNodeAdder:
             if variant.type == "SNP" or variant.type == "SUBSTITUTION":
                 continue
 
-            try:
-                self._add_dummy_edges_around_indel(variant)
-            except VariantNotFoundException as e:
-                logging.error("Could not find variant: %s" % str(e))
-                self._n_variants_failed += 1
-                continue
-            self._n_variants_fixed += 1
+            self.add_dummy_nodes_for_indel(variant)
 
         logging.info("Creating a new immutable graph from the mutable graph")
         #print(self.mutable_graph.get_all_nodes())
@@ -45,13 +42,22 @@ class DummyNodeAdder:
         logging.info("%d variants were found and dummy nodes were added for these" % self._n_variants_fixed)
         return Graph.from_mutable_graph(self.mutable_graph)
 
+    def add_dummy_nodes_for_indel(self, variant):
+        try:
+            self._add_dummy_edges_around_indel(variant)
+        except VariantNotFoundException as e:
+            logging.error("Could not find variant: %s" % str(e))
+            self._n_variants_failed += 1
+            return
+        self._n_variants_fixed += 1
+
     def get_edge_mapping(self):
         return self._old_edges_to_new_node_mapping
 
     def get_nodes_for_inserted_sequence_at_ref_pos(self, variant):
         inserted_sequence = variant.get_inserted_sequence()
         node_before_inserted_nodes = self.graph.get_node_at_chromosome_and_chromosome_offset(variant.chromosome, variant.position-1)
-        inserted_nodes = self.mutable_graph.find_nodes_from_node_that_matches_sequence(node_before_inserted_nodes, inserted_sequence, variant.type, [], [])
+        inserted_nodes = self.mutable_graph.find_nodes_from_node_that_matches_sequence(node_before_inserted_nodes, inserted_sequence, variant.type, [], [], max_paths=10)
         if len(inserted_nodes) == 0:
             raise VariantNotFoundException("Could not find inserted nodes for sequence %s, variant %s. Node before is %d" % (inserted_sequence, variant, node_before_inserted_nodes))
 
@@ -136,9 +142,256 @@ class DummyNodeAdder:
             self.mutable_graph.add_edge(from_node, dummy_node)
 
         # For all unique to_nodes, add an edge from dummy node to to node
-        for to_node in set((to_node for from_node, to_node in edges)):
+        for to_node in sorted(set((to_node for from_node, to_node in edges))):
             #print("Adding node from dummy node %d to node %d" % (dummy_node, to_node))
             self.mutable_graph.add_edge(dummy_node, to_node)
 
         self.current_new_node_id += 1
 
+
+
+class _EdgeOverlay:
+    # The part of the MutableGraph interface that DummyNodeAdder uses, on top of the edge arrays of a Graph.
+    # Edge lists are copied from the graph when they are first looked up, and nodes with changed edge lists are recorded
+    def __init__(self, graph):
+        self._graph = graph
+        self._n_nodes = len(graph.nodes)
+        # rows are sliced from the flat arrays, which is much faster than indexing the RaggedArrays one row at a time
+        self._edges = (graph.edges.ravel(), graph.edges._shape.starts, graph.edges.lengths)
+        self._reverse_edges = (graph.reverse_edges.ravel(), graph.reverse_edges._shape.starts, graph.reverse_edges.lengths)
+        self.edges = {}
+        self.reverse_edges = {}
+        self.changed_nodes = set()
+
+    def _get_row(self, edges, node):
+        data, starts, lengths = edges
+        if node >= len(starts):
+            return []
+        return data[starts[node]:starts[node] + lengths[node]].tolist()
+
+    def get_edges(self, node):
+        if node not in self.edges:
+            self.edges[node] = self._get_row(self._edges, node)
+        return self.edges[node]
+
+    def get_nodes_before(self, node):
+        if node not in self.reverse_edges:
+            self.reverse_edges[node] = self._get_row(self._reverse_edges, node)
+        return self.reverse_edges[node]
+
+    def get_node_size(self, node):
+        if node >= self._n_nodes:
+            return 0
+        return int(self._graph.nodes[node])
+
+    def get_node_sequence(self, node):
+        if node >= self._n_nodes:
+            return ""
+        return self._graph.get_node_sequence(node)
+
+    def remove_edge(self, from_node, to_node):
+        self.get_edges(from_node).remove(to_node)
+        self.get_nodes_before(to_node).remove(from_node)
+        self.changed_nodes.add(from_node)
+
+    def add_edge(self, from_node, to_node):
+        self.get_edges(from_node).append(to_node)
+        self.get_nodes_before(to_node).append(from_node)
+        self.changed_nodes.add(from_node)
+
+    def add_node(self, id, sequence=""):
+        assert sequence == "", "Only empty nodes can be added"
+        self.edges[id] = []
+        self.reverse_edges[id] = []
+        self.changed_nodes.add(id)
+
+    find_nodes_from_node_that_matches_sequence = MutableGraph.find_nodes_from_node_that_matches_sequence
+
+
+def _unique_pairs(first, second, n):
+    # unique (first, second) pairs, sorted by first and then second
+    codes = np.unique(first.astype(np.int64) * n + second)
+    return codes // n, codes % n
+
+
+class ArrayDummyNodeAdder:
+    # Gives the same graph as DummyNodeAdder, but changes the edge arrays of the graph instead of going
+    # through a MutableGraph.
+    #
+    # Most indels are simple: the only path from the node at the variant position that matches the inserted (or
+    # deleted) sequence is one node. The dummy nodes of these are found for all indels at once from the nodes going
+    # into and out of the inserted node. Other indels, and indels close to other indels (which may change each
+    # other's edges), are processed one by one the way DummyNodeAdder does, on an overlay of the edges they change.
+    #
+    # Dummy nodes get ids after the last node in the order of the variants. The edge mapping (edges that were
+    # replaced by a dummy node) is kept as three arrays from_nodes, to_nodes, dummy_nodes
+    def __init__(self, graph, variants):
+        self.graph = graph
+        self.variants = variants
+        self._n_nodes = len(graph.nodes)
+        self._n_variants_failed = 0
+        self._n_variants_fixed = 0
+        self._edge_mapping = None
+
+    def get_edge_mapping(self):
+        return self._edge_mapping
+
+    def edge_mapping_to_file(self, file_name):
+        from_nodes, to_nodes, dummy_nodes = self._edge_mapping
+        np.savez(file_name, from_nodes=from_nodes, to_nodes=to_nodes, dummy_nodes=dummy_nodes)
+
+    @staticmethod
+    def edge_mapping_from_file(file_name):
+        data = np.load(file_name)
+        return data["from_nodes"], data["to_nodes"], data["dummy_nodes"]
+
+    def create_new_graph_with_dummy_nodes(self):
+        indels = np.array([i for i, variant in enumerate(self.variants) if variant.type != "SNP" and variant.type != "SUBSTITUTION"], dtype=np.int64)
+        inserted_nodes = self._find_simple_indels(indels)
+        is_simple = inserted_nodes >= 0
+        logging.info("Adding dummy nodes for %d simple indels" % np.sum(is_simple))
+        simple_dummy_edges = self._get_dummy_edges_for_simple_indels(indels[is_simple], inserted_nodes[is_simple])
+        logging.info("Adding dummy nodes for %d other indels one by one" % np.sum(~is_simple))
+        adder, overlay, dummy_variants = self._add_dummy_nodes_one_by_one(indels[~is_simple], self._n_nodes + 1 + len(simple_dummy_edges[0]))
+
+        if np.any(np.isin(simple_dummy_edges[2], list(overlay.changed_nodes))):
+            logging.info("Simple indels and other indels change the same edges, processing all indels one by one")
+            simple_dummy_edges = self._get_dummy_edges_for_simple_indels(indels[:0], inserted_nodes[:0])
+            adder, overlay, dummy_variants = self._add_dummy_nodes_one_by_one(indels, self._n_nodes + 1)
+
+        self._n_variants_failed += adder._n_variants_failed
+        self._n_variants_fixed += adder._n_variants_fixed
+        logging.info("%d variants were not found in graph" % self._n_variants_failed)
+        logging.info("%d variants were found and dummy nodes were added for these" % self._n_variants_fixed)
+        return self._make_graph(simple_dummy_edges, adder, overlay, dummy_variants)
+
+    def _find_simple_indels(self, indels):
+        # Returns the inserted node of each indel that is simple and not close to any other indel, -1 for other indels
+        inserted_nodes = np.full(len(indels), -1, dtype=np.int64)
+        variants = [self.variants[i] for i in indels]
+        chromosome_offsets = {chromosome: int(self.graph.get_ref_offset_at_node(node)) for chromosome, node in self.graph.chromosome_start_nodes.items()}
+        if len(variants) == 0 or any(variant.chromosome not in chromosome_offsets for variant in variants):
+            return inserted_nodes
+
+        # n is not the same as a in the mutable graphs, so only indels with ACGT sequences can be simple
+        inserted_sequences = [variant.get_inserted_sequence().upper() for variant in variants]
+        lengths = np.array([len(sequence) for sequence in inserted_sequences], dtype=np.int64)
+        sequence_starts = np.cumsum(lengths) - lengths
+        sequence_buffer = np.frombuffer("".join(inserted_sequences).encode(), dtype=np.uint8)
+        n_invalid_bases = np.cumsum(np.concatenate([[0], ~np.isin(sequence_buffer, np.frombuffer(b"ACGT", dtype=np.uint8))]))
+        is_acgt = n_invalid_bases[sequence_starts + lengths] == n_invalid_bases[sequence_starts]
+
+        # graph ref offset of the base before the indel, and of the base after the inserted/deleted sequence
+        starts = np.array([chromosome_offsets[variant.chromosome] + variant.position - 1 for variant in variants], dtype=np.int64)
+        ends = starts + lengths + 1
+        sorting = np.argsort(starts, kind="stable")
+        is_apart = np.ones(len(indels), dtype=bool)
+        is_apart[1:] = starts[sorting][1:] > np.maximum.accumulate(ends[sorting][:-1]) + 2
+        is_alone = np.zeros(len(indels), dtype=bool)
+        is_alone[sorting] = is_apart & np.append(is_apart[1:], True)
+
+        candidates = np.flatnonzero(is_alone & is_acgt & (lengths > 0) & (starts >= 0) & (starts < len(self.graph.ref_offset_to_node)))
+        if len(candidates) == 0:
+            return inserted_nodes
+
+        # simple indels have only one path from the node before matching the inserted sequence, with one node
+        paths = self.graph.find_nodes_from_nodes_that_match_sequences(self.graph.get_node_at_ref_offset(starts[candidates]),
+                                                                      [inserted_sequences[i] for i in candidates], max_paths=2)
+        for candidate, candidate_paths in zip(candidates, paths):
+            if len(candidate_paths) == 1 and len(candidate_paths[0]) == 1:
+                inserted_nodes[candidate] = candidate_paths[0][0]
+        return inserted_nodes
+
+    def _get_dummy_edges_for_simple_indels(self, indels, inserted_nodes):
+        # Returns the indels that got a dummy node, the edges into and out of the dummy nodes and the edges replaced by
+        # the dummy nodes. Dummy nodes are given as indexes in the indels that got a dummy node
+        has_dummy_node = (self.graph.reverse_edges.lengths[inserted_nodes] > 0) & (self.graph.edges.lengths[inserted_nodes] > 0)
+        for i in indels[~has_dummy_node]:
+            logging.warning("Not able to process variant %s" % self.variants[i])
+        self._n_variants_failed += int(np.sum(~has_dummy_node))
+        self._n_variants_fixed += int(np.sum(has_dummy_node))
+        indels = indels[has_dummy_node]
+        inserted_nodes = inserted_nodes[has_dummy_node]
+
+        nodes_in = self.graph.reverse_edges[inserted_nodes]
+        nodes_out = self.graph.edges[inserted_nodes]
+        in_dummies, in_nodes = _unique_pairs(np.repeat(np.arange(len(indels)), nodes_in.lengths), nodes_in.ravel(), self._n_nodes)
+        out_dummies, out_nodes = _unique_pairs(np.repeat(np.arange(len(indels)), nodes_out.lengths), nodes_out.ravel(), self._n_nodes)
+
+        # all edges from a node in to a node out of each dummy node, the ones in the graph are replaced
+        n_out = np.bincount(out_dummies, minlength=len(indels))
+        out_starts = np.cumsum(n_out) - n_out
+        bypass_dummies = np.repeat(in_dummies, n_out[in_dummies])
+        bypass_from = np.repeat(in_nodes, n_out[in_dummies])
+        bypass_to = out_nodes[np.repeat(out_starts[in_dummies] - np.cumsum(n_out[in_dummies]) + n_out[in_dummies], n_out[in_dummies]) + np.arange(len(bypass_dummies))]
+        is_edge = self.graph.has_edges(bypass_from, bypass_to)
+        bypass_dummies, bypass_from, bypass_to = bypass_dummies[is_edge], bypass_from[is_edge], bypass_to[is_edge]
+        # an edge is replaced by the first dummy node bypassing it
+        _, first = np.unique(bypass_from * self._n_nodes + bypass_to, return_index=True)
+        first = np.sort(first)
+
+        return indels, in_dummies, in_nodes, out_dummies, out_nodes, bypass_dummies[first], bypass_from[first], bypass_to[first]
+
+    def _add_dummy_nodes_one_by_one(self, indels, first_dummy_node):
+        # Returns the DummyNodeAdder and overlay used, and the variant of each dummy node added
+        overlay = _EdgeOverlay(self.graph)
+        adder = DummyNodeAdder(self.graph, self.variants)
+        adder.mutable_graph = overlay
+        adder.current_new_node_id = first_dummy_node
+        dummy_variants = []
+        for i in indels:
+            first_new_node = adder.current_new_node_id
+            adder.add_dummy_nodes_for_indel(self.variants[i])
+            dummy_variants.extend([i] * (adder.current_new_node_id - first_new_node))
+
+        return adder, overlay, np.array(dummy_variants, dtype=np.int64)
+
+    def _make_graph(self, simple_dummy_edges, adder, overlay, dummy_variants):
+        simple_indels, in_dummies, in_nodes, out_dummies, out_nodes, bypass_dummies, bypass_from, bypass_to = simple_dummy_edges
+        n_nodes = self._n_nodes
+        # dummy nodes have temporary ids after n_nodes (simple indels first), and get new ids in the order of the variants
+        dummy_variants = np.concatenate([simple_indels, dummy_variants])
+        n_dummy_nodes = len(dummy_variants)
+        new_ids = np.zeros(n_dummy_nodes, dtype=np.int64)
+        new_ids[np.argsort(dummy_variants, kind="stable")] = np.arange(n_dummy_nodes) + n_nodes + 1
+        to_new_id = np.concatenate([np.arange(n_nodes + 1), new_ids])
+        simple_dummy_nodes = np.arange(len(simple_indels)) + n_nodes + 1
+
+        # edges from the graph, except the replaced ones and the ones from nodes with edges changed in the overlay
+        from_nodes, to_nodes = self.graph.get_flat_edges()
+        ranks = np.arange(len(to_nodes)) - np.repeat(self.graph.edges._shape.starts, self.graph.edges.lengths)
+        is_kept = ~np.isin(from_nodes, list(overlay.changed_nodes))
+        is_kept &= ~np.isin(from_nodes.astype(np.int64) * n_nodes + to_nodes, bypass_from * n_nodes + bypass_to)
+
+        changed_nodes = sorted(overlay.changed_nodes)
+        changed_edges = [overlay.edges[node] for node in changed_nodes]
+        n_changed_edges = [len(edges) for edges in changed_edges]
+        changed_ranks = np.arange(sum(n_changed_edges)) - np.repeat(np.cumsum(n_changed_edges) - n_changed_edges, n_changed_edges)
+
+        # edges into dummy nodes of simple indels come after the other edges, in the order of the dummy nodes
+        from_nodes = np.concatenate([from_nodes[is_kept], np.repeat(changed_nodes, n_changed_edges), in_nodes, simple_dummy_nodes[out_dummies]]).astype(np.int64)
+        to_nodes = np.concatenate([to_nodes[is_kept], np.array([node for edges in changed_edges for node in edges], dtype=np.int64),
+                                   simple_dummy_nodes[in_dummies], out_nodes]).astype(np.int64)
+        ranks = np.concatenate([ranks[is_kept], changed_ranks, n_nodes + 1 + to_new_id[simple_dummy_nodes[in_dummies]],
+                                np.arange(len(out_dummies)) - np.searchsorted(out_dummies, out_dummies)])
+        from_nodes = to_new_id[from_nodes]
+        to_nodes = to_new_id[to_nodes]
+        sorting = np.lexsort((ranks, from_nodes))
+
+        edge_mapping = adder.get_edge_mapping()
+        mapping_dummy_nodes = to_new_id[np.concatenate([simple_dummy_nodes[bypass_dummies], np.array(list(edge_mapping.values()), dtype=np.int64)])]
+        mapping_sorting = np.argsort(mapping_dummy_nodes, kind="stable")
+        # edges replaced by dummy nodes of other indels can go from or to dummy nodes
+        mapping_edges = to_new_id[np.array(list(edge_mapping.keys()), dtype=np.int64).reshape(-1, 2)]
+        self._edge_mapping = (np.concatenate([bypass_from, mapping_edges[:, 0]])[mapping_sorting].astype(np.uint32),
+                              np.concatenate([bypass_to, mapping_edges[:, 1]])[mapping_sorting].astype(np.uint32),
+                              mapping_dummy_nodes[mapping_sorting].astype(np.uint32))
+
+        n_new_nodes = n_nodes + 1 + n_dummy_nodes if n_dummy_nodes > 0 else n_nodes
+        node_sizes = np.zeros(n_new_nodes, dtype=np.uint32)
+        node_sizes[:n_nodes] = self.graph.nodes
+        logging.info("Making new graph with %d dummy nodes" % n_dummy_nodes)
+        return Graph.from_arrays(np.arange(n_new_nodes), node_sizes, self.graph.get_numeric_node_sequences(np.arange(n_nodes)),
+                                 from_nodes[sorting], to_nodes[sorting], self.graph.ref_offset_to_node.nodes,
+                                 self.graph.chromosome_start_nodes, sequences_are_numeric=True,
+                                 pack_sequences=isinstance(self.graph.sequences, PackedSequences))
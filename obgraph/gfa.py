@@ -1,7 +1,8 @@
 import logging
-from .mutable_graph import MutableGraph
-from .graph import Graph
+from .graph import Graph, convert_byte_array_to_numeric
+from .cython_traversing import traverse_graph_in_chunks, make_follow_mask
 import numpy as np
+from npstructures import RaggedArray
 import pickle
 
 
@@ -36,53 +37,332 @@ def convert_gfa_ids_to_numeric(gfa_file_name, out_base_name):
         logging.info("Wrote id mapping to %s" % out_base_name + ".id_mapping")
 
 
-def create_graph_from_gfa_file(file_name):
+# Reading GFA files in chunks of whole lines. Each chunk is split into tab/space separated tokens with numpy,
+# and segments (S), links (L) and paths (P) are picked out by the record type of the line. Segment names are
+# kept as numeric ids if all names are integers, otherwise segments get ids 1, 2, ... in file order and links and
+# paths are mapped to these ids by sorting hashes of the names. The graph arrays are made directly from this.
 
-    graph = MutableGraph()
+_is_separator = np.zeros(256, dtype=bool)
+_is_separator[[ord("\t"), ord(" "), ord("\n"), ord("\r")]] = True
+_hash_multiplier = np.uint64(0x100000001b3)
 
-    path_lines = []
 
-    with open(file_name) as f:
-        for line in f:
-            l = line.split()
-            if line.startswith("S"):
-                id = int(l[1])
-                sequence = l[2]
-                graph.add_node(id, sequence)
-            elif line.startswith("L"):
-                from_node = int(l[1])
-                to_node = int(l[3])
+def _read_chunks(file_name, chunk_size):
+    # yields chunks of whole lines, all ending with a newline
+    with open(file_name, "rb") as f:
+        rest = []
+        while True:
+            chunk = f.read(chunk_size)
+            if len(chunk) == 0:
+                rest = b"".join(rest)
+                if len(rest) > 0:
+                    yield rest + b"\n"
+                return
 
-                if l[2] != "+" or l[4] != "+":
-                    logging.warning("Only links from positive side to positive side are supported. Found link with negative side")
+            last_newline = chunk.rfind(b"\n")
+            if last_newline == -1:
+                # a line longer than the chunk size
+                rest.append(chunk)
+                continue
 
-                if l[5] != "*":
-                    logging.warning("Overlaps between segments not supported. Segments %d-%d will be linked by edge"
-                                    % (from_node, to_node))
+            yield b"".join(rest + [chunk[:last_newline + 1]])
+            rest = [chunk[last_newline + 1:]]
 
-                graph.add_edge(from_node, to_node)
-            elif line.startswith("P"):
-                if not l[1].startswith("_alt"):
-                    path_lines.append(l)
 
-    #assert len(path_lines) == 1, "Supports only one path, which should be reference path. Found %d" % len(path_lines)
+def _get_ranges(starts, ends):
+    # all indexes from starts[i] to ends[i] after each other
+    lengths = ends - starts
+    return np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(np.sum(lengths))
+
+
+def _get_name_hashes(data, starts, ends):
+    assert np.all(ends > starts), "Found empty segment name"
+    lengths = ends - starts
+    indexes = _get_ranges(starts, ends)
+    powers = np.cumprod(np.concatenate([[1], np.full(np.max(lengths, initial=1) - 1, _hash_multiplier)]).astype(np.uint64))
+    values = data[indexes].astype(np.uint64) * powers[np.repeat(ends - 1, lengths) - indexes]
+    return np.add.reduceat(values, np.cumsum(lengths) - lengths) if len(values) > 0 else np.zeros(0, dtype=np.uint64)
+
+
+def _get_numeric_names(data, starts, ends):
+    # names as integers, or None if not all names are integers
+    lengths = ends - starts
+    indexes = _get_ranges(starts, ends)
+    digits = data[indexes].astype(np.int64) - ord("0")
+    if np.any(lengths > 18) or np.any((digits < 0) | (digits > 9)):
+        return None
+    powers = 10 ** np.arange(np.max(lengths, initial=1), dtype=np.int64)
+    values = digits * powers[np.repeat(ends - 1, lengths) - indexes]
+    return np.add.reduceat(values, np.cumsum(lengths) - lengths) if len(values) > 0 else np.zeros(0, dtype=np.int64)
+
+
+class GfaNames:
+    # Names of segments or the segments in links/paths. Kept as hashes, and also as integers as long as all are integers
+    def __init__(self):
+        self.hashes = []
+        self.numeric = []
+
+    def add(self, data, starts, ends):
+        self.hashes.append(_get_name_hashes(data, starts, ends))
+        if self.numeric is not None:
+            numeric = _get_numeric_names(data, starts, ends)
+            self.numeric = None if numeric is None else self.numeric + [numeric]
+
+    def get_hashes(self):
+        return np.concatenate(self.hashes + [np.zeros(0, dtype=np.uint64)])
+
+    def get_numeric(self):
+        return np.concatenate(self.numeric + [np.zeros(0, dtype=np.int64)])
+
+
+class GfaIdMap:
+    # Segment names of node ids 1, 2, ... (names[i] is the name of node i + 1)
+    def __init__(self, names):
+        self.names = names
+
+    def get_name(self, node):
+        return self.names[node - 1].tobytes().decode()
+
+    def get_nodes(self, names):
+        # node ids of the names, 0 for names that are not segments
+        encoded = [name.encode() for name in names]
+        ends = np.cumsum([len(name) for name in encoded], dtype=np.int64)
+        hashes = _get_name_hashes(np.frombuffer(b"".join(encoded), dtype=np.uint8), np.insert(ends[:-1], 0, 0), ends)
+        starts = self.names._shape.starts
+        segment_hashes = _get_name_hashes(self.names.ravel(), starts, starts + self.names.lengths)
+        nodes = _get_nodes_from_hashes(segment_hashes, np.arange(1, len(segment_hashes) + 1), hashes, check=False)
+        return np.array([node if node > 0 and self.get_name(node) == name else 0 for node, name in zip(nodes, names)], dtype=np.int64)
+
+    def to_file(self, file_name):
+        np.savez(file_name, names=self.names.ravel(), names_lengths=self.names.lengths)
+
+    @classmethod
+    def from_file(cls, file_name):
+        try:
+            data = np.load(file_name)
+        except FileNotFoundError:
+            data = np.load(file_name + ".npz")
+
+        return cls(RaggedArray(data["names"], data["names_lengths"]))
+
+
+def _get_nodes_from_hashes(segment_hashes, segment_ids, hashes, check=True):
+    sorting = np.argsort(segment_hashes, kind="stable")
+    sorted_hashes = segment_hashes[sorting]
+    assert not np.any(sorted_hashes[1:] == sorted_hashes[:-1]), "Segment names are duplicated or have the same hash"
+    index = np.minimum(np.searchsorted(sorted_hashes, hashes), max(len(sorted_hashes) - 1, 0))
+    is_found = sorted_hashes[index] == hashes if len(sorted_hashes) > 0 else np.zeros(len(hashes), dtype=bool)
+    if check:
+        assert np.all(is_found), "Links or paths refer to %d segments not in the gfa" % np.sum(~is_found)
+    return np.where(is_found, segment_ids[sorting][index], 0)
+
+
+def _get_tokens(data):
+    # start and end of each token, its line and its field index in the line, and the record type of each line
+    is_token = np.concatenate([[False], ~_is_separator[data], [False]])
+    changes = np.flatnonzero(is_token[1:] != is_token[:-1])
+    starts = changes[0::2]
+    ends = changes[1::2]
+    line_ends = np.flatnonzero(data == ord("\n"))
+    lines = np.searchsorted(line_ends, starts)
+    first_tokens = np.searchsorted(lines, np.arange(len(line_ends)))
+    fields = np.arange(len(starts)) - first_tokens[lines]
+
+    line_types = np.zeros(len(line_ends), dtype=np.uint8)
+    is_first = (fields == 0) & (ends - starts == 1)
+    line_types[lines[is_first]] = data[starts[is_first]]
+    return starts, ends, fields, line_types[lines]
+
+
+def create_graph_and_id_map_from_gfa_file(file_name, chunk_size=64 * 1024 * 1024):
+    # Returns the graph and a GfaIdMap, or None as id map if the segment names are integers (and used as node ids)
+    segment_names = GfaNames()
+    segment_name_bytes = []
+    segment_name_lengths = []
+    sequences = []
+    sequence_lengths = []
+    link_from = GfaNames()
+    link_to = GfaNames()
+    path_names = []
+    path_nodes = []
+    n_reverse_links = 0
+    n_overlap_links = 0
+
+    for i, chunk in enumerate(_read_chunks(file_name, chunk_size)):
+        data = np.frombuffer(chunk, dtype=np.uint8)
+        starts, ends, fields, types = _get_tokens(data)
+
+        # segments
+        is_segment = types == ord("S")
+        name_starts, name_ends = starts[is_segment & (fields == 1)], ends[is_segment & (fields == 1)]
+        sequence_starts, sequence_ends = starts[is_segment & (fields == 2)], ends[is_segment & (fields == 2)]
+        assert len(name_starts) == len(sequence_starts), "Found segment lines without a sequence"
+        segment_names.add(data, name_starts, name_ends)
+        segment_name_bytes.append(data[_get_ranges(name_starts, name_ends)])
+        segment_name_lengths.append(name_ends - name_starts)
+        # segments without sequence (*) are made empty
+        is_missing = (sequence_ends - sequence_starts == 1) & (data[sequence_starts] == ord("*"))
+        sequence_ends[is_missing] = sequence_starts[is_missing]
+        sequences.append(convert_byte_array_to_numeric(data[_get_ranges(sequence_starts, sequence_ends)]))
+        sequence_lengths.append(sequence_ends - sequence_starts)
+
+        # links
+        is_link = types == ord("L")
+        link_fields = [(starts[is_link & (fields == field)], ends[is_link & (fields == field)]) for field in range(1, 6)]
+        assert all(len(field_starts) == len(link_fields[0][0]) for field_starts, _ in link_fields), "Found link lines with missing fields"
+        link_from.add(data, *link_fields[0])
+        link_to.add(data, *link_fields[2])
+        n_reverse_links += np.sum((data[link_fields[1][0]] != ord("+")) | (data[link_fields[3][0]] != ord("+")))
+        overlap_starts, overlap_ends = link_fields[4]
+        n_overlap_links += np.sum((overlap_ends - overlap_starts > 1) | (data[overlap_starts] != ord("*")))
+
+        # paths, one at a time since there are few of them
+        is_path = types == ord("P")
+        for name_start, name_end, nodes_start, nodes_end in zip(starts[is_path & (fields == 1)], ends[is_path & (fields == 1)],
+                                                                starts[is_path & (fields == 2)], ends[is_path & (fields == 2)]):
+            path_name = chunk[name_start:name_end].decode()
+            if path_name.startswith("_alt"):
+                continue
+
+            commas = np.flatnonzero(data[nodes_start:nodes_end] == ord(",")) + nodes_start
+            element_ends = np.append(commas, nodes_end)
+            if np.any(data[element_ends - 1] != ord("+")):
+                logging.warning("Path %s has segments in reverse orientation. Orientations are ignored" % path_name)
+            nodes = GfaNames()
+            nodes.add(data, np.insert(commas + 1, 0, nodes_start), element_ends - 1)
+            path_names.append(path_name)
+            path_nodes.append(nodes)
+
+        logging.info("Read chunk %d with %d segments, %d links and %d paths" % (i, len(name_starts), len(link_fields[0][0]), np.sum(is_path & (fields == 0))))
+
+    if n_reverse_links > 0:
+        logging.warning("Only links from positive side to positive side are supported. Found %d links with negative side" % n_reverse_links)
+    if n_overlap_links > 0:
+        logging.warning("Overlaps between segments not supported. %d links with overlaps are made into edges" % n_overlap_links)
+
+    all_names = [segment_names, link_from, link_to] + path_nodes
+    if all(names.numeric is not None for names in all_names):
+        # segment 0 is used as node 0 (convert_gfa_ids_to_numeric numbers segments from 0)
+        logging.info("Segment names are integers and used as node ids")
+        id_map = None
+        node_ids = segment_names.get_numeric()
+        is_segment = np.zeros(np.max(node_ids, initial=0) + 1, dtype=bool)
+        is_segment[node_ids] = True
+        get_nodes = lambda names: names.get_numeric()
+        for names in all_names[1:]:
+            nodes = names.get_numeric()
+            assert np.all(nodes < len(is_segment)) and np.all(is_segment[nodes]), "Links or paths refer to segments not in the gfa"
+    else:
+        logging.info("Segment names are not integers. Giving segments ids in the order they are in the gfa")
+        node_ids = np.arange(1, len(segment_names.get_hashes()) + 1)
+        id_map = GfaIdMap(RaggedArray(np.concatenate(segment_name_bytes), np.concatenate(segment_name_lengths)))
+        segment_hashes = segment_names.get_hashes()
+        get_nodes = lambda names: _get_nodes_from_hashes(segment_hashes, node_ids, names.get_hashes())
 
-    # find reference node from path
     linear_ref_nodes = []
     chromosome_start_nodes = {}
-    for path_line in path_lines:
-        path_name = path_line[1]
-        logging.info("Processing path %s" % path_name)
-        nodes = path_line[2].split(",")
-        nodes = [int(node.replace("+", "")) for node in nodes]
-        chromosome_start_nodes[path_name] = nodes[0]
-        linear_ref_nodes.extend(nodes)
-        logging.info("There are %d linear ref nodes in path %s"  % (len(nodes), path_name))
-
-    graph.set_linear_ref_nodes(linear_ref_nodes)
-    graph.chromosome_start_nodes = chromosome_start_nodes
+    for path_name, names in zip(path_names, path_nodes):
+        nodes = get_nodes(names)
+        chromosome_start_nodes[path_name] = int(nodes[0])
+        linear_ref_nodes.append(nodes)
+        logging.info("There are %d linear ref nodes in path %s" % (len(nodes), path_name))
 
+    graph = Graph.from_arrays(node_ids, np.concatenate(sequence_lengths), np.concatenate(sequences), get_nodes(link_from),
+                              get_nodes(link_to), np.concatenate(linear_ref_nodes + [np.zeros(0, dtype=np.int64)]),
+                              chromosome_start_nodes, sequences_are_numeric=True)
     logging.info("Chromosome start nodes: %s" % graph.chromosome_start_nodes)
-    return Graph.from_mutable_graph(graph)
+    return graph, id_map
+
+
+def create_graph_from_gfa_file(file_name, chunk_size=64 * 1024 * 1024):
+    return create_graph_and_id_map_from_gfa_file(file_name, chunk_size)[0]
+
 
+# Writing GFA files. Lines are made for many nodes/edges at a time as one byte array, so that only one chunk of
+# the output is in memory. Empty nodes with edges (dummy nodes) are written with * as sequence, which
+# create_graph_from_gfa_file reads back as empty nodes
 
+def _get_ascii_integers(values):
+    # the decimal digits of all the values after each other, and the number of digits of each value
+    values = np.asarray(values, dtype=np.int64)
+    n_digits = np.ones(len(values), dtype=np.int64)
+    for power in range(1, 19):
+        n_digits += values >= 10 ** power
+    ends = np.cumsum(n_digits)
+    digits = np.empty(ends[-1] if len(values) > 0 else 0, dtype=np.uint8)
+    for power in range(np.max(n_digits, initial=0)):
+        has_digit = n_digits > power
+        digits[ends[has_digit] - 1 - power] = ord("0") + (values[has_digit] // 10 ** power) % 10
+    return digits, n_digits
+
+
+def _join_fields(fields, n_rows):
+    # One row per element with the fields after each other. A field is either bytes (the same in all rows)
+    # or a flat uint8 array and the length of the field in each row
+    fields = [(np.tile(np.frombuffer(field, dtype=np.uint8), n_rows), np.full(n_rows, len(field), dtype=np.int64))
+              if isinstance(field, bytes) else field for field in fields]
+    row_lengths = np.sum([lengths for _, lengths in fields], axis=0, dtype=np.int64)
+    field_starts = np.cumsum(row_lengths) - row_lengths
+    out = np.empty(np.sum(row_lengths), dtype=np.uint8)
+    for data, lengths in fields:
+        out[_get_ranges(field_starts, field_starts + lengths)] = data
+        field_starts = field_starts + lengths
+    return out
+
+
+def _get_blocks(costs, chunk_size):
+    # splits elements into blocks of consecutive elements with about chunk_size total cost
+    cumulative_costs = np.cumsum(costs, dtype=np.int64)
+    total = cumulative_costs[-1] if len(costs) > 0 else 0
+    ends = np.searchsorted(cumulative_costs, np.arange(chunk_size, total + chunk_size, chunk_size), side="left") + 1
+    ends = np.unique(np.minimum(ends, len(costs)))
+    return zip(np.insert(ends[:-1], 0, 0), ends)
+
+
+def write_gfa(graph, file_name, chunk_size=64 * 1024 * 1024):
+    # chunk_size is approximately the number of bytes of the gfa that are made at a time
+    from_nodes, to_nodes = graph.get_flat_edges()
+    has_edges = np.zeros(len(graph.nodes), dtype=bool)
+    has_edges[from_nodes] = True
+    has_edges[to_nodes] = True
+    node_ids = np.flatnonzero((graph.nodes > 0) | has_edges)
+    node_ids = node_ids[node_ids > 0]
+
+    with open(file_name, "wb") as f:
+        f.write(b"H\tVN:Z:1.0\n")
+
+        node_sizes = graph.nodes[node_ids].astype(np.int64)
+        for start, end in _get_blocks(node_sizes + 16, chunk_size):
+            nodes = node_ids[start:end]
+            sizes = node_sizes[start:end]
+            is_empty = (sizes == 0).astype(np.int64)
+            sequences = graph.get_nodes_sequence_array(nodes)
+            _join_fields([b"S\t", _get_ascii_integers(nodes), b"\t", (sequences, sizes),
+                          (np.full(np.sum(is_empty), ord("*"), dtype=np.uint8), is_empty), b"\n"], len(nodes)).tofile(f)
+        logging.info("Wrote %d segments" % len(node_ids))
+
+        for start, end in _get_blocks(np.full(len(to_nodes), 32), chunk_size):
+            _join_fields([b"L\t", _get_ascii_integers(from_nodes[start:end]), b"\t+\t",
+                          _get_ascii_integers(to_nodes[start:end]), b"\t+\t*\n"], end - start).tofile(f)
+        logging.info("Wrote %d links" % len(to_nodes))
+
+        # the path of a chromosome is the reference path from its start node, which also goes through the
+        # empty dummy nodes between linear ref nodes (these are not in the linear ref index)
+        reference_follow_mask = make_follow_mask(len(graph.nodes), [[]])
+        chromosomes = list(graph.chromosome_start_nodes.keys())
+        path_lengths = np.zeros(len(chromosomes), dtype=np.int64)
+        for chromosome_index, nodes in traverse_graph_in_chunks(graph, reference_follow_mask, chunk_size=max(chunk_size // 16, 1)):
+            if len(nodes) == 0:
+                continue
+            if path_lengths[chromosome_index] == 0:
+                if chromosome_index > 0:
+                    f.write(b"\t*\n")
+                f.write(("P\t%s\t" % chromosomes[chromosome_index]).encode())
+            else:
+                f.write(b",")
+            _join_fields([_get_ascii_integers(nodes), b"+,"], len(nodes))[:-1].tofile(f)
+            path_lengths[chromosome_index] += len(nodes)
+        if len(chromosomes) > 0:
+            f.write(b"\t*\n")
+        for chromosome, path_length in zip(chromosomes, path_lengths):
+            logging.info("Wrote path %s with %d nodes" % (chromosome, path_length))
@@ -5,12 +5,17 @@ import re
 import numpy as np
 from .variants import VcfVariants
 from collections import defaultdict
-from .mutable_graph import MutableGraph
+from .mutable_graph import MutableGraph, ArrayMutableGraph
+from .sequence_search import find_paths_matching_sequence, find_paths_matching_sequences
 from dataclasses import dataclass
 from npstructures import RaggedArray, HashTable
 from shared_memory_wrapper import to_file, from_file
 from .nplist import NpList
 from .util import encode_chromosome
+from .linear_ref_index import LinearRefIndex
+from .packed_sequences import PackedSequences
+from .index_cache import fingerprint_arrays
+from .graph_file import write_native_graph, read_native_graph, is_native_graph_file, write_sharded_graph, ShardedGraph
 
 
 class VariantNotFoundException(Exception):
@@ -34,30 +39,61 @@ def convert_sequence_array_to_numeric(sequence):
     to_values = np.array([0, 1, 2, 3, 0, 1, 2, 3], dtype=np.uint64)
     return remap_array(sequences_as_byte_values, from_values, to_values).astype(np.uint8)
 
+def _make_byte_to_numeric_lookup():
+    # same mapping as convert_sequence_array_to_numeric, for all byte values it accepts
+    byte_values = np.arange(117, dtype=np.uint8)
+    lookup = np.zeros(256, dtype=np.uint8)
+    lookup[:117] = remap_array(byte_values.view(np.int8), np.array([65, 67, 71, 84, 97, 99, 103, 116], dtype=np.uint64),
+                               np.array([0, 1, 2, 3, 0, 1, 2, 3], dtype=np.uint64))
+    return lookup
+
+
+_byte_to_numeric = _make_byte_to_numeric_lookup()
+
+
+def convert_byte_array_to_numeric(sequence, out=None):
+    # sequence is a uint8 array of ascii values. out can be sequence itself to convert in place
+    if len(sequence) > 0 and np.max(sequence) > 116:
+        logging.error("Invalid byte values in sequence. Max value: %d" % np.max(sequence))
+        raise IndexError("Invalid byte value %d in sequence" % np.max(sequence))
+    # indexes are checked above, mode="clip" makes take write directly to out instead of buffering
+    return np.take(_byte_to_numeric, sequence, out=out, mode="clip")
+
+
 numeric_to_letter_sequence = np.array(["A", "C", "G", "T"])
+# byte lookup table from numeric base to ascii
+numeric_to_ascii = np.frombuffer(b"ACGT", dtype=np.uint8)
 
 class Graph:
+    # the attributes the fingerprint is made from. Assigning one of them clears the fingerprint, but arrays (and the
+    # chromosome_start_nodes dict) must not be changed in place after the fingerprint is made
+    _fingerprint_attributes = {"nodes", "edges", "sequences", "node_to_ref_offset", "ref_offset_to_node", "chromosome_start_nodes"}
+
     def __init__(self, nodes,
                  sequences: RaggedArray,
                  edges: RaggedArray,
                  node_to_ref_offset=None, ref_offset_to_node=None, chromosome_start_nodes=None, allele_frequencies=None, linear_ref_nodes_index=None,
-                 numeric_node_sequences=None, linear_ref_nodes_and_dummy_nodes_index=None):
+                 numeric_node_sequences=None, linear_ref_nodes_and_dummy_nodes_index=None, reverse_edges=None):
         assert chromosome_start_nodes is None or isinstance(chromosome_start_nodes, dict), "Chromosome start nodes must be None or a dict from chromosome to start node"
         self.nodes = nodes
         self.edges = edges
         self.sequences = sequences
 
         self.node_to_ref_offset = node_to_ref_offset
+        if isinstance(ref_offset_to_node, np.ndarray):
+            # graphs written by older versions store one node per linear ref base
+            ref_offset_to_node = LinearRefIndex.from_ref_offset_to_node(ref_offset_to_node)
         self.ref_offset_to_node = ref_offset_to_node
         self._linear_ref_nodes_cache = None
         self.chromosome_start_nodes = chromosome_start_nodes
         self.allele_frequencies = allele_frequencies
         self.numeric_node_sequences = numeric_node_sequences
+        self._reverse_edges = reverse_edges
 
         if self.nodes is not None and linear_ref_nodes_index is None:
             logging.info("Makng a linear ref lookup, since it is not provided")
             self.linear_ref_nodes_index = np.zeros(len(self.nodes), dtype=np.uint8)
-            self.linear_ref_nodes_index[np.array(list(self.linear_ref_nodes()))] = 1
+            self.linear_ref_nodes_index[self.ref_offset_to_node.nodes] = 1
             logging.info("Done making linear ref nodes index")
         else:
             self.linear_ref_nodes_index = linear_ref_nodes_index
@@ -113,10 +149,18 @@ class Graph:
         nodes = {node: self.get_node_size(node) for node in all_nodes}
         node_sequences = {node: self.get_node_sequence(node) for node in all_nodes}
         edges = {node: list(self.get_edges(node)) for node in all_nodes}
-        return MutableGraph(nodes, node_sequences, edges, list(self.linear_ref_nodes()), self.node_to_ref_offset, self.ref_offset_to_node, self.chromosome_start_nodes, self.allele_frequencies)
+        # linear ref nodes in the order they are on the linear reference (linear_ref_nodes() gives a set)
+        linear_ref_nodes = [int(node) for node in self.ref_offset_to_node.nodes]
+        return MutableGraph(nodes, node_sequences, edges, linear_ref_nodes, self.node_to_ref_offset, self.ref_offset_to_node, self.chromosome_start_nodes, self.allele_frequencies)
 
     @classmethod
     def from_mutable_graph(cls, mutable_graph):
+        if isinstance(mutable_graph, ArrayMutableGraph):
+            # faster than going through the dicts
+            node_ids, node_sizes, sequences, from_nodes, to_nodes = mutable_graph.to_arrays()
+            return cls.from_arrays(node_ids, node_sizes, sequences, from_nodes, to_nodes, mutable_graph.linear_ref_nodes,
+                                   mutable_graph.chromosome_start_nodes)
+
         return cls.from_dicts(mutable_graph.node_sequences, mutable_graph.edges, mutable_graph.linear_ref_nodes,
                               mutable_graph.chromosome_start_nodes)
 
@@ -137,7 +181,7 @@ class Graph:
         return self.get_node_sequence(node)[int(start):int(end)]
 
     def get_node_sequence(self, node):
-        return ''.join(numeric_to_letter_sequence[self.sequences[node]])
+        return numeric_to_ascii[self.sequences[node]].tobytes().decode()
 
     def max_node_id(self):
         return len(self.nodes)-1
@@ -177,14 +221,39 @@ class Graph:
     def get_nodes_sequences2(self, nodes):
         raise NotImplementedError("Use get_nodes_sequences instead")
 
-    def get_nodes_sequence(self, nodes):
-        # todo: This is slow, should be fixed
-        sequences = []
+    def get_nodes_sequence_array(self, nodes, numeric=False):
+        # Sequence of all nodes after each other as a uint8 array, either numeric (0-3) or ascii
+        numeric_sequence = self.get_numeric_node_sequences(np.asarray(nodes, dtype=np.int64))
+        if numeric:
+            return numeric_sequence
+        return numeric_to_ascii[numeric_sequence]
 
-        for node in nodes:
-            sequences.extend(self.get_node_sequence(node))
+    def get_nodes_sequence(self, nodes):
+        return self.get_nodes_sequence_array(nodes).tobytes().decode()
+
+    def get_nodes_sequence_chunks(self, nodes, chunk_size=10000000, numeric=False):
+        # Yields the sequence of the nodes as uint8 arrays of chunk_size bases (the last chunk may be shorter),
+        # so that a path can be written without ever having the whole sequence in memory
+        nodes = np.asarray(nodes, dtype=np.int64)
+        cumulative_sizes = np.cumsum(self.nodes[nodes], dtype=np.int64)
+        total_size = cumulative_sizes[-1] if len(nodes) > 0 else 0
+        # decode nodes in blocks that end where each chunk ends
+        block_ends = np.searchsorted(cumulative_sizes, np.arange(chunk_size, total_size + chunk_size, chunk_size), side="left") + 1
+        carry = np.zeros(0, dtype=np.uint8)
+        block_start = 0
+        for block_end in block_ends:
+            block_end = min(block_end, len(nodes))
+            if block_end <= block_start:
+                continue
+            sequence = np.concatenate([carry, self.get_nodes_sequence_array(nodes[block_start:block_end], numeric)])
+            n_full = len(sequence) // chunk_size * chunk_size
+            for chunk_start in range(0, n_full, chunk_size):
+                yield sequence[chunk_start:chunk_start + chunk_size]
+            carry = sequence[n_full:]
+            block_start = block_end
 
-        return ''.join(sequences)
+        if len(carry) > 0:
+            yield carry
 
     def get_node_offset_at_chromosome_and_chromosome_offset(self, chromosome, offset):
         #chromosome_position = chromosome - 1
@@ -221,18 +290,17 @@ class Graph:
 
 
     def get_linear_ref_nodes_between_offsets(self, chromosome, start_offset, end_offset):
-        # todo
-        chromosome_position = chromosome - 1
+        # chromosome_start_nodes is a dict from chromosome to start node
         try:
-            chromosome_start_node = self.chromosome_start_nodes[chromosome_position]
-        except IndexError:
+            chromosome_start_node = self.chromosome_start_nodes[chromosome]
+        except KeyError:
             logging.error(
-                "Could not find chromosome start position for chromosome %d. Chromosome start nodes are %s" % (
+                "Could not find chromosome start position for chromosome %s. Chromosome start nodes are %s" % (
                 chromosome, self.chromosome_start_nodes))
             raise
 
         chromosome_offset = self.get_ref_offset_at_node(chromosome_start_node)
-        return np.unique(self.ref_offset_to_node[int(chromosome_offset+start_offset):int(chromosome_offset+end_offset)])
+        return np.unique(self.ref_offset_to_node.get_nodes_between_offsets(int(chromosome_offset+start_offset), int(chromosome_offset+end_offset)))
 
     def get_edges(self, node):
         if node >= len(self.edges):
@@ -244,19 +312,48 @@ class Graph:
         if self._linear_ref_nodes_cache is not None:
             return self._linear_ref_nodes_cache
         else:
-            nodes = set(np.unique(self.ref_offset_to_node))
+            nodes = set(np.unique(self.ref_offset_to_node.nodes))
             self._linear_ref_nodes_cache = nodes
             return nodes
 
+    def get_flat_edges(self):
+        # returns two arrays from_nodes, to_nodes with one element per edge (sorted by from node)
+        from_nodes = np.repeat(np.arange(len(self.edges), dtype=np.uint32), self.edges.lengths)
+        return from_nodes, self.edges.ravel()
+
+    def has_edges(self, from_nodes, to_nodes):
+        # vectorized check of whether there is an edge from_nodes[i] -> to_nodes[i].
+        # Edges are encoded as from_node * n_nodes + to_node and looked up among all edges, sorted
+        from_nodes = np.asarray(from_nodes, dtype=np.uint64)
+        to_nodes = np.asarray(to_nodes, dtype=np.uint64)
+        all_from_nodes, all_to_nodes = self.get_flat_edges()
+        if len(all_from_nodes) == 0:
+            return np.zeros(len(from_nodes), dtype=bool)
+
+        n_nodes = np.uint64(len(self.nodes))
+        edge_codes = np.sort(all_from_nodes.astype(np.uint64) * n_nodes + all_to_nodes)
+        query_codes = from_nodes * n_nodes + to_nodes
+        index = np.minimum(np.searchsorted(edge_codes, query_codes), len(edge_codes) - 1)
+        return edge_codes[index] == query_codes
+
     def make_linear_ref_node_and_ref_dummy_node_index(self):
-        linear_ref_nodes_and_dummy_nodes_index = np.zeros(len(self.linear_ref_nodes_index), dtype=np.uint8)
-        for node in range(len(linear_ref_nodes_and_dummy_nodes_index)):
-            if node % 100000 == 0:
-                logging.info("%d nodes processed" % node)
+        # Same as calling is_linear_ref_node_or_linear_ref_dummy_node for every node, but done on all edges at once:
+        # An empty node is a linear ref dummy node if it has an edge to a linear ref node and
+        # the linear ref node just before that node has an edge to the empty node
+        linear_ref_nodes_and_dummy_nodes_index = (self.linear_ref_nodes_index != 0).astype(np.uint8)
 
-            if self.is_linear_ref_node_or_linear_ref_dummy_node(node):
-                linear_ref_nodes_and_dummy_nodes_index[node] = 1
+        from_nodes, to_nodes = self.get_flat_edges()
+        is_candidate = (self.nodes[from_nodes] == 0) & (self.linear_ref_nodes_index[to_nodes] != 0)
+        dummy_nodes = from_nodes[is_candidate]
+        next_ref_nodes = to_nodes[is_candidate]
+        logging.info("Checking %d edges from empty nodes to linear ref nodes" % len(dummy_nodes))
 
+        previous_ref_nodes = self.get_node_at_ref_offset(self.node_to_ref_offset[next_ref_nodes].astype(np.int64) - 1)
+
+        has_edge = self.has_edges(previous_ref_nodes, dummy_nodes)
+
+        linear_ref_nodes_and_dummy_nodes_index[dummy_nodes[has_edge]] = 1
+        logging.info("Found %d linear ref dummy nodes" % len(np.unique(dummy_nodes[has_edge])))
         self.linear_ref_nodes_and_dummy_nodes_index = linear_ref_nodes_and_dummy_nodes_index
 
     def is_linear_ref_node_or_linear_ref_dummy_node(self, node):
@@ -309,16 +406,40 @@ class Graph:
         return self.get_ref_offset_at_node(node) - chromosome_offset
 
     def get_node_offset_at_ref_offset(self, ref_offset):
-        node = self.get_node_at_ref_offset(ref_offset)
-        offset_at_node = self.get_ref_offset_at_node(node)
-        return ref_offset - offset_at_node
+        # ref_offset can be a single offset or an array of offsets
+        return self.ref_offset_to_node.get_node_offset_at_ref_offset(ref_offset)
 
-    def to_file(self, file_name):
+    def to_file(self, file_name, native=False):
+        # native=True writes a directory of raw arrays that can be memory-mapped by from_file
+        if native:
+            return write_native_graph(self, file_name)
         return to_file(self, file_name)
 
     @classmethod
-    def from_file(cls, file_name):
-        return from_file(file_name)
+    def from_file(cls, file_name, mmap=False):
+        # Graphs in the native format are detected automatically. With mmap=True, the arrays
+        # are read-only memory-mapped views of the files instead of being read into memory
+        if is_native_graph_file(file_name):
+            return read_native_graph(file_name, mmap=mmap)
+        graph = from_file(file_name)
+        # objects are unpickled without calling __init__, so graphs written by older versions need to be upgraded here
+        if isinstance(graph.ref_offset_to_node, np.ndarray):
+            graph.ref_offset_to_node = LinearRefIndex.from_ref_offset_to_node(graph.ref_offset_to_node)
+        return graph
+
+    def to_sharded_file(self, directory):
+        # Writes one native graph shard per chromosome, so that single chromosomes can be loaded with Graph.open
+        return write_sharded_graph(self, directory)
+
+    def to_gfa(self, file_name, chunk_size=64 * 1024 * 1024):
+        # Writes segments, links and one path with the linear ref nodes of each chromosome
+        from .gfa import write_gfa
+        return write_gfa(self, file_name, chunk_size)
+
+    @classmethod
+    def open(cls, file_name, mmap=True):
+        # Returns a ShardedGraph. Use .chromosome(name) on this to get a Graph with only that chromosome
+        return ShardedGraph(file_name, mmap=mmap)
 
     def get_flat_graph(self):
         node_ids = list(np.where(self.nodes > 0)[0])
@@ -338,71 +459,88 @@ class Graph:
         return node_ids, node_sequences, node_sizes, from_nodes, to_nodes, linear_ref_nodes, self.chromosome_start_nodes
 
     @classmethod
-    def from_dicts(cls, node_sequences, edges, linear_ref_nodes, chromosome_start_nodes=None):
+    def from_dicts(cls, node_sequences, edges, linear_ref_nodes, chromosome_start_nodes=None, pack_sequences=False):
+        # if pack_sequences is True, node sequences are stored with 2 bits per base (see PackedSequences)
         assert linear_ref_nodes is not None
         logging.info("Making graph from dicts")
-        nodes = np.sort(list(node_sequences.keys())).astype(np.uint32)
-        node_ids = nodes
-        max_node = nodes[-1]
+        node_ids = np.sort(list(node_sequences.keys())).astype(np.uint32)
+        max_node = node_ids[-1]
         logging.info("Max node id is %d" % max_node)
 
-        logging.info("Making sequences")
-        node_sequences = [node_sequences[node] for node in nodes]
-        node_sizes = [len(seq) for seq in node_sequences]
-        node_sizes_array = np.zeros(nodes[-1]+1, dtype=np.uint32)
-        node_sizes_array[nodes] = node_sizes
-        nodes = node_sizes_array
+        node_sequences = [node_sequences[node] for node in node_ids]
+        node_sizes = np.array([len(sequence) for sequence in node_sequences], dtype=np.uint32)
+        sequence_buffer = np.frombuffer(''.join(node_sequences).encode(), dtype=np.uint8)
 
-        #from_nodes = []
-
-        to_nodes = []
-        n_edges = []
+        from_nodes = sorted(node for node in edges if node <= max_node)
+        n_edges = [len(edges[node]) for node in from_nodes]
+        to_nodes = np.array([to_node for node in from_nodes for to_node in edges[node]], dtype=np.uint32)
+        from_nodes = np.repeat(np.array(from_nodes, dtype=np.uint32), n_edges)
+        logging.info("Done preparing data from dicts")
 
-        to_nodes = np.concatenate([edges[n] for n in range(max_node+1) if n in edges]).astype(np.uint32)
-        n_edges = np.array([len(edges[n]) if n in edges else 0 for n in range(max_node+1)], dtype=np.uint8)
+        return cls.from_arrays(node_ids, node_sizes, sequence_buffer, from_nodes, to_nodes, linear_ref_nodes,
+                               chromosome_start_nodes=chromosome_start_nodes, pack_sequences=pack_sequences)
 
-        to_nodes_set = set(to_nodes)
-        logging.info("Done preparing data from dicts")
-        logging.info("There are %d node sequences" % len(node_sequences))
+    @classmethod
+    def from_arrays(cls, node_ids, node_sizes, sequences, from_nodes, to_nodes, linear_ref_nodes,
+                    chromosome_start_nodes=None, sequences_are_numeric=False, pack_sequences=False):
+        # Makes a graph from flat arrays:
+        # sequences is one buffer with the sequences of the nodes in node_ids after each other, either as ascii
+        # (bytes or uint8 array) or numeric (0-3) if sequences_are_numeric is True. Edges are given as from_nodes[i] -> to_nodes[i]
+        node_ids = np.asarray(node_ids, dtype=np.uint32)
+        node_sizes = np.asarray(node_sizes, dtype=np.uint32)
+        if isinstance(sequences, (bytes, bytearray)):
+            sequences = np.frombuffer(sequences, dtype=np.uint8)
+        assert len(sequences) == np.sum(node_sizes, dtype=np.uint64), "Sequence buffer has length %d, but node sizes sum to %d" % (len(sequences), np.sum(node_sizes))
+
+        if not sequences_are_numeric:
+            sequences = convert_byte_array_to_numeric(sequences)
+
+        if np.any(np.diff(node_ids.astype(np.int64)) < 0):
+            logging.info("Sorting nodes")
+            sorting = np.argsort(node_ids, kind="stable")
+            sequences = RaggedArray(sequences, node_sizes.astype(np.int64))[sorting].ravel()
+            node_ids = node_ids[sorting]
+            node_sizes = node_sizes[sorting]
+
+        max_node = int(node_ids[-1])
+        nodes = np.zeros(max_node + 1, dtype=np.uint32)
+        nodes[node_ids] = node_sizes
+        logging.info("There are %d nodes with %d bases in total" % (len(node_ids), len(sequences)))
 
-        # sequences
-        sequence = np.array(list(''.join(node_sequences)))
-        numeric_sequence = convert_sequence_array_to_numeric(sequence)
-        sequences = RaggedArray(numeric_sequence, nodes, dtype=np.uint8)
+        # all nodes from 0 to max_node get a row (empty if the node does not exist)
+        if pack_sequences:
+            sequences = PackedSequences.from_numeric(sequences, nodes)
+        else:
+            sequences = RaggedArray(sequences, nodes, dtype=np.uint8)
+
+        # edges, sorted by from node and otherwise kept in the order given
+        from_nodes = np.asarray(from_nodes, dtype=np.uint32)
+        to_nodes = np.asarray(to_nodes, dtype=np.uint32)
+        is_valid = from_nodes <= max_node
+        from_nodes = from_nodes[is_valid]
+        to_nodes = to_nodes[is_valid]
+        sorting = np.argsort(from_nodes, kind="stable")
+        n_edges = np.bincount(from_nodes, minlength=max_node + 1)
+        edges = RaggedArray(to_nodes[sorting], n_edges, dtype=np.uint32)
 
         # linear ref index
+        linear_ref_nodes = np.asarray(linear_ref_nodes, dtype=np.int64)
         node_to_ref_offset = np.zeros(max_node + 1, np.uint64)
-        ref_node_sizes = nodes[linear_ref_nodes]
-
-        # print("Ref node sizes: %s"  % ref_node_sizes)
-        ref_offsets = np.cumsum(ref_node_sizes)
+        ref_offsets = np.cumsum(nodes[linear_ref_nodes], dtype=np.uint64)
         node_to_ref_offset[linear_ref_nodes[1:]] = ref_offsets[:-1]
 
-
-        # Find last node to add to linear ref size
-        last_node_in_graph = np.argmax(node_to_ref_offset)
-        last_node_size = nodes[last_node_in_graph]
-        logging.info("Last node in graph is %d with size %d" % (last_node_in_graph, last_node_size))
-
-        ref_offset_to_node = np.zeros(int(np.max(node_to_ref_offset)) + last_node_size)
-        index_positions = np.cumsum(ref_node_sizes)[:-1]
-        # logging.info("INdex positions: %s" % index_positions)
-        # logging.info("Linear ref nodes: %s" % linear_ref_nodes)
-        # logging.info("Diff linear ref nodes: %s" % np.diff(linear_ref_nodes))
-        ref_offset_to_node[index_positions] = np.diff(linear_ref_nodes)
-        ref_offset_to_node[0] = linear_ref_nodes[0]
-        # logging.info("Ref offset to node 1: %s" % ref_offset_to_node)
-        ref_offset_to_node = np.cumsum(ref_offset_to_node, dtype=np.uint32)
+        ref_offset_to_node = LinearRefIndex.from_linear_ref_nodes(linear_ref_nodes, nodes)
+        logging.info("Linear reference has %d nodes and length %d" % (len(ref_offset_to_node.nodes), len(ref_offset_to_node)))
 
         if chromosome_start_nodes is None:
-            chromosome_start_nodes = [node for node in node_ids if node not in to_nodes_set]
+            # nodes without edges going in
+            chromosome_start_nodes = np.setdiff1d(node_ids, to_nodes)
             chromosome_start_nodes = {i+1: node for i, node in enumerate(chromosome_start_nodes)}
             logging.info("Seting chromosome start nodes to be %s" % chromosome_start_nodes)
         else:
             logging.info("Chromosome start nodes already set to %s" % chromosome_start_nodes)
 
-        return Graph(node_sizes_array, sequences, RaggedArray(to_nodes, n_edges, dtype=np.uint32), node_to_ref_offset, ref_offset_to_node, chromosome_start_nodes)
-        #return Graph.from_flat_nodes_and_edges(nodes, node_sequences, node_sizes, to_nodes, n_edges, np.array(linear_ref_nodes))
+        return cls(nodes, sequences, edges, node_to_ref_offset, ref_offset_to_node, chromosome_start_nodes)
 
     @classmethod
     def from_flat_nodes_and_edges(cls, node_ids, node_sequences, node_sizes, to_nodes, n_edges, linear_ref_nodes, chromosome_start_nodes):
@@ -827,35 +965,75 @@ class Graph:
 
         return nodes
    
-    def get_reverse_edges_hashtable(self):
-
-        class HashTableWrapper:
-            def __init__(self, hashtable):
-                self.hashtable = hashtable
-
-            def __getitem__(self, item):
-                try:
-                    return self.hashtable[[item]]
-                except IndexError:
-                    return np.array([])
-
-
-        from_nodes = NpList(dtype=np.uint32)
-        to_nodes = NpList(dtype=np.uint32)
-
-        for node in self.get_all_nodes():
-            for edge in self.get_edges(node):
-                from_nodes.append(edge)
-                to_nodes.append(node)
+    def __setattr__(self, name, value):
+        if name in Graph._fingerprint_attributes:
+            self.__dict__.pop("_fingerprint", None)
+        super().__setattr__(name, value)
+
+    def fingerprint(self):
+        # Hash of the arrays defining the graph. Used as key for derived indexes in an IndexCache
+        if getattr(self, "_fingerprint", None) is None:
+            logging.info("Computing graph fingerprint")
+            if isinstance(self.sequences, PackedSequences):
+                sequence_arrays = [self.sequences.packed, self.sequences.offsets]
+            else:
+                sequence_arrays = [self.sequences.ravel(), self.sequences.lengths]
+            # no chromosome start nodes is the same as no chromosomes
+            chromosome_start_nodes = self.chromosome_start_nodes if self.chromosome_start_nodes is not None else {}
+            chromosomes = sorted(chromosome_start_nodes.items(), key=lambda item: str(item[0]))
+            chromosome_names = np.frombuffer(" ".join(str(chromosome) for chromosome, _ in chromosomes).encode(), dtype=np.uint8)
+            chromosome_start_nodes = np.array([node for _, node in chromosomes], dtype=np.int64)
+            ref_offset_to_node = self.ref_offset_to_node
+            self._fingerprint = fingerprint_arrays(self.nodes, self.edges.ravel(), self.edges.lengths, *sequence_arrays,
+                                                   self.node_to_ref_offset,
+                                                   None if ref_offset_to_node is None else ref_offset_to_node.offsets,
+                                                   None if ref_offset_to_node is None else ref_offset_to_node.nodes,
+                                                   chromosome_names, chromosome_start_nodes)
+        return self._fingerprint
+
+    def use_index_cache(self, index_cache):
+        # Derived indexes (see index_cache.GRAPH_INDEXES) will then be loaded from/stored in this cache
+        self._index_cache = index_cache
+
+    def get_index(self, name):
+        index_cache = getattr(self, "_index_cache", None)
+        if index_cache is not None:
+            return index_cache.get_graph_index(self, name)
+
+        from .index_cache import GRAPH_INDEXES
+        return GRAPH_INDEXES[name][0](self)
+
+    @property
+    def reverse_edges(self):
+        # RaggedArray where row i contains the nodes with an edge to node i (sorted by node id).
+        # Made (or loaded from the index cache) on first access and kept on the graph (and in the graph file) after that
+        if getattr(self, "_reverse_edges", None) is None:
+            self._reverse_edges = self.get_index("reverse_edges")
+        return self._reverse_edges
+
+    def make_reverse_edges(self):
+        logging.info("Making reverse edges")
+        from_nodes, to_nodes = self.get_flat_edges()
+        # stable sort keeps the from nodes sorted within each row
+        sorting = np.argsort(to_nodes, kind="stable")
+        n_reverse_edges = np.bincount(to_nodes, minlength=len(self.nodes))
+        return RaggedArray(from_nodes[sorting], n_reverse_edges, dtype=np.uint32)
+
+    def get_reverse_edges(self, node):
+        if node >= len(self.reverse_edges):
+            return []
 
-        return HashTableWrapper(HashTable(from_nodes.get_nparray(), to_nodes.get_nparray()))
+        return self.reverse_edges[node]
 
+    def get_reverse_edges_hashtable(self):
+        # kept for backwards compatibility, the reverse edges RaggedArray can be indexed the same way
+        return self.reverse_edges
 
     def get_reverse_edges_dict(self):
         reverse_edges = defaultdict(list)
-        for node in self.get_all_nodes():
-            for edge in self.get_edges(node):
-                reverse_edges[edge].append(node)
+        nodes_with_reverse_edges = np.flatnonzero(self.reverse_edges.lengths)
+        for node, nodes_in in zip(nodes_with_reverse_edges, self.reverse_edges[nodes_with_reverse_edges].tolist()):
+            reverse_edges[node] = nodes_in
 
         return reverse_edges
 
@@ -865,37 +1043,13 @@ class Graph:
         return int(self.node_to_ref_offset[self.chromosome_start_nodes[chromosome]] + chromosome_offset)
 
 
-    def find_nodes_from_node_that_matches_sequence(self, from_node, sequence, nodes_found, all_paths_found):
-        # hack to fix issue with "n"
-        sequence = sequence.replace("n", "a").replace("N", "A")
-
-        #logging.info("== Searching from node %d with sequence %s. Variant type %s. Nodes found: %s. All paths found: %s" % (from_node, sequence, variant_type, nodes_found, all_paths_found))
-        if sequence == "":
-            # All of the sequence is used successfully, return
-            all_paths_found.append(nodes_found)
-            #logging.info("   RETURNING. All paths found: %s" % all_paths_found)
-            return nodes_found, all_paths_found
-
-        next_nodes = self.get_edges(from_node)
-        result = (nodes_found, all_paths_found)
-        for possible_next in next_nodes:
-
-            #print("Checking next node %d" % possible_next)
-
-            node_size = self.get_node_size(possible_next)
-            if node_size == 0 or self.get_node_sequence(possible_next).lower() == sequence[0:node_size].lower():
-                # This node is a match, we can continue searching
-                new_sequence = sequence[node_size:]
-                new_nodes_found = nodes_found.copy()
-                new_nodes_found.append(possible_next)
-
-                #print("   Matching sequence. New sequence is now %s" % new_sequence)
-                result = self.find_nodes_from_node_that_matches_sequence(possible_next, new_sequence, new_nodes_found, all_paths_found)
-                if not result:
-                    continue
-            else:
-                #print("   No sequence match")
-                continue
+    def find_nodes_from_node_that_matches_sequence(self, from_node, sequence, nodes_found, all_paths_found, max_paths=None):
+        # n in the sequence is treated as a (see sequence_search)
+        one_path, paths = find_paths_matching_sequence(self, from_node, sequence, max_paths=max_paths)
+        all_paths_found.extend(nodes_found + path for path in paths)
+        return nodes_found + one_path, all_paths_found
 
-        return result
+    def find_nodes_from_nodes_that_match_sequences(self, from_nodes, sequences, max_paths=None):
+        # the paths of many (from node, sequence) queries at once, as a list with the paths of each query
+        return find_paths_matching_sequences(self, from_nodes, sequences, max_paths=max_paths)
 
@@ -1,10 +1,15 @@
-from .variants import VcfVariants
+from .variants import VcfVariants, get_vcf_chromosome_offsets
+import os
+import tempfile
 import logging
 from collections import defaultdict
-from .mutable_graph import MutableGraph
-from .graph import Graph
-from .dummy_node_adder import DummyNodeAdder
+from .mutable_graph import ArrayMutableGraph
+from .graph import Graph, convert_byte_array_to_numeric
+from .dummy_node_adder import DummyNodeAdder, ArrayDummyNodeAdder
+from .graph_file import ShardedGraphWriter
+from multiprocessing import Pool
 import numpy as np
+import bionumpy as bnp
 
 class EmptyNodeException(Exception):
     pass
@@ -33,7 +38,7 @@ class GraphConstructor:
         self._deletions = defaultdict(list)  # A lookup from a ref pos to another ref pos representing a deltion
         self._edges_added = set()
 
-        self._mutable_graph = MutableGraph()
+        self._mutable_graph = ArrayMutableGraph()
         self.make_nodes()
         self.make_edges()
         self._graph = None
@@ -193,3 +198,347 @@ class GraphConstructor:
         logging.info("Done sorting breakpoints")
 
         #logging.info("Breakpoints: %s" % self.breakpoints)
+
+
+class ArrayGraphConstructor:
+    # Makes the same graph as GraphConstructor (same node ids, edges and edge order), but works on numpy arrays of
+    # breakpoints, nodes and edges instead of dicts keyed by reference position and a MutableGraph.
+    # Every node has a reference position before it (the last base before the node) and after it (the first base after it).
+    # The reference sequence can be a str or an array of ascii values, or numeric (0-3) if reference_is_numeric is True.
+    # It is converted to numeric once, and node sequences are cut from the numeric reference
+    def __init__(self, reference_sequence, variants: VcfVariants, reference_is_numeric=False):
+        if isinstance(reference_sequence, str):
+            reference_sequence = reference_sequence.encode()
+        if isinstance(reference_sequence, (bytes, bytearray)):
+            reference_sequence = np.frombuffer(reference_sequence, dtype=np.uint8)
+        if not reference_is_numeric:
+            reference_sequence = convert_byte_array_to_numeric(reference_sequence)
+        self.reference_sequence = reference_sequence
+        self.variants = variants
+        self._set_variant_arrays()
+        self.make_sorted_breakpoints()
+        self.make_nodes()
+        self.make_edges()
+        logging.info("Making a graph")
+        self._graph = self.get_graph()
+        logging.info("Adding dummy nodes for indels")
+        self.add_dummy_nodes()
+
+    def _set_variant_arrays(self):
+        logging.info("Traversing variants")
+        chromosomes = []
+        positions_before = []
+        positions_after = []
+        is_deletion = []
+        variant_sequences = []
+        for variant in self.variants:
+            chromosomes.append(variant.chromosome)
+            positions_before.append(variant.get_reference_position_before_variant())
+            positions_after.append(variant.get_reference_position_after_variant())
+            is_deletion.append(variant.type == "DELETION")
+            variant_sequences.append(variant.get_variant_sequence())
+
+        self._chromosome_names = list(dict.fromkeys(chromosomes))
+        chromosome_codes = {chromosome: i for i, chromosome in enumerate(self._chromosome_names)}
+        self._variant_chromosomes = np.array([chromosome_codes[chromosome] for chromosome in chromosomes], dtype=np.int64)
+        self._variant_before = np.array(positions_before, dtype=np.int64)
+        self._variant_after = np.array(positions_after, dtype=np.int64)
+        self._variant_is_deletion = np.array(is_deletion, dtype=bool)
+        self._variant_sequence_lengths = np.array([len(sequence) for sequence in variant_sequences], dtype=np.int64)
+        self._variant_sequence_starts = np.cumsum(self._variant_sequence_lengths) - self._variant_sequence_lengths
+        self._variant_sequences = convert_byte_array_to_numeric(np.frombuffer("".join(variant_sequences).encode(), dtype=np.uint8))
+
+    def make_sorted_breakpoints(self):
+        # Breakpoints are last base pair in a reference node. A stable sort keeps the order GraphConstructor gets
+        # by sorting the breakpoints (before variant, after variant) of all variants after each other
+        logging.info("Sorting breakpoints")
+        n_variants = len(self._variant_before)
+        positions = np.empty(2 * n_variants, dtype=np.int64)
+        positions[0::2] = self._variant_before
+        positions[1::2] = self._variant_after - 1
+        variants = np.full(2 * n_variants, -1, dtype=np.int64)
+        variants[0::2] = np.arange(n_variants)
+        sorting = np.argsort(positions, kind="stable")
+        self._breakpoints = positions[sorting]
+        self._breakpoint_variants = variants[sorting]
+        logging.info("Done sorting breakpoints")
+
+    def make_nodes(self):
+        logging.info("Making nodes")
+        breakpoints = self._breakpoints
+        reference_length = len(self.reference_sequence)
+        # end of the previous reference node at each breakpoint. A reference node is made at every new breakpoint position
+        prev_ref_node_ends = np.maximum(np.concatenate([[-1], breakpoints[:-1]]), -1)
+        makes_ref_node = breakpoints > prev_ref_node_ends
+        if np.any(breakpoints[makes_ref_node] >= reference_length):
+            logging.error("Breakpoint at position %d is outside the reference sequence, which has length %d" % (np.max(breakpoints), reference_length))
+            logging.error("Is your reference genome matching the vcf?")
+            raise EmptyNodeException("Empty sequence for node")
+
+        variants = self._breakpoint_variants
+        has_variant = variants >= 0
+        makes_variant_node = has_variant.copy()
+        makes_variant_node[has_variant] = ~self._variant_is_deletion[variants[has_variant]]
+
+        # node ids are given in breakpoint order, the reference node (if any) before the variant node at each breakpoint
+        n_new_nodes = makes_ref_node.astype(np.int64) + makes_variant_node
+        first_ids = np.cumsum(n_new_nodes) - n_new_nodes + 1
+        ref_node_ids = first_ids[makes_ref_node]
+        variant_node_ids = first_ids[makes_variant_node] + makes_ref_node[makes_variant_node]
+        node_variants = variants[makes_variant_node]
+
+        # one reference node for the rest of the reference sequence
+        last_ref_node_end = max(int(breakpoints[-1]), -1) if len(breakpoints) > 0 else -1
+        if last_ref_node_end + 1 >= reference_length:
+            logging.error("Ref pos before node: %d" % last_ref_node_end)
+            raise EmptyNodeException("Empty sequence for node")
+        last_node_id = int(np.sum(n_new_nodes)) + 1
+        self._n_nodes = last_node_id
+
+        # arrays indexed by node id (0 is not a node)
+        self._node_before = np.zeros(last_node_id + 1, dtype=np.int64)
+        self._node_after = np.zeros(last_node_id + 1, dtype=np.int64)
+        self._node_sequence_starts = np.zeros(last_node_id + 1, dtype=np.int64)
+        self._node_sizes = np.zeros(last_node_id + 1, dtype=np.int64)
+
+        self._node_before[ref_node_ids] = prev_ref_node_ends[makes_ref_node]
+        self._node_after[ref_node_ids] = breakpoints[makes_ref_node] + 1
+        self._node_before[last_node_id] = last_ref_node_end
+        self._node_after[last_node_id] = reference_length
+        self._linear_ref_nodes = np.append(ref_node_ids, last_node_id)
+        self._node_sequence_starts[self._linear_ref_nodes] = self._node_before[self._linear_ref_nodes] + 1
+        self._node_sizes[self._linear_ref_nodes] = self._node_after[self._linear_ref_nodes] - self._node_before[self._linear_ref_nodes] - 1
+
+        # sequence starts are in the reference for reference nodes and in the variant sequences for variant nodes
+        self._node_before[variant_node_ids] = self._variant_before[node_variants]
+        self._node_after[variant_node_ids] = self._variant_after[node_variants]
+        self._variant_node_ids = variant_node_ids
+        self._node_sequence_starts[variant_node_ids] = self._variant_sequence_starts[node_variants]
+        self._node_sizes[variant_node_ids] = self._variant_sequence_lengths[node_variants]
+        if np.any(self._node_sizes[variant_node_ids] == 0):
+            logging.error("Ref pos before node: %d" % self._node_before[variant_node_ids[self._node_sizes[variant_node_ids] == 0][0]])
+            raise EmptyNodeException("Empty sequence for node")
+
+        # the start node of a chromosome is the last reference node made before the first variant on the chromosome
+        last_ref_node_ids = np.maximum.accumulate(np.where(makes_ref_node, first_ids, 0))
+        variant_breakpoints = np.flatnonzero(has_variant)
+        chromosomes = self._variant_chromosomes[variants[variant_breakpoints]]
+        first_breakpoints = np.full(len(self._chromosome_names), len(breakpoints), dtype=np.int64)
+        np.minimum.at(first_breakpoints, chromosomes, variant_breakpoints)
+        self._chromosome_start_nodes = {}
+        for chromosome in np.argsort(first_breakpoints, kind="stable"):
+            self._chromosome_start_nodes[self._chromosome_names[chromosome]] = int(last_ref_node_ids[first_breakpoints[chromosome]])
+            logging.info("Setting chromosome start node of chromosome %s to be %d" % (
+                self._chromosome_names[chromosome], self._chromosome_start_nodes[self._chromosome_names[chromosome]]))
+
+        logging.info("Made %d nodes" % last_node_id)
+
+    def _get_nodes_starting_after(self, ref_positions):
+        # For each ref position, the range in self._nodes_by_before of nodes with that ref position before them
+        return (np.searchsorted(self._sorted_before, ref_positions, side="left"),
+                np.searchsorted(self._sorted_before, ref_positions, side="right"))
+
+    def _get_deletion_bypass_nodes(self):
+        # GraphConstructor adds an edge from a node to every node after a deletion starting where the node goes to,
+        # and then (recursively) to the nodes after deletions starting where those nodes start. For every
+        # ref position where deletions start, this finds the nodes reached that way in the order GraphConstructor
+        # adds the edges, as (ref positions, nodes) sorted by ref position.
+        #
+        # The nodes after deletion d are added in the order: the first node, the nodes reached from deletions
+        # starting at the same position, the other nodes. The paths of (deletion, slot, node) choices leading to
+        # each node are used as sort keys, and paths are made one level at a time until no more deletions are reached.
+        deletions = np.flatnonzero(self._variant_is_deletion)
+        deletions = deletions[np.argsort(self._variant_before[deletions], kind="stable")]
+        deletion_starts = self._variant_before[deletions]
+        deletion_ends = self._variant_after[deletions] - 1
+        # index of each deletion among the deletions starting at the same position
+        first_at_position = np.searchsorted(deletion_starts, deletion_starts, side="left")
+        deletion_ranks = np.arange(len(deletions)) - first_at_position
+
+        def expand(roots, keys, ref_positions):
+            # deletions starting at each of ref_positions, with the nodes after them
+            deletion_lo = np.searchsorted(deletion_starts, ref_positions, side="left")
+            n_deletions = np.searchsorted(deletion_starts, ref_positions, side="right") - deletion_lo
+            entries = np.repeat(np.arange(len(ref_positions)), n_deletions)
+            chosen = (np.arange(len(entries)) - np.repeat(np.cumsum(n_deletions) - n_deletions, n_deletions)) + deletion_lo[entries]
+            node_lo, node_hi = self._get_nodes_starting_after(deletion_ends[chosen])
+            n_nodes = node_hi - node_lo
+            deletion_entries = np.repeat(np.arange(len(chosen)), n_nodes)
+            node_indexes = np.arange(len(deletion_entries)) - np.repeat(np.cumsum(n_nodes) - n_nodes, n_nodes)
+            nodes = self._nodes_by_before[node_lo[deletion_entries] + node_indexes]
+            new_keys = np.stack([deletion_ranks[chosen][deletion_entries],
+                                 np.where(node_indexes == 0, 0, 2), node_indexes], axis=1)
+            new_keys = np.concatenate([keys[entries][deletion_entries], new_keys], axis=1)
+            # deletions reached from the first node after each deletion
+            first_keys = new_keys[node_indexes == 0].copy()
+            first_keys[:, -2] = 1
+            return (roots[entries][deletion_entries], new_keys, nodes,
+                    roots[entries][deletion_entries][node_indexes == 0], first_keys, deletion_ends[chosen][n_nodes > 0])
+
+        roots = np.unique(deletion_starts)
+        keys = np.zeros((len(roots), 0), dtype=np.int64)
+        ref_positions = roots
+        all_roots, all_keys, all_nodes = [], [], []
+        while len(ref_positions) > 0:
+            level_roots, level_keys, level_nodes, roots, keys, ref_positions = expand(roots, keys, ref_positions)
+            all_roots.append(level_roots)
+            all_keys.append(level_keys)
+            all_nodes.append(level_nodes)
+            # a position reached several ways from the same root only needs to be expanded from the first (smallest key)
+            sorting = np.lexsort(tuple(keys[:, i] for i in range(keys.shape[1] - 1, -1, -1)) + (ref_positions, roots))
+            roots, keys, ref_positions = roots[sorting], keys[sorting], ref_positions[sorting]
+            is_first = np.concatenate([[True], (roots[1:] != roots[:-1]) | (ref_positions[1:] != ref_positions[:-1])])[:len(roots)]
+            roots, keys, ref_positions = roots[is_first], keys[is_first], ref_positions[is_first]
+
+        if len(all_roots) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        # keys of different lengths are padded. A key is never a prefix of another key, so the padding is never compared
+        key_length = max(k.shape[1] for k in all_keys)
+        keys = np.concatenate([np.pad(k, ((0, 0), (0, key_length - k.shape[1]))) for k in all_keys])
+        roots = np.concatenate(all_roots)
+        nodes = np.concatenate(all_nodes)
+        sorting = np.lexsort(tuple(keys[:, i] for i in range(key_length - 1, -1, -1)) + (roots,))
+        roots = roots[sorting]
+        nodes = nodes[sorting]
+
+        # a node reached several ways only gets an edge the first time
+        _, first = np.unique(np.stack([roots, nodes], axis=1), axis=0, return_index=True)
+        first = np.sort(first)
+        return roots[first], nodes[first]
+
+    def make_edges(self):
+        logging.info("Making edges")
+        node_ids = np.arange(1, self._n_nodes + 1)
+        self._nodes_by_before = node_ids[np.argsort(self._node_before[node_ids], kind="stable")]
+        self._sorted_before = self._node_before[self._nodes_by_before]
+
+        # edges to the nodes starting where each node ends, except parallel nodes (same ref position before and after)
+        lo, hi = self._get_nodes_starting_after(self._node_after[node_ids] - 1)
+        n_edges = hi - lo
+        from_nodes = np.repeat(node_ids, n_edges)
+        to_nodes = self._nodes_by_before[np.arange(len(from_nodes)) - np.repeat(np.cumsum(n_edges) - n_edges - lo, n_edges)]
+        is_parallel = (self._node_before[from_nodes] == self._node_before[to_nodes]) & (self._node_after[from_nodes] == self._node_after[to_nodes])
+        keep = (from_nodes != to_nodes) & ~is_parallel
+        from_nodes = from_nodes[keep]
+        to_nodes = to_nodes[keep]
+        is_first = np.concatenate([[True], from_nodes[1:] != from_nodes[:-1]]) if len(from_nodes) > 0 else np.zeros(0, dtype=bool)
+
+        # deletion bypass edges come right after the first edge of a node
+        bypass_roots, bypass_nodes = self._get_deletion_bypass_nodes()
+        bypass_from_nodes = from_nodes[is_first]
+        bypass_lo = np.searchsorted(bypass_roots, self._node_after[bypass_from_nodes] - 1, side="left")
+        n_bypass = np.searchsorted(bypass_roots, self._node_after[bypass_from_nodes] - 1, side="right") - bypass_lo
+        bypass_indexes = np.arange(np.sum(n_bypass)) - np.repeat(np.cumsum(n_bypass) - n_bypass - bypass_lo, n_bypass)
+        bypass_from_nodes = np.repeat(bypass_from_nodes, n_bypass)
+        logging.info("Made %d edges and %d deletion bypass edges" % (len(from_nodes), len(bypass_from_nodes)))
+
+        from_nodes = np.concatenate([from_nodes, bypass_from_nodes])
+        to_nodes = np.concatenate([to_nodes, bypass_nodes[bypass_indexes]])
+        slots = np.concatenate([np.where(is_first, 0, 2), np.ones(len(bypass_from_nodes), dtype=np.int64)])
+        sorting = np.lexsort((np.arange(len(from_nodes)), slots, from_nodes))
+        self._edges_from = from_nodes[sorting]
+        self._edges_to = to_nodes[sorting]
+
+    def get_graph(self):
+        node_ids = np.arange(1, self._n_nodes + 1)
+        sizes = self._node_sizes[node_ids]
+        # Reference nodes cover the reference in node id order, so the sequence buffer is the reference with the
+        # variant node sequences inserted before the reference node coming after each variant node
+        variant_nodes = self._variant_node_ids
+        variant_sizes = self._node_sizes[variant_nodes]
+        variant_sequences = self._variant_sequences[np.arange(np.sum(variant_sizes)) + np.repeat(
+            self._node_sequence_starts[variant_nodes] - (np.cumsum(variant_sizes) - variant_sizes), variant_sizes)]
+        ref_sizes = np.zeros(self._n_nodes + 1, dtype=np.int64)
+        ref_sizes[self._linear_ref_nodes] = self._node_sizes[self._linear_ref_nodes]
+        insert_positions = np.cumsum(ref_sizes)[variant_nodes]
+        sequences = np.insert(self.reference_sequence, np.repeat(insert_positions, variant_sizes), variant_sequences)
+        return Graph.from_arrays(node_ids, sizes, sequences, self._edges_from, self._edges_to, self._linear_ref_nodes,
+                                 chromosome_start_nodes=self._chromosome_start_nodes, sequences_are_numeric=True)
+
+    def get_graph_with_dummy_nodes(self):
+        return self._graph_with_dummy_nodes
+
+    def add_dummy_nodes(self):
+        dummy_node_adder = ArrayDummyNodeAdder(self._graph, self.variants)
+        self._graph_with_dummy_nodes = dummy_node_adder.create_new_graph_with_dummy_nodes()
+
+
+# Rough estimate of the peak memory used when making the graph for one chromosome (reference sequence,
+# variants, graph arrays and the mutable graph used when adding dummy nodes), in bytes per reference base
+MAKE_MEMORY_PER_REFERENCE_BASE = 40
+
+
+def _get_available_memory():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def get_n_graph_construction_workers(chromosome_sizes):
+    # as many workers as there are cores, but not more than there is memory for when the largest chromosomes are made at the same time
+    n_workers = min(os.cpu_count(), len(chromosome_sizes))
+    try:
+        available_memory = _get_available_memory()
+    except (ValueError, OSError, AttributeError):
+        logging.warning("Could not find available memory, using one worker per core")
+        return max(1, n_workers)
+
+    largest_chromosomes = sorted(chromosome_sizes, reverse=True)[:n_workers]
+    while n_workers > 1 and sum(largest_chromosomes[:n_workers]) * MAKE_MEMORY_PER_REFERENCE_BASE > available_memory:
+        n_workers -= 1
+    logging.info("Using %d workers (%d cores, %.1f GB memory available)" % (n_workers, os.cpu_count(), available_memory / 1024**3))
+    return max(1, n_workers)
+
+
+def read_numeric_reference_sequence(reference_fasta_file, chromosome):
+    # Reads one chromosome with the fasta index (bionumpy makes the index if it does not exist) and converts
+    # it to numeric (0-3) in place, so that no other copy of the chromosome is made
+    reference_sequence = bnp.open_indexed(reference_fasta_file)[chromosome].raw()
+    if not reference_sequence.flags.writeable:
+        reference_sequence = reference_sequence.copy()
+    return convert_byte_array_to_numeric(reference_sequence, out=reference_sequence)
+
+
+def make_chromosome_graph(reference_fasta_file, vcf_file_name, chromosome, vcf_offset=None):
+    # vcf_offset is the offset of the chromosome in the vcf (see get_vcf_chromosome_offsets)
+    reference_sequence = read_numeric_reference_sequence(reference_fasta_file, chromosome)
+    logging.info("Extracted sequence for chromosome %s. Length is: %d" % (chromosome, len(reference_sequence)))
+    variants = VcfVariants.from_vcf(vcf_file_name, limit_to_chromosome=chromosome, dont_encode_chromosomes=True, file_offset=vcf_offset)
+    logging.info("There are %d variants in chromosome %s" % (len(variants), chromosome))
+    assert len(variants) > 0, "Did not find any variants in VCF when limiting to chromosome %s" % chromosome
+    return ArrayGraphConstructor(reference_sequence, variants, reference_is_numeric=True).get_graph_with_dummy_nodes()
+
+
+def _make_chromosome_graph_file(data):
+    # Pool worker. The graph is written to a native graph file and read memory-mapped by the main process,
+    # instead of being pickled back
+    reference_fasta_file, vcf_file_name, chromosome, vcf_offset, out_file_name = data
+    make_chromosome_graph(reference_fasta_file, vcf_file_name, chromosome, vcf_offset).to_file(out_file_name, native=True)
+    return out_file_name
+
+
+def make_genome_graph(reference_fasta_file, vcf_file_name, chromosomes, out_file_name, n_workers=1, vcf_offsets=None):
+    # Makes one graph per chromosome in parallel, and writes them as shards of one sharded graph (in the order given)
+    # as soon as each chromosome (and all chromosomes before it) is finished. vcf_offsets is a dict with the offset of
+    # each chromosome in the vcf (see get_vcf_chromosome_offsets), found here if not given.
+    # Chromosome graphs are written to a temporary directory next to the graph, which is removed also if a worker fails
+    if vcf_offsets is None:
+        vcf_offsets = get_vcf_chromosome_offsets(vcf_file_name)
+
+    writer = ShardedGraphWriter(out_file_name)
+    with tempfile.TemporaryDirectory(prefix=os.path.basename(os.path.normpath(out_file_name)) + ".tmp",
+                                     dir=os.path.dirname(os.path.abspath(out_file_name))) as tmp_directory:
+        tasks = [(reference_fasta_file, vcf_file_name, chromosome, vcf_offsets.get(chromosome), os.path.join(tmp_directory, "chromosome%d" % i))
+                 for i, chromosome in enumerate(chromosomes)]
+        with Pool(n_workers) as pool:
+            for chromosome, chromosome_file_name in zip(chromosomes, pool.imap(_make_chromosome_graph_file, tasks)):
+                logging.info("Chromosome %s is finished" % chromosome)
+                writer.add_chromosome_graph(Graph.from_file(chromosome_file_name, mmap=True))
+
+    return writer.close()
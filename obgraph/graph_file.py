@@ -0,0 +1,440 @@
+import os
+import json
+import logging
+import numpy as np
+from npstructures import RaggedArray
+from npstructures.raggedshape import RaggedShape
+from .linear_ref_index import LinearRefIndex
+from .packed_sequences import PackedSequences
+
+# Native on-disk format for Graph: A directory with one .npy file per array and a json header.
+# Arrays are stored raw (np.save pads the header so that data is aligned), meaning that they
+# can be memory-mapped directly, and several processes reading the same graph share the page cache.
+
+NATIVE_FORMAT_NAME = "obgraph"
+NATIVE_FORMAT_VERSION = 1
+HEADER_FILE_NAME = "header.json"
+
+
+def is_native_graph_file(file_name):
+    return os.path.isdir(file_name) and os.path.isfile(os.path.join(file_name, HEADER_FILE_NAME))
+
+
+def _ragged_array_to_arrays(ragged_array):
+    # Codes are the interleaved row starts and row lengths, which is what RaggedShape uses internally.
+    # Storing these makes it possible to create the RaggedArray without copying anything
+    return ragged_array.ravel(), ragged_array._shape._codes
+
+
+def _ragged_array_from_arrays(data, codes):
+    return RaggedArray(data, RaggedShape(codes, is_coded=True))
+
+
+def _chromosome_to_json(chromosome):
+    if isinstance(chromosome, (int, np.integer)):
+        return int(chromosome)
+    return str(chromosome)
+
+
+def graph_to_arrays(graph):
+    arrays = {"nodes": graph.nodes}
+    arrays["edges"], arrays["edges_codes"] = _ragged_array_to_arrays(graph.edges)
+    if isinstance(graph.sequences, PackedSequences):
+        arrays["packed_sequences"] = graph.sequences.packed
+        arrays["packed_sequences_offsets"] = graph.sequences.offsets
+    else:
+        arrays["sequences"], arrays["sequences_codes"] = _ragged_array_to_arrays(graph.sequences)
+
+    optional_arrays = {
+        "node_to_ref_offset": graph.node_to_ref_offset,
+        "linear_ref_nodes_index": graph.linear_ref_nodes_index,
+        "linear_ref_nodes_and_dummy_nodes_index": graph.linear_ref_nodes_and_dummy_nodes_index,
+        "allele_frequencies": graph.allele_frequencies
+    }
+    for name, array in optional_arrays.items():
+        if array is not None:
+            arrays[name] = array
+
+    # reverse edges are only stored if they have been made
+    if getattr(graph, "_reverse_edges", None) is not None:
+        arrays["reverse_edges"], arrays["reverse_edges_codes"] = _ragged_array_to_arrays(graph._reverse_edges)
+
+    if graph.ref_offset_to_node is not None:
+        arrays["linear_ref_offsets"] = graph.ref_offset_to_node.offsets
+        arrays["linear_ref_nodes"] = graph.ref_offset_to_node.nodes
+
+    return arrays
+
+
+def graph_from_arrays(arrays, chromosome_start_nodes):
+    from .graph import Graph
+    ref_offset_to_node = None
+    if "linear_ref_offsets" in arrays:
+        ref_offset_to_node = LinearRefIndex(arrays["linear_ref_offsets"], arrays["linear_ref_nodes"])
+
+    if "packed_sequences" in arrays:
+        sequences = PackedSequences(arrays["packed_sequences"], arrays["packed_sequences_offsets"])
+    else:
+        sequences = _ragged_array_from_arrays(arrays["sequences"], arrays["sequences_codes"])
+
+    reverse_edges = None
+    if "reverse_edges" in arrays:
+        reverse_edges = _ragged_array_from_arrays(arrays["reverse_edges"], arrays["reverse_edges_codes"])
+
+    return Graph(arrays["nodes"],
+                 sequences,
+                 _ragged_array_from_arrays(arrays["edges"], arrays["edges_codes"]),
+                 node_to_ref_offset=arrays.get("node_to_ref_offset"),
+                 ref_offset_to_node=ref_offset_to_node,
+                 chromosome_start_nodes=chromosome_start_nodes,
+                 allele_frequencies=arrays.get("allele_frequencies"),
+                 linear_ref_nodes_index=arrays.get("linear_ref_nodes_index"),
+                 linear_ref_nodes_and_dummy_nodes_index=arrays.get("linear_ref_nodes_and_dummy_nodes_index"),
+                 reverse_edges=reverse_edges)
+
+
+def write_arrays(directory, arrays, header):
+    os.makedirs(directory, exist_ok=True)
+    header = dict(header)
+    header["format"] = NATIVE_FORMAT_NAME
+    header["version"] = NATIVE_FORMAT_VERSION
+    header["arrays"] = {}
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        np.save(os.path.join(directory, name + ".npy"), array)
+        header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape)}
+
+    # header is written last, so that a directory without a header is never mistaken for a complete graph
+    with open(os.path.join(directory, HEADER_FILE_NAME), "w") as f:
+        json.dump(header, f)
+
+
+def _write_array(directory, name, array):
+    # adds or replaces one array of a native graph directory. The array is written to a new file that replaces
+    # the old one, since the old one may be memory-mapped
+    header = read_header(directory)
+    tmp_file_name = os.path.join(directory, name + ".tmp.npy")
+    np.save(tmp_file_name, array)
+    os.replace(tmp_file_name, os.path.join(directory, name + ".npy"))
+    header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape)}
+    with open(os.path.join(directory, HEADER_FILE_NAME), "w") as f:
+        json.dump(header, f)
+
+
+def read_header(directory):
+    with open(os.path.join(directory, HEADER_FILE_NAME)) as f:
+        header = json.load(f)
+
+    if header.get("format") != NATIVE_FORMAT_NAME:
+        raise Exception("%s is not an obgraph graph directory" % directory)
+
+    if header["version"] > NATIVE_FORMAT_VERSION:
+        raise Exception("Graph %s has format version %d, but this version of obgraph only supports up to version %d" %
+                        (directory, header["version"], NATIVE_FORMAT_VERSION))
+    return header
+
+
+def read_arrays(directory, header, mmap=True):
+    mmap_mode = "r" if mmap else None
+    return {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode)
+            for name in header["arrays"]}
+
+
+def write_native_graph(graph, directory):
+    header = {"chromosome_start_nodes": [[_chromosome_to_json(chromosome), int(node)]
+                                         for chromosome, node in graph.chromosome_start_nodes.items()]}
+    write_arrays(directory, graph_to_arrays(graph), header)
+    logging.info("Wrote graph to %s" % directory)
+    return directory
+
+
+def read_native_graph(directory, mmap=True):
+    header = read_header(directory)
+    chromosome_start_nodes = {chromosome: node for chromosome, node in header["chromosome_start_nodes"]}
+    if "shards" in header:
+        return ShardedGraph(directory, mmap).load_all()
+
+    arrays = read_arrays(directory, header, mmap)
+    return graph_from_arrays(arrays, chromosome_start_nodes)
+
+
+# Sharded graphs: A native graph directory where the arrays are split into one subdirectory per chromosome.
+# Each shard is a graph of one chromosome with its own node ids and linear ref offsets, starting with an empty
+# node 0, so a single chromosome can be loaded (memory-mapped) without reading the rest. The shard header has the
+# node id in the full graph of the shard's node 0 (first_node) and the linear ref offset where the chromosome starts.
+# A shard can start at the last node of the shard before it, this node is then the empty node 0 of the shard.
+
+_PER_NODE_ARRAYS = ["nodes", "node_to_ref_offset", "linear_ref_nodes_index",
+                    "linear_ref_nodes_and_dummy_nodes_index", "allele_frequencies"]
+_RAGGED_ARRAYS = ["edges", "sequences", "reverse_edges"]
+# arrays with node ids and ref offsets, which are shifted between the full graph and the shards
+_NODE_ID_ARRAYS = ["edges", "reverse_edges", "linear_ref_nodes"]
+_REF_OFFSET_ARRAYS = ["node_to_ref_offset", "linear_ref_offsets"]
+
+
+def _get_shard_node_ranges(graph):
+    # one shard per chromosome, from the chromosome start node. The first shard also includes node 0
+    chromosomes = sorted(graph.chromosome_start_nodes.items(), key=lambda item: item[1])
+    start_nodes = [int(node) for _, node in chromosomes]
+    first_nodes = [0] + start_nodes[1:]
+    end_nodes = start_nodes[1:] + [len(graph.nodes)]
+
+    # all edges must be within a shard
+    from_nodes, to_nodes = graph.get_flat_edges()
+    from_shards = np.searchsorted(first_nodes, from_nodes, side="right")
+    to_shards = np.searchsorted(first_nodes, to_nodes, side="right")
+    if np.any(from_shards != to_shards):
+        crossing = np.flatnonzero(from_shards != to_shards)[:10]
+        raise Exception("Graph cannot be split into chromosomes, some edges go between chromosomes: %s" %
+                        list(zip(from_nodes[crossing], to_nodes[crossing])))
+
+    return [(chromosome, first_node, end_node) for (chromosome, _), first_node, end_node in zip(chromosomes, first_nodes, end_nodes)]
+
+
+def _shift_arrays(arrays, node_offset, ref_offset):
+    arrays = dict(arrays)
+    for names, offset in [(_NODE_ID_ARRAYS, node_offset), (_REF_OFFSET_ARRAYS, ref_offset)]:
+        for name in names:
+            if name in arrays and offset != 0:
+                dtype = arrays[name].dtype
+                arrays[name] = (arrays[name].astype(np.int64) + offset).astype(dtype)
+    return arrays
+
+
+def _pad_array(array, n):
+    # array with n zero elements before it. Memory from np.zeros is only backed by pages when written to,
+    # so the padding does not use memory
+    padded = np.zeros(n + len(array), dtype=array.dtype)
+    padded[n:] = array
+    return padded
+
+
+def _pad_shard_arrays(arrays, n_nodes_before):
+    # gives node i of the shard node id n_nodes_before + i, with empty nodes before it
+    arrays = dict(arrays)
+    for name in _PER_NODE_ARRAYS:
+        if name in arrays:
+            arrays[name] = _pad_array(arrays[name], n_nodes_before)
+
+    for name in _RAGGED_ARRAYS:
+        if name in arrays:
+            # codes are interleaved row starts and lengths, zeros are empty rows
+            arrays[name + "_codes"] = _pad_array(arrays[name + "_codes"], 2 * n_nodes_before)
+
+    if "packed_sequences" in arrays:
+        arrays["packed_sequences_offsets"] = _pad_array(arrays["packed_sequences_offsets"], n_nodes_before)
+    return arrays
+
+
+def _get_shard_arrays(graph, first_node, end_node):
+    # arrays of the nodes from first_node to end_node, with an empty node 0 before them if first_node is not 0
+    nodes = np.arange(first_node, end_node)
+    has_empty_first_node = first_node > 0
+    if has_empty_first_node:
+        # the empty node 0 has the same rows as the last node of the previous shard, these are set to empty below
+        nodes = np.insert(nodes, 0, first_node - 1)
+
+    arrays = {}
+    for name in _PER_NODE_ARRAYS:
+        array = getattr(graph, name)
+        if array is not None:
+            arrays[name] = array[nodes]
+            if has_empty_first_node:
+                arrays[name][0] = 0
+
+    ragged_arrays = {"edges": graph.edges, "sequences": graph.sequences, "reverse_edges": getattr(graph, "_reverse_edges", None)}
+    for name, ragged_array in ragged_arrays.items():
+        if ragged_array is None:
+            continue
+        rows = ragged_array[nodes]
+        lengths = rows.lengths.astype(np.int64)
+        data = rows.ravel()
+        if has_empty_first_node:
+            data = data[lengths[0]:]
+            lengths[0] = 0
+        if name == "sequences" and isinstance(graph.sequences, PackedSequences):
+            # re-packed, since a shard does not necessarily start at a byte boundary
+            shard_sequences = PackedSequences.from_numeric(data, lengths)
+            arrays["packed_sequences"] = shard_sequences.packed
+            arrays["packed_sequences_offsets"] = shard_sequences.offsets
+        else:
+            arrays[name], arrays[name + "_codes"] = _ragged_array_to_arrays(RaggedArray(data, lengths, dtype=data.dtype))
+
+    index = graph.ref_offset_to_node
+    in_shard = (index.nodes >= first_node) & (index.nodes < end_node)
+    arrays["linear_ref_nodes"] = index.nodes[in_shard]
+    linear_ref_offsets = index.offsets[:-1][in_shard]
+    if len(linear_ref_offsets) > 0:
+        arrays["linear_ref_offsets"] = np.append(linear_ref_offsets, index.offsets[1:][in_shard][-1])
+    else:
+        arrays["linear_ref_offsets"] = np.zeros(1, dtype=index.offsets.dtype)
+
+    node_offset = first_node - int(has_empty_first_node)
+    ref_offset = int(arrays["linear_ref_offsets"][0])
+    return _shift_arrays(arrays, -node_offset, -ref_offset), node_offset, ref_offset
+
+
+def _get_shard_header(chromosome, directory, first_node, end_node, ref_offset):
+    return {"chromosome": _chromosome_to_json(chromosome), "directory": directory,
+            "first_node": int(first_node), "end_node": int(end_node), "ref_offset": int(ref_offset)}
+
+
+def write_sharded_graph(graph, directory):
+    shards = []
+    for i, (chromosome, first_node, end_node) in enumerate(_get_shard_node_ranges(graph)):
+        shard_directory = "shard%d" % i
+        logging.info("Writing chromosome %s with nodes %d-%d to %s" % (chromosome, first_node, end_node, shard_directory))
+        arrays, node_offset, ref_offset = _get_shard_arrays(graph, first_node, end_node)
+        shard = _get_shard_header(chromosome, shard_directory, node_offset, end_node, ref_offset)
+        write_arrays(os.path.join(directory, shard_directory), arrays, shard)
+        shards.append(shard)
+
+    header = {"chromosome_start_nodes": [[_chromosome_to_json(chromosome), int(node)]
+                                         for chromosome, node in graph.chromosome_start_nodes.items()],
+              "shards": shards}
+    write_arrays(directory, {}, header)
+    logging.info("Wrote sharded graph to %s" % directory)
+    return directory
+
+
+class ShardedGraphWriter:
+    """
+    Writes a sharded graph one chromosome graph at a time, so that the whole graph is never in memory.
+    Node ids and linear ref offsets of each chromosome graph come after the chromosomes written before it
+    in the full graph, which gives the same graph as merge_graphs.
+    """
+    def __init__(self, directory):
+        self._directory = directory
+        self._shards = []
+        self._chromosome_start_nodes = []
+        self._node_offset = 0
+        self._ref_offset = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def add_chromosome_graph(self, graph):
+        assert len(graph.chromosome_start_nodes) == 1, "Can only add graphs representing single chromosomes"
+        chromosome = list(graph.chromosome_start_nodes.keys())[0]
+        first_node = self._node_offset
+        end_node = first_node + len(graph.nodes)
+
+        shard_directory = "shard%d" % len(self._shards)
+        logging.info("Writing chromosome %s with nodes %d-%d to %s" % (chromosome, first_node, end_node, shard_directory))
+        shard = _get_shard_header(chromosome, shard_directory, first_node, end_node, self._ref_offset)
+        write_arrays(os.path.join(self._directory, shard_directory), graph_to_arrays(graph), shard)
+        self._shards.append(shard)
+        self._chromosome_start_nodes.append([_chromosome_to_json(chromosome), int(graph.get_first_node()) + first_node])
+
+        self._node_offset = end_node
+        self._ref_offset += graph.linear_ref_length()
+
+    def close(self):
+        write_arrays(self._directory, {}, {"chromosome_start_nodes": self._chromosome_start_nodes, "shards": self._shards})
+        logging.info("Wrote sharded graph with %d chromosomes to %s" % (len(self._shards), self._directory))
+        return self._directory
+
+
+def _combine_shard_arrays(shards, arrays):
+    # Makes the arrays of the full graph from the arrays of all shards. The empty node 0 of a shard starting
+    # at the last node of the shard before it is left out
+    skips = [0] + [max(previous["end_node"] - shard["first_node"], 0) for previous, shard in zip(shards[:-1], shards[1:])]
+    arrays = [_shift_arrays(shard_arrays, shard["first_node"], shard["ref_offset"]) for shard, shard_arrays in zip(shards, arrays)]
+    combined = {}
+
+    for name in _PER_NODE_ARRAYS:
+        if name in arrays[0]:
+            combined[name] = np.concatenate([shard_arrays[name][skip:] for skip, shard_arrays in zip(skips, arrays)])
+
+    for name in _RAGGED_ARRAYS:
+        if name not in arrays[0]:
+            continue
+        lengths = np.concatenate([_ragged_array_from_arrays(shard_arrays[name], shard_arrays[name + "_codes"]).lengths[skip:]
+                                  for skip, shard_arrays in zip(skips, arrays)])
+        # the rows left out are empty
+        data = np.concatenate([shard_arrays[name] for shard_arrays in arrays])
+        combined[name], combined[name + "_codes"] = _ragged_array_to_arrays(RaggedArray(data, lengths, dtype=data.dtype))
+
+    if "packed_sequences" in arrays[0]:
+        shard_sequences = [PackedSequences(shard_arrays["packed_sequences"], shard_arrays["packed_sequences_offsets"]) for shard_arrays in arrays]
+        sequences = PackedSequences.concatenate([sequences[np.arange(skip, len(sequences))] for skip, sequences in zip(skips, shard_sequences)])
+        combined["packed_sequences"] = sequences.packed
+        combined["packed_sequences_offsets"] = sequences.offsets
+
+    # linear ref of consecutive chromosomes is continuous
+    combined["linear_ref_nodes"] = np.concatenate([shard_arrays["linear_ref_nodes"] for shard_arrays in arrays])
+    combined["linear_ref_offsets"] = np.concatenate([arrays[0]["linear_ref_offsets"][:1]] + [shard_arrays["linear_ref_offsets"][1:] for shard_arrays in arrays])
+    return combined
+
+
+class ShardedGraph:
+    """
+    A graph file opened with Graph.open. Chromosomes are loaded when asked for.
+    Graph files that are not sharded are loaded as a whole on first use.
+    """
+    def __init__(self, file_name, mmap=True):
+        self._file_name = file_name
+        self._mmap = mmap
+        self._graph = None
+        self._shards = None
+        if is_native_graph_file(file_name):
+            header = read_header(file_name)
+            self._chromosome_start_nodes = {chromosome: node for chromosome, node in header["chromosome_start_nodes"]}
+            self._shards = header.get("shards")
+
+        if self._shards is None:
+            from .graph import Graph
+            self._graph = Graph.from_file(file_name, mmap=mmap)
+            self._chromosome_start_nodes = self._graph.chromosome_start_nodes
+
+    @property
+    def chromosomes(self):
+        return list(self._chromosome_start_nodes.keys())
+
+    @property
+    def is_sharded(self):
+        return self._shards is not None
+
+    def _read_shard(self, shard):
+        directory = os.path.join(self._file_name, shard["directory"])
+        return read_arrays(directory, read_header(directory), self._mmap)
+
+    def chromosome(self, chromosome):
+        # Graph with the nodes of the given chromosome, with the same node ids and linear ref offsets as in the full
+        # graph. Nodes before the chromosome are empty, and nodes after it are not in the graph.
+        # For graph files that are not sharded, the whole graph is returned
+        if chromosome not in self._chromosome_start_nodes:
+            raise KeyError("Chromosome %s is not in graph %s. Chromosomes are %s" % (chromosome, self._file_name, self.chromosomes))
+
+        if self._shards is None:
+            return self._graph
+
+        shard = self._get_shard(chromosome)
+        logging.info("Loading chromosome %s (nodes %d-%d) from %s" % (chromosome, shard["first_node"], shard["end_node"], self._file_name))
+        arrays = _shift_arrays(self._read_shard(shard), shard["first_node"], shard["ref_offset"])
+        return graph_from_arrays(_pad_shard_arrays(arrays, shard["first_node"]), {chromosome: self._chromosome_start_nodes[chromosome]})
+
+    def set_chromosome_array(self, chromosome, name, array, default_value=0):
+        # Writes a per node array (e.g. allele_frequencies) of a graph returned by chromosome() to the shard of
+        # that chromosome. Shards without the array get default_value, so that all shards have the same arrays
+        assert name in _PER_NODE_ARRAYS and name != "nodes", "Only per node arrays other than nodes can be set"
+        assert self._shards is not None, "Arrays can only be set on chromosomes of sharded graphs"
+        for shard in self._shards:
+            if shard["chromosome"] == chromosome:
+                shard_array = array[shard["first_node"]:shard["end_node"]]
+            elif name not in read_header(os.path.join(self._file_name, shard["directory"]))["arrays"]:
+                shard_array = np.zeros(shard["end_node"] - shard["first_node"], dtype=array.dtype) + default_value
+            else:
+                continue
+            _write_array(os.path.join(self._file_name, shard["directory"]), name, shard_array)
+
+    def _get_shard(self, chromosome):
+        return [shard for shard in self._shards if shard["chromosome"] == chromosome][0]
+
+    def load_all(self):
+        if self._shards is None:
+            return self._graph
+
+        shards = sorted(self._shards, key=lambda shard: shard["first_node"])
+        arrays = [self._read_shard(shard) for shard in shards]
+        if len(shards) > 1 or shards[0]["first_node"] != 0 or shards[0]["ref_offset"] != 0:
+            arrays = [_combine_shard_arrays(shards, arrays)]
+        return graph_from_arrays(arrays[0], self._chromosome_start_nodes)
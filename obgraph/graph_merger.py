@@ -1,6 +1,8 @@
 import logging
 import numpy as np
 from .graph import Graph
+from .linear_ref_index import LinearRefIndex
+from .packed_sequences import PackedSequences
 
 
 def merge_graphs(graphs):
@@ -10,7 +12,8 @@ def merge_graphs(graphs):
     new_node_sequences = []
     new_edges = []
     new_node_to_ref_offset = []
-    new_ref_offset_to_node = []
+    ref_offset_indexes = []
+    node_offsets = []
     new_chromosome_start_nodes = {}
     new_allele_frequencies = []
 
@@ -33,7 +36,8 @@ def merge_graphs(graphs):
         new_edges.append(graph.edges+node_offset)
 
         new_node_to_ref_offset.append(graph.node_to_ref_offset+ref_offset)
-        new_ref_offset_to_node.append(graph.ref_offset_to_node+node_offset)
+        ref_offset_indexes.append(graph.ref_offset_to_node)
+        node_offsets.append(node_offset)
 
         assert len(graph.chromosome_start_nodes) == 1, "Can only merge graphs representing single chromosomes"
         chromosome = list(graph.chromosome_start_nodes.keys())[0]
@@ -49,16 +53,19 @@ def merge_graphs(graphs):
         edge_index_offset += len(graph.edges)
 
         # increase the length of the linear reference genome
-        ref_offset += len(graph.ref_offset_to_node)
+        ref_offset += graph.linear_ref_length()
 
         logging.info("Ref offset is now %d" % ref_offset)
 
     logging.info("Concatenating all data")
     new_nodes = np.concatenate(new_nodes)
-    new_node_sequences = np.concatenate(new_node_sequences)
+    if any(isinstance(sequences, PackedSequences) for sequences in new_node_sequences):
+        new_node_sequences = PackedSequences.concatenate(new_node_sequences)
+    else:
+        new_node_sequences = np.concatenate(new_node_sequences)
     new_edges = np.concatenate(new_edges)
     new_node_to_ref_offset = np.concatenate(new_node_to_ref_offset)
-    new_ref_offset_to_node = np.concatenate(new_ref_offset_to_node)
+    new_ref_offset_to_node = LinearRefIndex.concatenate(ref_offset_indexes, node_offsets)
 
     if len(new_allele_frequencies) > 0:
         new_allele_frequencies = np.concatenate(new_allele_frequencies)
@@ -0,0 +1,138 @@
+import os
+import logging
+import numpy as np
+from shared_memory_wrapper import to_file
+
+# Writes the sequence of a haplotype path to a fasta file while the path is being traversed, together with
+# the coordinate map (haplotype position -> approximate position on the chromosome linear reference) and
+# refpos to node map (haplotype position -> node) of each chromosome. Only one chunk of nodes is kept in memory;
+# the maps are appended to raw files on disk and are memory-mapped when the output files are written.
+#
+# The output files are the same as the ones get_haplotype_sequence has always written
+# (<out>.fa, <out>.nodes.npy, <out>.coordinate_maps.npz and <out>.refpos_to_node.npz)
+
+
+class HaplotypeSequenceWriter:
+    def __init__(self, graph, out_file_name, sequence_chunk_size=10000000):
+        self._graph = graph
+        self._out_file_name = out_file_name
+        self._sequence_chunk_size = sequence_chunk_size
+        self._fasta_file = open(out_file_name + ".fa", "wb")
+        self._nodes_file = open(self._tmp_file_name("nodes"), "wb")
+        self._n_nodes = 0
+        self._chromosome_ids = []
+        self._map_files = None
+        self._reset_chromosome_state(0)
+
+    def _tmp_file_name(self, name):
+        return "%s.tmp_%s" % (self._out_file_name, name)
+
+    def start_chromosome(self, chromosome_id, chromosome_index):
+        if self._map_files is not None:
+            self._finish_chromosome()
+
+        self._chromosome_ids.append(str(chromosome_id))
+        self._map_files = {name: open(self._tmp_file_name("%s_%s" % (name, chromosome_id)), "wb")
+                           for name in ["coordinate_map", "refpos_to_node"]}
+        start_node = list(self._graph.chromosome_start_nodes.values())[chromosome_index]
+        self._reset_chromosome_state(int(self._graph.get_ref_offset_at_node(start_node)))
+        self._fasta_file.write((">" + str(chromosome_id) + "\n").encode())
+
+    def _reset_chromosome_state(self, chromosome_start_offset):
+        self._chromosome_start_offset = chromosome_start_offset
+        self._position = 0
+        # node starts (and coordinate map values) that are not written to the coordinate map yet
+        self._pending_starts = np.zeros(0, dtype=np.int64)
+        self._pending_values = np.zeros(0, dtype=np.int64)
+        self._coordinate_map_length = 0
+        # coordinate map value at the last position written
+        self._last_coordinate = 0
+
+    def add_nodes(self, nodes):
+        # nodes is the next part of the path on the current chromosome
+        assert self._map_files is not None, "start_chromosome must be called before nodes are added"
+        nodes = np.asarray(nodes, dtype=np.uint32)
+        self._nodes_file.write(nodes.tobytes())
+        self._n_nodes += len(nodes)
+
+        for chunk in self._graph.get_nodes_sequence_chunks(nodes, self._sequence_chunk_size):
+            self._fasta_file.write(chunk.tobytes())
+
+        node_sizes = self._graph.nodes[nodes].astype(np.int64)
+        self._map_files["refpos_to_node"].write(np.repeat(nodes, node_sizes).tobytes())
+
+        node_starts = self._position + np.cumsum(node_sizes) - node_sizes
+        self._position += int(np.sum(node_sizes))
+        coordinates = self._graph.node_to_ref_offset[nodes].astype(np.int64) - self._chromosome_start_offset
+        node_starts = np.concatenate([self._pending_starts, node_starts])
+        coordinates = np.concatenate([self._pending_values, coordinates])
+        # the coordinate map ends at the start of the last node on the chromosome, so everything from the
+        # start of the last node we have seen is kept until we know if more nodes follow
+        if len(node_starts) > 0:
+            self._write_coordinate_map(node_starts, coordinates, int(node_starts[-1]))
+
+    def _write_coordinate_map(self, node_starts, coordinates, end_position):
+        # Writes the coordinate map up to end_position, same as util.create_coordinate_map: Each node start gets the
+        # linear ref offset of the node (of the last node if several nodes start at the same position), and other
+        # positions get the last nonzero value before them
+        is_pending = node_starts >= end_position
+        self._pending_starts = node_starts[is_pending]
+        self._pending_values = coordinates[is_pending]
+
+        start_position = self._coordinate_map_length
+        values = np.zeros(end_position - start_position, dtype=np.int64)
+        values[node_starts[~is_pending] - start_position] = coordinates[~is_pending]
+        if len(values) == 0:
+            return
+
+        indexes = np.where(values != 0, np.arange(len(values)), -1)
+        if start_position == 0:
+            # the first position on the chromosome is always used as it is
+            indexes[0] = 0
+        indexes = np.maximum.accumulate(indexes)
+        values = np.where(indexes >= 0, values[indexes], self._last_coordinate)
+        self._last_coordinate = values[-1]
+        self._map_files["coordinate_map"].write(values.tobytes())
+        self._coordinate_map_length = end_position
+
+    def _finish_chromosome(self):
+        # the coordinate map goes to (and includes) the start of the last node
+        if len(self._pending_starts) > 0:
+            self._write_coordinate_map(self._pending_starts, self._pending_values, int(self._pending_starts[-1]) + 1)
+        self._fasta_file.write(b"\n")
+        for f in self._map_files.values():
+            f.close()
+        self._map_files = None
+
+    def close(self):
+        if self._map_files is not None:
+            self._finish_chromosome()
+        self._fasta_file.close()
+        self._nodes_file.close()
+        logging.info("Wrote sequences to %s" % (self._out_file_name + ".fa"))
+
+        nodes = np.memmap(self._tmp_file_name("nodes"), dtype=np.uint32, mode="r", shape=(self._n_nodes,)) \
+            if self._n_nodes > 0 else np.zeros(0, dtype=np.uint32)
+        np.save(self._out_file_name + ".nodes", nodes)
+        logging.info("Wrote nodes in haplotype path to %s" % self._out_file_name + ".nodes.npy")
+
+        for name, dtype, out_name in [("coordinate_map", np.int64, "coordinate_maps"), ("refpos_to_node", np.uint32, "refpos_to_node")]:
+            maps = {chromosome_id: self._read_tmp_array("%s_%s" % (name, chromosome_id), dtype)
+                    for chromosome_id in self._chromosome_ids}
+            to_file(maps, self._out_file_name + "." + out_name)
+            logging.info("Wrote %s to %s" % (name, self._out_file_name + "." + out_name))
+
+        del nodes
+        self._remove_tmp_files()
+
+    def _read_tmp_array(self, name, dtype):
+        file_name = self._tmp_file_name(name)
+        if os.path.getsize(file_name) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(file_name, dtype=dtype, mode="r")
+
+    def _remove_tmp_files(self):
+        os.remove(self._tmp_file_name("nodes"))
+        for chromosome_id in self._chromosome_ids:
+            for name in ["coordinate_map", "refpos_to_node"]:
+                os.remove(self._tmp_file_name("%s_%s" % (name, chromosome_id)))
@@ -0,0 +1,145 @@
+import logging
+import numpy as np
+from .cython_traversing import traverse_graph_by_following_nodes
+
+# A haplotype path that can be updated when nodes are added to or removed from the follow set, without traversing
+# the whole graph again. Only the nodes going into the changed nodes can make a different choice, so the path is
+# walked again from those nodes until it gets back to the old path, and that part of the path is replaced.
+#
+# The path is stored in blocks of about block_size nodes, so that an update only touches the blocks around the
+# changed part of the path. Each block has the offsets of its nodes in the haplotype sequence relative to the block.
+
+
+class IncrementalHaplotypePath:
+    def __init__(self, graph, follow_nodes, block_size=65536):
+        self._graph = graph
+        self._block_size = block_size
+        self._follow_nodes = np.zeros(len(graph.nodes), dtype=np.uint8)
+        self._follow_nodes[np.asarray(follow_nodes, dtype=np.int64)] = 1
+        # walking uses the same rules as traverse_graph_by_following_nodes
+        self._linear_nodes_index = graph.linear_ref_nodes_and_dummy_nodes_index
+
+        path = traverse_graph_by_following_nodes(graph, self._follow_nodes).astype(np.uint32)
+        # block ids are never reused, so that node_to_block stays valid when blocks before a node are changed
+        self._blocks = {}
+        self._block_offsets = {}
+        self._block_order = []
+        self._next_block_id = 0
+        self._node_to_block = np.full(len(graph.nodes), -1, dtype=np.int64)
+        self._block_order = self._make_blocks(path)
+
+    def _make_blocks(self, path):
+        block_ids = []
+        for start in range(0, max(len(path), 1), self._block_size):
+            block = path[start:start + self._block_size]
+            block_id = self._next_block_id
+            self._next_block_id += 1
+            node_sizes = self._graph.nodes[block].astype(np.int64)
+            self._blocks[block_id] = block
+            self._block_offsets[block_id] = np.cumsum(node_sizes) - node_sizes
+            self._node_to_block[block] = block_id
+            block_ids.append(block_id)
+        return block_ids
+
+    def _block_sequence_length(self, block_id):
+        block = self._blocks[block_id]
+        if len(block) == 0:
+            return 0
+        return int(self._block_offsets[block_id][-1] + self._graph.nodes[block[-1]])
+
+    @property
+    def path(self):
+        return np.concatenate([self._blocks[block_id] for block_id in self._block_order])
+
+    @property
+    def offsets(self):
+        # offset of every node of the path in the haplotype sequence
+        block_starts = np.cumsum([0] + [self._block_sequence_length(block_id) for block_id in self._block_order[:-1]])
+        return np.concatenate([self._block_offsets[block_id] + block_start
+                               for block_id, block_start in zip(self._block_order, block_starts)])
+
+    def __len__(self):
+        return sum(len(self._blocks[block_id]) for block_id in self._block_order)
+
+    def is_on_path(self, node):
+        return self._node_to_block[node] >= 0
+
+    def _get_next_node(self, node):
+        # the node traverse_graph_by_following_nodes goes to from node (-1 if node has no edges)
+        next_nodes = self._graph.edges[node]
+        if len(next_nodes) == 0:
+            return -1
+        if len(next_nodes) == 1:
+            return int(next_nodes[0])
+
+        next_node = -1
+        for candidate in next_nodes:
+            if self._follow_nodes[candidate] == 1 or (next_node == -1 and self._linear_nodes_index[candidate] == 1):
+                next_node = int(candidate)
+        assert next_node != -1, "Could not find next node from node %d" % node
+        return next_node
+
+    def _get_position(self, node):
+        # (index in block order, index in block)
+        block_id = self._node_to_block[node]
+        return self._block_order.index(block_id), int(np.flatnonzero(self._blocks[block_id] == node)[0])
+
+    def _get_node_after(self, block_index, index):
+        block = self._blocks[self._block_order[block_index]]
+        if index + 1 < len(block):
+            return int(block[index + 1])
+        for block_id in self._block_order[block_index + 1:]:
+            if len(self._blocks[block_id]) > 0:
+                return int(self._blocks[block_id][0])
+        return -1
+
+    def _rewalk_from(self, node):
+        # Walks from node (on the path) until the old path is reached again, and replaces the nodes in between.
+        # Returns True if the path changed
+        block_index, index = self._get_position(node)
+        next_node = self._get_next_node(node)
+        if next_node == self._get_node_after(block_index, index):
+            return False
+
+        new_nodes = []
+        while next_node != -1 and not self.is_on_path(next_node):
+            new_nodes.append(next_node)
+            next_node = self._get_next_node(next_node)
+        assert next_node != -1, "Path from node %d did not get back to the old path" % node
+
+        end_block_index, end_index = self._get_position(next_node)
+        assert (end_block_index, end_index) > (block_index, index)
+        changed_block_ids = self._block_order[block_index:end_block_index + 1]
+        old_nodes = np.concatenate([self._blocks[block_id] for block_id in changed_block_ids])
+        # index of the reconverging node in old_nodes
+        end = sum(len(self._blocks[block_id]) for block_id in changed_block_ids[:-1]) + end_index
+        self._node_to_block[old_nodes[index + 1:end]] = -1
+        new_path = np.concatenate([old_nodes[:index + 1], np.array(new_nodes, dtype=np.uint32), old_nodes[end:]])
+
+        for block_id in changed_block_ids:
+            del self._blocks[block_id]
+            del self._block_offsets[block_id]
+        self._block_order[block_index:end_block_index + 1] = self._make_blocks(new_path)
+        return True
+
+    def update(self, added_nodes=(), removed_nodes=()):
+        # Adds and removes nodes from the follow set, and updates the path. Returns the number of changed parts of the path
+        added_nodes = np.asarray(added_nodes, dtype=np.int64)
+        removed_nodes = np.asarray(removed_nodes, dtype=np.int64)
+        self._follow_nodes[removed_nodes] = 0
+        self._follow_nodes[added_nodes] = 1
+        changed_nodes = np.concatenate([added_nodes, removed_nodes])
+        n_changes = 0
+
+        # a change can make new nodes go into other changed nodes, so this is repeated until nothing changes
+        is_changed = True
+        while is_changed:
+            is_changed = False
+            for changed_node in changed_nodes:
+                for node in self._graph.get_reverse_edges(changed_node):
+                    if self.is_on_path(node) and self._rewalk_from(node):
+                        is_changed = True
+                        n_changes += 1
+
+        logging.debug("Changed %d parts of haplotype path" % n_changes)
+        return n_changes
@@ -0,0 +1,160 @@
+import os
+import time
+import shutil
+import hashlib
+import logging
+import numpy as np
+from .graph_file import write_arrays, read_header, read_arrays, _ragged_array_to_arrays, _ragged_array_from_arrays, HEADER_FILE_NAME
+
+# Cache for indexes derived from a graph (or from other arrays). Each index is stored as a native array directory
+# (see graph_file) in <cache directory>/<fingerprint>/<index name>, where the fingerprint is a hash of the data the
+# index is made from. Indexes are memory-mapped when loaded. When the cache grows beyond max_size bytes, the least
+# recently used indexes are removed (the mtime of an index header is updated every time the index is used).
+
+
+def fingerprint_arrays(*arrays):
+    h = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        if array is None:
+            h.update(b"none")
+            continue
+        array = np.ascontiguousarray(array)
+        h.update(("%s%s" % (array.dtype.str, array.shape)).encode())
+        h.update(array.reshape(-1).view(np.uint8))
+    return h.hexdigest()
+
+
+def _make_reverse_edges(graph):
+    return graph.make_reverse_edges()
+
+
+def _reverse_edges_to_arrays(reverse_edges):
+    data, codes = _ragged_array_to_arrays(reverse_edges)
+    return {"data": data, "codes": codes}
+
+
+def _reverse_edges_from_arrays(arrays):
+    return _ragged_array_from_arrays(arrays["data"], arrays["codes"])
+
+
+def _make_position_id(graph):
+    from .position_id import PositionId
+    return PositionId.from_graph(graph)
+
+
+def _position_id_from_arrays(arrays):
+    from .position_id import PositionId
+    return PositionId(arrays["index"])
+
+
+def _make_coordinate_converter(graph):
+    from .coordinate_converter import CoordinateConverter
+    return CoordinateConverter.from_graph(graph)
+
+
+def _coordinate_converter_from_arrays(arrays):
+    from .coordinate_converter import CoordinateConverter
+    return CoordinateConverter(arrays["chromosome_offsets"])
+
+
+# name -> (function making the index from a graph, function giving the arrays to store, function restoring the index)
+GRAPH_INDEXES = {
+    "reverse_edges": (_make_reverse_edges, _reverse_edges_to_arrays, _reverse_edges_from_arrays),
+    "position_id": (_make_position_id, lambda position_id: {"index": position_id._index}, _position_id_from_arrays),
+    "coordinate_converter": (_make_coordinate_converter,
+                             lambda converter: {"chromosome_offsets": converter.chromosome_offsets},
+                             _coordinate_converter_from_arrays),
+}
+
+
+class IndexCache:
+    def __init__(self, directory, max_size=10 * 1024**3):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry_directory(self, fingerprint, name):
+        return os.path.join(self.directory, fingerprint, name)
+
+    def has(self, fingerprint, name):
+        return os.path.isfile(os.path.join(self._entry_directory(fingerprint, name), HEADER_FILE_NAME))
+
+    def load(self, fingerprint, name):
+        # returns the stored arrays, or None if the index is not in the cache
+        directory = self._entry_directory(fingerprint, name)
+        try:
+            header = read_header(directory)
+        except FileNotFoundError:
+            return None
+
+        os.utime(os.path.join(directory, HEADER_FILE_NAME))
+        logging.info("Loaded %s from index cache %s" % (name, directory))
+        return read_arrays(directory, header, mmap=True)
+
+    def store(self, fingerprint, name, arrays):
+        directory = self._entry_directory(fingerprint, name)
+        # written to a temporary directory first, so that other processes never see a half-written index
+        tmp_directory = "%s.tmp%d" % (directory, os.getpid())
+        write_arrays(tmp_directory, arrays, {"index": name})
+        try:
+            os.rename(tmp_directory, directory)
+        except OSError:
+            # another process stored the same index in the meantime
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+
+        logging.info("Stored %s in index cache %s" % (name, directory))
+        self.evict()
+
+    def get(self, fingerprint, name, make_function, to_arrays, from_arrays):
+        arrays = self.load(fingerprint, name)
+        if arrays is not None:
+            return from_arrays(arrays)
+
+        index = make_function()
+        self.store(fingerprint, name, to_arrays(index))
+        return index
+
+    def get_graph_index(self, graph, name):
+        make_function, to_arrays, from_arrays = GRAPH_INDEXES[name]
+        return self.get(graph.fingerprint(), name, lambda: make_function(graph), to_arrays, from_arrays)
+
+    def get_node_to_variants(self, variant_to_nodes):
+        from .variant_to_nodes import NodeToVariants
+        fingerprint = fingerprint_arrays(variant_to_nodes.ref_nodes, variant_to_nodes.var_nodes)
+        return self.get(fingerprint, "node_to_variants",
+                        lambda: NodeToVariants.from_variant_to_nodes(variant_to_nodes),
+                        lambda node_to_variants: {"index": node_to_variants.index},
+                        lambda arrays: NodeToVariants(arrays["index"]))
+
+    def _get_entries(self):
+        # (last used time, size in bytes, directory) for all cached indexes
+        entries = []
+        for fingerprint in os.listdir(self.directory):
+            fingerprint_directory = os.path.join(self.directory, fingerprint)
+            if not os.path.isdir(fingerprint_directory):
+                continue
+            for name in os.listdir(fingerprint_directory):
+                directory = os.path.join(fingerprint_directory, name)
+                header_file = os.path.join(directory, HEADER_FILE_NAME)
+                if not os.path.isfile(header_file):
+                    continue
+                size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+                entries.append((os.path.getmtime(header_file), size, directory))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._get_entries())
+
+    def evict(self):
+        # removes least recently used indexes until the cache is within max_size
+        entries = sorted(self._get_entries())
+        total_size = sum(size for _, size, _ in entries)
+        for last_used, size, directory in entries:
+            if total_size <= self.max_size:
+                break
+            logging.info("Removing %s from index cache (last used %s)" % (directory, time.ctime(last_used)))
+            shutil.rmtree(directory, ignore_errors=True)
+            total_size -= size
+            fingerprint_directory = os.path.dirname(directory)
+            if len(os.listdir(fingerprint_directory)) == 0:
+                os.rmdir(fingerprint_directory)
@@ -0,0 +1,96 @@
+import logging
+import numpy as np
+
+
+class LinearRefIndex:
+    """
+    Lookup from an offset on the linear reference to the linear reference node covering that offset.
+    Instead of storing one node id per reference base, only the start offset of every linear ref node
+    is stored, and lookups are done with np.searchsorted.
+
+    offsets has one more element than nodes: offsets[i] is the start of nodes[i] and offsets[-1]
+    is the length of the linear reference. Nodes with size 0 are never part of the index.
+    offsets[0] is 0, except when the index only covers the end of the linear reference (one chromosome
+    of a sharded graph). Offsets before offsets[0] are then invalid.
+    """
+    def __init__(self, offsets, nodes):
+        assert len(offsets) == len(nodes) + 1
+        self.offsets = offsets
+        self.nodes = nodes
+
+    # Indexing gives the same result as indexing the old per-base ref_offset_to_node array,
+    # but iterating over every base is never what we want
+    __iter__ = None
+
+    @classmethod
+    def from_linear_ref_nodes(cls, linear_ref_nodes, node_sizes):
+        linear_ref_nodes = np.asarray(linear_ref_nodes)
+        sizes = np.asarray(node_sizes)[linear_ref_nodes].astype(np.uint64)
+        has_sequence = sizes > 0
+        linear_ref_nodes = linear_ref_nodes[has_sequence]
+        offsets = np.zeros(len(linear_ref_nodes) + 1, dtype=np.uint64)
+        np.cumsum(sizes[has_sequence], out=offsets[1:])
+        return cls(offsets, linear_ref_nodes.astype(np.uint32))
+
+    @classmethod
+    def from_ref_offset_to_node(cls, ref_offset_to_node):
+        # Converts the old per-base representation
+        logging.info("Converting ref_offset_to_node array with %d elements to a compact index" % len(ref_offset_to_node))
+        ref_offset_to_node = np.asarray(ref_offset_to_node)
+        starts = np.flatnonzero(np.ediff1d(ref_offset_to_node, to_begin=1) != 0)
+        offsets = np.append(starts, len(ref_offset_to_node)).astype(np.uint64)
+        return cls(offsets, ref_offset_to_node[starts].astype(np.uint32))
+
+    @classmethod
+    def concatenate(cls, indexes, node_offsets):
+        # node ids in each index are shifted by the corresponding node offset, and ref offsets by the length of the previous indexes
+        offsets = [np.zeros(1, dtype=np.uint64)]
+        nodes = []
+        ref_offset = 0
+        for index, node_offset in zip(indexes, node_offsets):
+            offsets.append(index.offsets[1:] + np.uint64(ref_offset))
+            nodes.append(index.nodes + np.uint32(node_offset))
+            ref_offset += len(index)
+
+        return cls(np.concatenate(offsets), np.concatenate(nodes).astype(np.uint32))
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __eq__(self, other):
+        return np.all(self.offsets == other.offsets) and np.all(self.nodes == other.nodes)
+
+    def _get_node_indexes(self, ref_offsets):
+        length = len(self)
+        is_scalar = np.ndim(ref_offsets) == 0
+        ref_offsets = np.atleast_1d(np.asarray(ref_offsets, dtype=np.int64))
+        # negative offsets count from the end, as when indexing an array
+        ref_offsets = np.where(ref_offsets < 0, ref_offsets + length, ref_offsets)
+        is_outside = (ref_offsets < int(self.offsets[0])) | (ref_offsets >= length)
+        if np.any(is_outside):
+            raise IndexError("Ref offset(s) %s outside linear reference %d-%d" % (ref_offsets[is_outside][:10], self.offsets[0], length))
+
+        node_indexes = np.searchsorted(self.offsets, ref_offsets.astype(np.uint64), side="right") - 1
+        if is_scalar:
+            return node_indexes[0]
+        return node_indexes
+
+    def get_node_at_ref_offset(self, ref_offset):
+        return self.nodes[self._get_node_indexes(ref_offset)]
+
+    def get_node_offset_at_ref_offset(self, ref_offset):
+        node_indexes = self._get_node_indexes(ref_offset)
+        return np.asarray(ref_offset, dtype=np.int64) % len(self) - self.offsets[node_indexes].astype(np.int64)
+
+    def __getitem__(self, ref_offsets):
+        return self.get_node_at_ref_offset(ref_offsets)
+
+    def get_nodes_between_offsets(self, start_offset, end_offset):
+        # all nodes overlapping the half-open interval [start_offset, end_offset)
+        start = np.searchsorted(self.offsets, np.uint64(start_offset), side="right") - 1
+        end = np.searchsorted(self.offsets, np.uint64(end_offset), side="left")
+        return self.nodes[max(start, 0):min(end, len(self.nodes))]
+
+    def to_ref_offset_to_node(self):
+        # materializes the full per-base array. Only meant for small graphs / debugging
+        return np.repeat(self.nodes, np.diff(self.offsets).astype(np.int64))
@@ -1,5 +1,8 @@
 from collections import defaultdict
+from types import MappingProxyType
 import logging
+import numpy as np
+from .sequence_search import find_paths_matching_sequence
 
 
 class MutableGraph:
@@ -85,34 +88,273 @@ class MutableGraph:
     def get_nodes_before(self, node):
         return self.reverse_edges[node]
 
-    def find_nodes_from_node_that_matches_sequence(self, from_node, sequence, variant_type, nodes_found, all_paths_found):
-        #logging.info("== Searching from node %d with sequence %s. Variant type %s. Nodes found: %s. All paths found: %s" % (from_node, sequence, variant_type, nodes_found, all_paths_found))
-        if sequence == "":
-            # All of the sequence is used successfully, return
-            all_paths_found.append(nodes_found)
-            #logging.info("   RETURNING. All paths found: %s" % all_paths_found)
-            return nodes_found, all_paths_found
-
-        next_nodes = self.get_edges(from_node)
-        result = (nodes_found, all_paths_found)
-        for possible_next in next_nodes:
-
-            #print("Checking next node %d" % possible_next)
-
-            node_size = self.get_node_size(possible_next)
-            if node_size == 0 or self.get_node_sequence(possible_next).lower() == sequence[0:node_size].lower():
-                # This node is a match, we can continue searching
-                new_sequence = sequence[node_size:]
-                new_nodes_found = nodes_found.copy()
-                new_nodes_found.append(possible_next)
-
-                #print("   Matching sequence. New sequence is now %s" % new_sequence)
-                result = MutableGraph.find_nodes_from_node_that_matches_sequence(self, possible_next, new_sequence, variant_type, new_nodes_found, all_paths_found)
-                if not result:
-                    continue
+    def find_nodes_from_node_that_matches_sequence(self, from_node, sequence, variant_type, nodes_found, all_paths_found, max_paths=None):
+        one_path, paths = find_paths_matching_sequence(self, from_node, sequence, max_paths=max_paths)
+        all_paths_found.extend(nodes_found + path for path in paths)
+        return nodes_found + one_path, all_paths_found
+
+
+
+def _grow(array, size, fill_value):
+    # returns a copy of array with room for at least size elements, the new elements are set to fill_value
+    new_array = np.full(max(size, 2 * len(array)), fill_value, dtype=array.dtype)
+    new_array[:len(array)] = array
+    return new_array
+
+
+class ArrayMutableGraph:
+    # Same interface as MutableGraph, but nodes and edges are stored in numpy arrays instead of dicts of lists.
+    # The nodes, node_sequences, edges and reverse_edges dicts of MutableGraph are read-only dicts made from the
+    # arrays when asked for, so changes must be made with add_node, add_edge etc.
+    #
+    # Node sizes and the offsets of the node sequences in one sequence buffer are indexed by node id. Edges are stored
+    # in the order they are added, and the edges out of (and into) a node are linked together through next_edge
+    # (next_reverse_edge). Removed edges are only marked as removed, and are taken out when more than half of the
+    # edges are removed. New edges always get the highest edge id, so the edges of a node are always in id order.
+    def __init__(self, nodes=None, node_sequences=None, edges=None, linear_ref_nodes=None, node_to_ref_offset=None, ref_offset_to_node=None, chromosome_start_nodes=None, allele_frequencies=None):
+        self._node_sizes = np.zeros(16, dtype=np.int64)
+        self._sequence_starts = np.zeros(16, dtype=np.int64)
+        self._node_exists = np.zeros(16, dtype=bool)
+        self._first_edge = np.full(16, -1, dtype=np.int64)
+        self._last_edge = np.full(16, -1, dtype=np.int64)
+        self._first_reverse_edge = np.full(16, -1, dtype=np.int64)
+        self._last_reverse_edge = np.full(16, -1, dtype=np.int64)
+        self._sequences = np.zeros(64, dtype=np.uint8)
+        self._sequences_length = 0
+        self._make_edge_store(16)
+
+        self.set_linear_ref_nodes([] if linear_ref_nodes is None else linear_ref_nodes)
+        self.node_to_ref_offset = node_to_ref_offset
+        self.ref_offset_to_node = ref_offset_to_node
+        self.chromosome_start_nodes = chromosome_start_nodes
+        self.allele_frequencies = allele_frequencies
+
+        if node_sequences is None and nodes is not None:
+            node_sequences = {node: "N" * size for node, size in nodes.items()}
+        if node_sequences is not None and len(node_sequences) > 0:
+            self.add_nodes(list(node_sequences.keys()), "".join(node_sequences.values()).encode(),
+                           [len(sequence) for sequence in node_sequences.values()])
+        if edges is not None and len(edges) > 0:
+            self.add_edges(np.repeat(list(edges.keys()), [len(to_nodes) for to_nodes in edges.values()]),
+                           [to_node for to_nodes in edges.values() for to_node in to_nodes])
+
+    @classmethod
+    def from_graph(cls, graph):
+        # same as Graph.to_mutable_graph, without going through dicts
+        mutable_graph = cls(linear_ref_nodes=graph.ref_offset_to_node.nodes.tolist(), node_to_ref_offset=graph.node_to_ref_offset,
+                            ref_offset_to_node=graph.ref_offset_to_node, chromosome_start_nodes=graph.chromosome_start_nodes,
+                            allele_frequencies=graph.allele_frequencies)
+        node_ids = graph.get_all_nodes()
+        mutable_graph.add_nodes(node_ids, graph.get_nodes_sequence_array(node_ids), graph.nodes[node_ids])
+        mutable_graph.add_edges(*graph.get_flat_edges())
+        return mutable_graph
+
+    def to_arrays(self):
+        # node ids, node sizes, sequence buffer (ascii), from nodes and to nodes, as Graph.from_arrays takes them
+        node_ids = np.flatnonzero(self._node_exists)
+        node_sizes = self._node_sizes[node_ids]
+        sequence_index = np.repeat(self._sequence_starts[node_ids] - (np.cumsum(node_sizes) - node_sizes), node_sizes) + np.arange(np.sum(node_sizes))
+        edges = np.flatnonzero(~self._edge_is_removed[:self._n_edges])
+        return node_ids, node_sizes, self._sequences[sequence_index], self._edge_from[edges], self._edge_to[edges]
+
+    def __str__(self):
+        description = "Nodes: %s " % ({node: self.get_node_sequence(node) for node in self.get_all_nodes()})
+        description += "\nEdges: %s" % ({node: self.get_edges(node) for node in self.get_all_nodes()})
+        return description
+
+    def _make_edge_store(self, size):
+        self._edge_from = np.zeros(size, dtype=np.int64)
+        self._edge_to = np.zeros(size, dtype=np.int64)
+        self._next_edge = np.full(size, -1, dtype=np.int64)
+        self._next_reverse_edge = np.full(size, -1, dtype=np.int64)
+        self._edge_is_removed = np.zeros(size, dtype=bool)
+        self._n_edges = 0
+        self._n_removed_edges = 0
+
+    def _ensure_node_capacity(self, n_nodes):
+        if n_nodes <= len(self._node_sizes):
+            return
+        self._node_sizes = _grow(self._node_sizes, n_nodes, 0)
+        self._sequence_starts = _grow(self._sequence_starts, n_nodes, 0)
+        self._node_exists = _grow(self._node_exists, n_nodes, False)
+        self._first_edge = _grow(self._first_edge, n_nodes, -1)
+        self._last_edge = _grow(self._last_edge, n_nodes, -1)
+        self._first_reverse_edge = _grow(self._first_reverse_edge, n_nodes, -1)
+        self._last_reverse_edge = _grow(self._last_reverse_edge, n_nodes, -1)
+
+    def _ensure_edge_capacity(self, n_edges):
+        if n_edges <= len(self._edge_from):
+            return
+        self._edge_from = _grow(self._edge_from, n_edges, 0)
+        self._edge_to = _grow(self._edge_to, n_edges, 0)
+        self._next_edge = _grow(self._next_edge, n_edges, -1)
+        self._next_reverse_edge = _grow(self._next_reverse_edge, n_edges, -1)
+        self._edge_is_removed = _grow(self._edge_is_removed, n_edges, False)
+
+    def _ensure_sequence_capacity(self, length):
+        if length > len(self._sequences):
+            self._sequences = _grow(self._sequences, length, 0)
+
+    def set_linear_ref_nodes(self, nodes):
+        self.linear_ref_nodes = nodes
+        self.linear_ref_nodes_set = set(nodes)
+
+    def _get_edge_dict(self, from_nodes, to_nodes):
+        # to_nodes grouped by from node, in the order the edges were added
+        edges = np.flatnonzero(~self._edge_is_removed[:self._n_edges])
+        from_nodes = from_nodes[edges]
+        sorting = np.argsort(from_nodes, kind="stable")
+        nodes, starts = np.unique(from_nodes[sorting], return_index=True)
+        to_nodes = np.split(to_nodes[edges][sorting], starts[1:]) if len(nodes) > 0 else []
+        return MappingProxyType({int(node): node_edges.tolist() for node, node_edges in zip(nodes, to_nodes)})
+
+    @property
+    def nodes(self):
+        return MappingProxyType({node: self.get_node_size(node) for node in self.get_all_nodes()})
+
+    @property
+    def node_sequences(self):
+        return MappingProxyType({node: self.get_node_sequence(node) for node in self.get_all_nodes()})
+
+    @property
+    def edges(self):
+        return self._get_edge_dict(self._edge_from, self._edge_to)
+
+    @property
+    def reverse_edges(self):
+        return self._get_edge_dict(self._edge_to, self._edge_from)
+
+    def get_reverse_edges(self):
+        # reverse edges are always kept up to date, this is only here to have the same interface as MutableGraph
+        return self.reverse_edges
+
+    def get_all_nodes(self):
+        return np.flatnonzero(self._node_exists).tolist()
+
+    def get_node_size(self, node):
+        return int(self._node_sizes[node])
+
+    def get_node_sequence(self, node):
+        start = self._sequence_starts[node]
+        return self._sequences[start:start + self._node_sizes[node]].tobytes().decode()
+
+    def add_node(self, id, sequence="", is_ref_node=False):
+        self._ensure_node_capacity(id + 1)
+        self._ensure_sequence_capacity(self._sequences_length + len(sequence))
+        self._sequences[self._sequences_length:self._sequences_length + len(sequence)] = np.frombuffer(sequence.encode(), dtype=np.uint8)
+        self._sequence_starts[id] = self._sequences_length
+        self._sequences_length += len(sequence)
+        self._node_sizes[id] = len(sequence)
+        self._node_exists[id] = True
+
+        if is_ref_node:
+            self.linear_ref_nodes.append(id)
+            self.linear_ref_nodes_set.add(id)
+
+    def add_nodes(self, node_ids, sequences, node_sizes):
+        # sequences is one buffer (bytes or uint8 array) with the sequences of the nodes after each other
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        node_sizes = np.asarray(node_sizes, dtype=np.int64)
+        if isinstance(sequences, (bytes, bytearray)):
+            sequences = np.frombuffer(sequences, dtype=np.uint8)
+        if len(node_ids) == 0:
+            return
+        self._ensure_node_capacity(int(np.max(node_ids)) + 1)
+        self._ensure_sequence_capacity(self._sequences_length + len(sequences))
+        self._sequences[self._sequences_length:self._sequences_length + len(sequences)] = sequences
+        self._sequence_starts[node_ids] = self._sequences_length + np.cumsum(node_sizes) - node_sizes
+        self._sequences_length += len(sequences)
+        self._node_sizes[node_ids] = node_sizes
+        self._node_exists[node_ids] = True
+
+    def get_edges(self, node):
+        if node >= len(self._first_edge):
+            return []
+        edges = []
+        edge = int(self._first_edge[node])
+        while edge != -1:
+            if not self._edge_is_removed[edge]:
+                edges.append(int(self._edge_to[edge]))
+            edge = int(self._next_edge[edge])
+        return edges
+
+    def get_nodes_before(self, node):
+        if node >= len(self._first_reverse_edge):
+            return []
+        nodes = []
+        edge = int(self._first_reverse_edge[node])
+        while edge != -1:
+            if not self._edge_is_removed[edge]:
+                nodes.append(int(self._edge_from[edge]))
+            edge = int(self._next_reverse_edge[edge])
+        return nodes
+
+    def add_edge(self, from_node, to_node):
+        self._ensure_node_capacity(max(from_node, to_node) + 1)
+        self._ensure_edge_capacity(self._n_edges + 1)
+        edge = self._n_edges
+        self._n_edges += 1
+        self._edge_from[edge] = from_node
+        self._edge_to[edge] = to_node
+        for node, first, last, next_edges in ((from_node, self._first_edge, self._last_edge, self._next_edge),
+                                              (to_node, self._first_reverse_edge, self._last_reverse_edge, self._next_reverse_edge)):
+            if last[node] == -1:
+                first[node] = edge
             else:
-                #print("   No sequence match")
-                continue
+                next_edges[last[node]] = edge
+            last[node] = edge
+
+    def add_edges(self, from_nodes, to_nodes):
+        # adds from_nodes[i] -> to_nodes[i] for all i, same as calling add_edge for each edge in order
+        from_nodes = np.asarray(from_nodes, dtype=np.int64)
+        to_nodes = np.asarray(to_nodes, dtype=np.int64)
+        if len(from_nodes) == 0:
+            return
+        self._ensure_node_capacity(int(max(np.max(from_nodes), np.max(to_nodes))) + 1)
+        self._ensure_edge_capacity(self._n_edges + len(from_nodes))
+        edges = np.arange(self._n_edges, self._n_edges + len(from_nodes))
+        self._n_edges += len(from_nodes)
+        self._edge_from[edges] = from_nodes
+        self._edge_to[edges] = to_nodes
+        self._link_edges(edges, from_nodes, self._first_edge, self._last_edge, self._next_edge)
+        self._link_edges(edges, to_nodes, self._first_reverse_edge, self._last_reverse_edge, self._next_reverse_edge)
+
+    @staticmethod
+    def _link_edges(edges, nodes, first, last, next_edges):
+        # appends the edges (in order) to the edge lists of the nodes
+        sorting = np.argsort(nodes, kind="stable")
+        edges = edges[sorting]
+        nodes = nodes[sorting]
+        is_new_node = np.append(True, nodes[1:] != nodes[:-1])
+        is_last_of_node = np.append(is_new_node[1:], True)
+        next_edges[edges[:-1][~is_last_of_node[:-1]]] = edges[1:][~is_last_of_node[:-1]]
+
+        nodes = nodes[is_new_node]
+        has_edges = last[nodes] != -1
+        next_edges[last[nodes[has_edges]]] = edges[is_new_node][has_edges]
+        first[nodes[~has_edges]] = edges[is_new_node][~has_edges]
+        last[nodes] = edges[is_last_of_node]
+
+    def remove_edge(self, from_node, to_node):
+        edge = int(self._first_edge[from_node]) if from_node < len(self._first_edge) else -1
+        while edge != -1 and (self._edge_is_removed[edge] or self._edge_to[edge] != to_node):
+            edge = int(self._next_edge[edge])
+        if edge == -1:
+            raise ValueError("There is no edge from %d to %d" % (from_node, to_node))
+
+        self._edge_is_removed[edge] = True
+        self._n_removed_edges += 1
+        if self._n_removed_edges > 1024 and 2 * self._n_removed_edges > self._n_edges:
+            self._compact_edges()
 
-        return result
+    def _compact_edges(self):
+        logging.debug("Removing %d removed edges" % self._n_removed_edges)
+        edges = np.flatnonzero(~self._edge_is_removed[:self._n_edges])
+        from_nodes = self._edge_from[edges]
+        to_nodes = self._edge_to[edges]
+        self._make_edge_store(max(16, 2 * len(edges)))
+        for node_array in (self._first_edge, self._last_edge, self._first_reverse_edge, self._last_reverse_edge):
+            node_array[:] = -1
+        self.add_edges(from_nodes, to_nodes)
 
+    find_nodes_from_node_that_matches_sequence = MutableGraph.find_nodes_from_node_that_matches_sequence
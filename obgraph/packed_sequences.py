@@ -0,0 +1,98 @@
+import logging
+import numpy as np
+from npstructures import RaggedArray
+
+# Numeric bases (0-3) take only 2 bits, so four bases are packed into each byte.
+# Base i of the buffer is stored in byte i // 4 at bit position 2 * (i % 4)
+_SHIFTS = np.array([0, 2, 4, 6], dtype=np.uint8)
+
+
+def pack_numeric_sequence(numeric_sequence):
+    numeric_sequence = np.asarray(numeric_sequence, dtype=np.uint8)
+    assert len(numeric_sequence) == 0 or np.max(numeric_sequence) <= 3, "Only numeric bases 0-3 can be packed"
+    padded = np.zeros((len(numeric_sequence) + 3) // 4 * 4, dtype=np.uint8)
+    padded[:len(numeric_sequence)] = numeric_sequence
+    return np.bitwise_or.reduce(padded.reshape(-1, 4) << _SHIFTS, axis=1).astype(np.uint8)
+
+
+def unpack_numeric_sequence(packed, start, end):
+    # returns the numeric bases in the base interval [start, end)
+    start = int(start)
+    end = int(end)
+    if end <= start:
+        return np.zeros(0, dtype=np.uint8)
+    bytes = packed[start // 4:(end + 3) // 4]
+    unpacked = ((bytes[:, None] >> _SHIFTS) & 3).astype(np.uint8).ravel()
+    return unpacked[start % 4:start % 4 + end - start]
+
+
+class PackedSequences:
+    """
+    Node sequences stored with 2 bits per base. Can be used in place of the
+    RaggedArray in Graph.sequences: indexing with a node gives the numeric sequence
+    of that node, and indexing with an array of nodes gives a RaggedArray.
+    """
+    def __init__(self, packed, offsets):
+        # offsets[node] is the base position of the node's sequence, offsets[-1] is the total number of bases
+        self.packed = packed
+        self.offsets = offsets
+
+    @classmethod
+    def from_numeric(cls, numeric_sequence, lengths):
+        offsets = np.zeros(len(lengths) + 1, dtype=np.uint64)
+        np.cumsum(lengths, out=offsets[1:])
+        assert offsets[-1] == len(numeric_sequence)
+        return cls(pack_numeric_sequence(numeric_sequence), offsets)
+
+    @classmethod
+    def from_ragged_array(cls, sequences):
+        logging.info("Packing %d bases" % sequences.size)
+        return cls.from_numeric(sequences.ravel(), sequences.lengths)
+
+    @classmethod
+    def concatenate(cls, sequences):
+        # sequences can be PackedSequences or RaggedArrays
+        return cls.from_numeric(np.concatenate([s.ravel() for s in sequences]),
+                                np.concatenate([s.lengths for s in sequences]))
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets).astype(np.int64)
+
+    @property
+    def size(self):
+        return int(self.offsets[-1])
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes + self.offsets.nbytes
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __eq__(self, other):
+        return len(self) == len(other) and np.all(self.lengths == other.lengths) and np.all(self.ravel() == other.ravel())
+
+    def ravel(self):
+        return unpack_numeric_sequence(self.packed, 0, self.size)
+
+    def _get_bases_at_positions(self, positions):
+        return ((self.packed[positions >> 2] >> ((positions & 3) << 1).astype(np.uint8)) & 3).astype(np.uint8)
+
+    def get_concatenated_sequence(self, nodes):
+        # numeric sequence of all nodes after each other, decoded in one vectorized operation
+        nodes = np.asarray(nodes)
+        starts = self.offsets[nodes].astype(np.int64)
+        lengths = self.offsets[nodes + 1].astype(np.int64) - starts
+        # base positions of all nodes: start of each node, then increasing by one within the node
+        row_starts = np.cumsum(lengths) - lengths
+        positions = np.arange(np.sum(lengths), dtype=np.int64) + np.repeat(starts - row_starts, lengths)
+        return self._get_bases_at_positions(positions)
+
+    def __getitem__(self, nodes):
+        if np.ndim(nodes) == 0:
+            return unpack_numeric_sequence(self.packed, self.offsets[nodes], self.offsets[nodes + 1])
+
+        nodes = np.asarray(nodes)
+        lengths = self.offsets[nodes + 1].astype(np.int64) - self.offsets[nodes].astype(np.int64)
+        return RaggedArray(self.get_concatenated_sequence(nodes), lengths, dtype=np.uint8)
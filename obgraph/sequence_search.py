@@ -0,0 +1,212 @@
+import logging
+import numpy as np
+from npstructures import RaggedArray
+
+# Finds all paths going out from a node where the node sequences together are a given sequence. Empty nodes
+# match anything and are passed through. Paths are found depth-first in edge order, with an explicit stack
+# instead of recursion, and are given in the same order as the old recursive search gave them.
+#
+# Works both on Graph (node sequences are compared as numeric bases, n is treated as a) and on the mutable graphs
+# (node sequences are compared as lower case ascii). max_paths stops the search after that many paths are found,
+# and max_depth is the maximum number of nodes in a path (no limit by default). Paths going through a cycle of
+# empty nodes are stopped when they get back to a node they have passed without matching any more of the sequence.
+
+# ascii to numeric base, as the node sequences of Graph are stored. Anything else never matches a node sequence
+_ascii_to_numeric = np.full(256, 255, dtype=np.uint8)
+for _bases, _value in [(b"Aa", 0), (b"Cc", 1), (b"Gg", 2), (b"Tt", 3), (b"Nn", 0)]:
+    _ascii_to_numeric[np.frombuffer(_bases, dtype=np.uint8)] = _value
+
+
+def _is_array_graph(graph):
+    return isinstance(getattr(graph, "edges", None), RaggedArray)
+
+
+def _get_row_function(ragged_array):
+    # rows are sliced from the flat array, which is much faster than indexing the RaggedArray one row at a time
+    data = ragged_array.ravel()
+    starts = ragged_array._shape.starts
+    lengths = ragged_array.lengths
+    return lambda row: data[starts[row]:starts[row] + lengths[row]] if row < len(starts) else data[:0]
+
+
+def _get_graph_functions(graph, sequence):
+    # returns functions giving the edges, size and comparable sequence (bytes) of a node, and the sequence as bytes
+    if not _is_array_graph(graph):
+        return graph.get_edges, graph.get_node_size, lambda node: graph.get_node_sequence(node).lower().encode(), sequence.lower().encode()
+
+    get_edges = _get_row_function(graph.edges)
+    if isinstance(graph.sequences, RaggedArray):
+        get_sequence = _get_row_function(graph.sequences)
+    else:
+        get_sequence = graph.get_numeric_node_sequence
+    return (lambda node: get_edges(node).tolist(), lambda node: int(graph.nodes[node]), lambda node: get_sequence(node).tobytes(),
+            _ascii_to_numeric[np.frombuffer(sequence.encode(), dtype=np.uint8)].tobytes())
+
+
+def find_paths_matching_sequence(graph, from_node, sequence, max_paths=None, max_depth=None):
+    # Returns one path (the one the old recursive search returned first: following the last matching node out of each
+    # node) and a list of all paths found
+    get_edges, get_node_size, get_node_sequence, sequence = _get_graph_functions(graph, sequence)
+
+    # each search state is a node on a path. parents[i] is the state before it, and offsets[i] how much of the
+    # sequence is matched when the path ends at the node
+    nodes = [from_node]
+    parents = [-1]
+    offsets = [0]
+    depths = [0]
+    last_children = [-1]
+    found = []
+    stack = [0]
+    while len(stack) > 0:
+        state = stack.pop()
+        offset = offsets[state]
+        if offset == len(sequence):
+            found.append(state)
+            if max_paths is not None and len(found) >= max_paths:
+                break
+            continue
+
+        if max_depth is not None and depths[state] >= max_depth:
+            logging.warning("Stopping sequence search from node %d at a path with %d nodes" % (from_node, depths[state]))
+            continue
+
+        first_child = len(nodes)
+        for next_node in get_edges(nodes[state]):
+            node_size = get_node_size(next_node)
+            if node_size == 0 and _is_in_empty_cycle(nodes, parents, offsets, state, next_node):
+                continue
+            if node_size == 0 or get_node_sequence(next_node) == sequence[offset:offset + node_size]:
+                nodes.append(next_node)
+                parents.append(state)
+                offsets.append(offset + node_size)
+                depths.append(depths[state] + 1)
+                last_children.append(-1)
+
+        if len(nodes) > first_child:
+            last_children[state] = len(nodes) - 1
+            stack.extend(range(len(nodes) - 1, first_child - 1, -1))
+
+    state = 0
+    while last_children[state] != -1:
+        state = last_children[state]
+
+    return _get_path(nodes, parents, state), [_get_path(nodes, parents, state) for state in found]
+
+
+def _is_in_empty_cycle(nodes, parents, offsets, state, next_node):
+    # whether the path ending at state has passed next_node without matching more of the sequence since then
+    offset = offsets[state]
+    while state != -1 and offsets[state] == offset:
+        if nodes[state] == next_node:
+            return True
+        state = parents[state]
+    return False
+
+
+def _get_path(nodes, parents, state):
+    path = []
+    while parents[state] != -1:
+        path.append(nodes[state])
+        state = parents[state]
+    return path[::-1]
+
+
+def find_paths_matching_sequences(graph, from_nodes, sequences, max_paths=None, max_depth=None):
+    # Batched version of find_paths_matching_sequence for a Graph. Returns a list with the paths found for each
+    # (from node, sequence) query, in the same order as find_paths_matching_sequence gives them.
+    # All queries are searched at the same time one node further at each step. A query is not searched further
+    # when max_paths paths are found for it, so with max_paths the paths with fewest nodes are given
+    assert _is_array_graph(graph), "Batched sequence search needs a Graph"
+    n_queries = len(from_nodes)
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+    sequence_starts = np.cumsum(lengths) - lengths
+    numeric_sequences = _ascii_to_numeric[np.frombuffer("".join(sequences).encode(), dtype=np.uint8)]
+
+    # search states of all steps. ranks is the index of the node in the edges of the node before it
+    state_queries = [np.arange(n_queries)]
+    state_nodes = [np.asarray(from_nodes, dtype=np.int64)]
+    state_parents = [np.full(n_queries, -1, dtype=np.int64)]
+    state_ranks = [np.zeros(n_queries, dtype=np.int64)]
+    state_offsets = [np.zeros(n_queries, dtype=np.int64)]
+    is_complete = [lengths == 0]
+    step_starts = [0]
+    n_found = is_complete[0].astype(np.int64)
+    n_states = n_queries
+    depth = 0
+    while max_depth is None or depth < max_depth:
+        is_searched = ~is_complete[-1]
+        if max_paths is not None:
+            is_searched &= n_found[state_queries[-1]] < max_paths
+        queries = state_queries[-1][is_searched]
+        if len(queries) == 0:
+            break
+        states = np.flatnonzero(is_searched) + step_starts[-1]
+        offsets = state_offsets[-1][is_searched]
+
+        next_nodes = graph.edges[state_nodes[-1][is_searched]]
+        n_next = next_nodes.lengths
+        parents = np.repeat(states, n_next)
+        queries = np.repeat(queries, n_next)
+        offsets = np.repeat(offsets, n_next)
+        ranks = np.arange(len(parents)) - np.repeat(np.cumsum(n_next) - n_next, n_next)
+        next_nodes = next_nodes.ravel().astype(np.int64)
+        node_sizes = graph.nodes[next_nodes].astype(np.int64)
+
+        # node sequences are compared with the sequence after the offset, base by base
+        is_compared = (node_sizes > 0) & (node_sizes <= lengths[queries] - offsets)
+        compared_sizes = node_sizes[is_compared]
+        node_sequences = graph.get_numeric_node_sequences(next_nodes[is_compared])
+        compared_starts = np.cumsum(compared_sizes) - compared_sizes
+        sequence_index = np.repeat(sequence_starts[queries[is_compared]] + offsets[is_compared] - compared_starts, compared_sizes) + np.arange(len(node_sequences))
+        n_mismatches = np.cumsum(np.concatenate([[0], node_sequences != numeric_sequences[sequence_index]]))
+        is_match = node_sizes == 0
+        is_match[is_match] = ~_is_in_empty_cycles(state_nodes, state_offsets, state_parents, step_starts, parents[is_match], next_nodes[is_match])
+        is_match[is_compared] = n_mismatches[compared_starts + compared_sizes] == n_mismatches[compared_starts]
+
+        offsets = offsets[is_match] + node_sizes[is_match]
+        step_starts.append(n_states)
+        state_queries.append(queries[is_match])
+        state_nodes.append(next_nodes[is_match])
+        state_parents.append(parents[is_match])
+        state_ranks.append(ranks[is_match])
+        state_offsets.append(offsets)
+        is_complete.append(offsets == lengths[state_queries[-1]])
+        n_found += np.bincount(state_queries[-1][is_complete[-1]], minlength=n_queries)
+        n_states += len(offsets)
+        depth += 1
+    else:
+        if np.any(~is_complete[-1]):
+            logging.warning("Stopping sequence search at paths with %d nodes" % max_depth)
+
+    state_queries = np.concatenate(state_queries)
+    state_nodes = np.concatenate(state_nodes)
+    state_parents = np.concatenate(state_parents)
+    state_ranks = np.concatenate(state_ranks)
+    paths = [[] for _ in range(n_queries)]
+    for state in np.flatnonzero(np.concatenate(is_complete)):
+        path = []
+        while state_parents[state] != -1:
+            path.append(state)
+            state = state_parents[state]
+        paths[state_queries[state]].append(path[::-1])
+
+    # depth-first order is the order of the edge ranks along the paths
+    return [[state_nodes[path].tolist() for path in sorted(query_paths, key=lambda path: state_ranks[path].tolist())][:max_paths]
+            for query_paths in paths]
+
+
+def _is_in_empty_cycles(state_nodes, state_offsets, state_parents, step_starts, parents, next_nodes):
+    # vectorized _is_in_empty_cycle, parents are states in the last step. The states before them are in the steps before
+    is_in_cycle = np.zeros(len(parents), dtype=bool)
+    offsets = state_offsets[-1][parents - step_starts[-1]]
+    is_checked = np.ones(len(parents), dtype=bool)
+    for step in range(len(step_starts) - 1, -1, -1):
+        local_states = parents[is_checked] - step_starts[step]
+        is_checked[is_checked] = state_offsets[step][local_states] == offsets[is_checked]
+        local_states = parents[is_checked] - step_starts[step]
+        is_in_cycle[is_checked] |= state_nodes[step][local_states] == next_nodes[is_checked]
+        parents[is_checked] = state_parents[step][local_states]
+        is_checked &= parents != -1
+        if not np.any(is_checked):
+            break
+    return is_in_cycle
@@ -38,7 +38,7 @@ def add_indel_dummy_nodes(graph):
     node_counter = node_ids[-1] + 1
 
     change_edges = {}
-    reverse_edges = graph.get_reverse_edges_dict()
+    reverse_edges = graph.reverse_edges
     # traverse graph, detect indels
     for node in node_ids:
         if node in linear_ref_set:
@@ -0,0 +1,448 @@
+import logging
+import numpy as np
+from npstructures import RaggedArray
+from .graph import Graph, numeric_to_ascii
+from .graph_construction import ArrayGraphConstructor
+from .haplotype_nodes import HaplotypeToNodes
+from .packed_sequences import PackedSequences
+from .variant_to_nodes import VariantToNodes
+from .variants import VcfVariant, VcfVariants
+
+# Adds new variants to an existing graph (with dummy nodes) without making the whole graph again.
+#
+# Every node covers the reference between a ref position before it and after it (as in ArrayGraphConstructor).
+# Variant nodes and dummy nodes touching the same junctions between reference bases as a new variant are connected to
+# it, so the graph is only changed in windows of reference where new variants overlap (directly or through old
+# variants). In each window, the old variants are read back from the graph, and the window is made again from the
+# reference with old and new variants, including dummy nodes. Nodes in the window graph that were in the old graph
+# (same ref positions and sequence) keep their old ids, and other nodes get new ids after max_node_id().
+#
+# A reference node split at new breakpoints keeps its id for the first part. The node id remap (NodeIdRemap) has
+# the parts of every split node, so that VariantToNodes and HaplotypeToNodes made from the old graph can be updated.
+
+_UNKNOWN = -2**62
+
+
+def _group_max(values, group_starts, n_groups, fill_value):
+    # max of values in groups of consecutive elements starting at group_starts
+    result = np.full(n_groups, fill_value, dtype=np.int64)
+    if len(values) > 0:
+        result[:] = np.maximum.reduceat(values, group_starts)
+    return result
+
+
+def get_node_ref_intervals(graph, max_iterations=1000):
+    # The linear ref offset before every node (last base before the node) and after it (first base after the node).
+    # Reference nodes get them from the linear ref index. Other nodes start after the latest end of the nodes going
+    # into them and end before the earliest start of the nodes going out of them (edges over deletions skip
+    # reference), which is repeated until nothing changes. Nodes not connected to the reference get _UNKNOWN
+    n_nodes = len(graph.nodes)
+    ref_nodes = graph.ref_offset_to_node.nodes.astype(np.int64)
+    ref_starts = graph.ref_offset_to_node.offsets[:-1].astype(np.int64)
+    is_ref = np.zeros(n_nodes, dtype=bool)
+    is_ref[ref_nodes] = True
+    before = np.full(n_nodes, _UNKNOWN, dtype=np.int64)
+    after = np.full(n_nodes, _UNKNOWN, dtype=np.int64)
+    before[ref_nodes] = ref_starts - 1
+    after[ref_nodes] = ref_starts + graph.nodes[ref_nodes].astype(np.int64)
+
+    from_nodes, to_nodes = graph.get_flat_edges()
+    from_nodes = from_nodes.astype(np.int64)
+    to_nodes = to_nodes.astype(np.int64)
+    # edges into and out of other nodes, grouped by the other node
+    is_into = ~is_ref[to_nodes]
+    sorting = np.argsort(to_nodes[is_into], kind="stable")
+    into_from = from_nodes[is_into][sorting]
+    into_nodes, into_starts = np.unique(to_nodes[is_into][sorting], return_index=True)
+    is_out_of = ~is_ref[from_nodes]
+    out_of_to = to_nodes[is_out_of]
+    out_of_nodes, out_of_starts = np.unique(from_nodes[is_out_of], return_index=True)
+
+    for i in range(max_iterations):
+        new_before = before.copy()
+        new_before[into_nodes] = _group_max(np.where(after[into_from] == _UNKNOWN, _UNKNOWN, after[into_from] - 1),
+                                            into_starts, len(into_nodes), _UNKNOWN)
+        # min as max of the negated values
+        new_after = after.copy()
+        new_after[out_of_nodes] = -_group_max(np.where(before[out_of_to] == _UNKNOWN, _UNKNOWN, -before[out_of_to] - 1),
+                                              out_of_starts, len(out_of_nodes), _UNKNOWN)
+        new_after[new_after == -_UNKNOWN] = _UNKNOWN
+        if np.all(new_before == before) and np.all(new_after == after):
+            break
+        before, after = new_before, new_after
+    else:
+        logging.warning("Ref positions of nodes did not converge after %d iterations" % max_iterations)
+
+    return before, after
+
+
+class NodeIdRemap:
+    # Old node ids that changed in a new graph: parts[i] are the nodes that nodes[i] became (in linear ref order),
+    # and is empty for removed nodes. All other node ids are the same in the new graph
+    def __init__(self, nodes, parts):
+        sorting = np.argsort(nodes, kind="stable")
+        self.nodes = np.asarray(nodes, dtype=np.int64)[sorting]
+        self.parts = parts[sorting]
+
+    def _get_changed(self, nodes):
+        index = np.minimum(np.searchsorted(self.nodes, nodes), max(len(self.nodes) - 1, 0))
+        is_changed = self.nodes[index] == nodes if len(self.nodes) > 0 else np.zeros(len(nodes), dtype=bool)
+        return index, is_changed
+
+    def map_nodes(self, nodes):
+        # the new id of each node (the first part of split nodes), -1 for removed nodes
+        nodes = np.asarray(nodes, dtype=np.int64)
+        index, is_changed = self._get_changed(nodes)
+        parts = self.parts[index[is_changed]]
+        first_parts = np.full(len(parts), -1, dtype=np.int64)
+        first_parts[parts.lengths > 0] = parts.ravel()[(np.cumsum(parts.lengths) - parts.lengths)[parts.lengths > 0]]
+        new_nodes = nodes.copy()
+        new_nodes[is_changed] = first_parts
+        return new_nodes
+
+    def expand_nodes(self, nodes):
+        # nodes (e.g. a path) with split nodes replaced by their parts and removed nodes left out.
+        # Also returns the number of new nodes for each node
+        nodes = np.asarray(nodes, dtype=np.int64)
+        index, is_changed = self._get_changed(nodes)
+        parts = self.parts[index[is_changed]]
+        n_new_nodes = np.ones(len(nodes), dtype=np.int64)
+        n_new_nodes[is_changed] = parts.lengths
+        new_nodes = np.repeat(nodes, n_new_nodes)
+        new_starts = np.cumsum(n_new_nodes) - n_new_nodes
+        new_nodes[np.repeat(new_starts[is_changed], parts.lengths) + np.arange(np.sum(parts.lengths)) -
+                  np.repeat(np.cumsum(parts.lengths) - parts.lengths, parts.lengths)] = parts.ravel()
+        return new_nodes, n_new_nodes
+
+    def update_variant_to_nodes(self, variant_to_nodes):
+        ref_nodes = self.map_nodes(variant_to_nodes.ref_nodes)
+        var_nodes = self.map_nodes(variant_to_nodes.var_nodes)
+        assert np.all(ref_nodes >= 0) and np.all(var_nodes >= 0), "Variant nodes have been removed from the graph"
+        return VariantToNodes(ref_nodes.astype(variant_to_nodes.ref_nodes.dtype), var_nodes.astype(variant_to_nodes.var_nodes.dtype))
+
+    def update_haplotype_to_nodes(self, haplotype_to_nodes):
+        nodes = haplotype_to_nodes._nodes
+        new_nodes, n_new_nodes = self.expand_nodes(nodes)
+        new_index = np.concatenate([[0], np.cumsum(n_new_nodes)])
+        index = haplotype_to_nodes._haplotype_to_index.astype(np.int64)
+        n = haplotype_to_nodes._haplotype_to_n_nodes.astype(np.int64)
+        return HaplotypeToNodes(new_index[index].astype(haplotype_to_nodes._haplotype_to_index.dtype),
+                                (new_index[index + n] - new_index[index]).astype(haplotype_to_nodes._haplotype_to_n_nodes.dtype),
+                                new_nodes.astype(nodes.dtype))
+
+    def to_file(self, file_name):
+        np.savez(file_name, nodes=self.nodes, parts=self.parts.ravel(), parts_lengths=self.parts.lengths)
+
+    @classmethod
+    def from_file(cls, file_name):
+        try:
+            data = np.load(file_name)
+        except FileNotFoundError:
+            data = np.load(file_name + ".npz")
+
+        return cls(data["nodes"], RaggedArray(data["parts"], data["parts_lengths"]))
+
+
+class VariantInserter:
+    # Window graphs are made with variants on this chromosome name
+    _window_chromosome = "window"
+
+    def __init__(self, graph, variants):
+        self.graph = graph
+        self.variants = variants
+        self._node_remap = None
+
+    def get_node_remap(self):
+        return self._node_remap
+
+    def node_remap_to_file(self, file_name):
+        self._node_remap.to_file(file_name)
+
+    def _get_chromosome_offset(self, chromosome):
+        # chromosomes can be given as int or str (e.g. 1 and "1")
+        if chromosome not in self.graph.chromosome_start_nodes:
+            matching = [graph_chromosome for graph_chromosome in self.graph.chromosome_start_nodes if str(graph_chromosome) == str(chromosome)]
+            if len(matching) != 1:
+                raise KeyError("Variant chromosome %s is not in the graph. Chromosomes are %s" % (chromosome, list(self.graph.chromosome_start_nodes.keys())))
+            chromosome = matching[0]
+        return self.graph.convert_chromosome_ref_offset_to_graph_ref_offset(0, chromosome)
+
+    def _set_new_variant_arrays(self):
+        # ref positions of new variants on the linear reference of the graph
+        chromosome_offsets = {}
+        before = []
+        after = []
+        offsets = []
+        for variant in self.variants:
+            if variant.chromosome not in chromosome_offsets:
+                chromosome_offsets[variant.chromosome] = self._get_chromosome_offset(variant.chromosome)
+            offset = chromosome_offsets[variant.chromosome]
+            offsets.append(offset)
+            before.append(offset + variant.get_reference_position_before_variant())
+            after.append(offset + variant.get_reference_position_after_variant())
+
+        self._new_variant_offsets = np.array(offsets, dtype=np.int64)
+        self._new_variant_before = np.array(before, dtype=np.int64)
+        self._new_variant_after = np.array(after, dtype=np.int64)
+
+    def _set_old_variant_arrays(self):
+        # Old variants are variant nodes and dummy nodes, and edges over deletions without dummy nodes
+        before, after = self._node_before, self._node_after
+        nodes = np.flatnonzero((self.graph.linear_ref_nodes_index == 0) & (before != _UNKNOWN) & (after != _UNKNOWN))
+        nodes = nodes[nodes > 0]
+        from_nodes, to_nodes = self.graph.get_flat_edges()
+        from_nodes = from_nodes.astype(np.int64)
+        to_nodes = to_nodes.astype(np.int64)
+        is_known = (after[from_nodes] != _UNKNOWN) & (before[to_nodes] != _UNKNOWN)
+        is_deletion_edge = is_known & (self.graph.nodes[from_nodes] > 0) & (self.graph.nodes[to_nodes] > 0) & \
+            (after[from_nodes] - 1 < before[to_nodes])
+
+        self._old_variant_nodes = np.concatenate([nodes, np.full(np.sum(is_deletion_edge), -1, dtype=np.int64)])
+        self._old_variant_before = np.concatenate([before[nodes], after[from_nodes[is_deletion_edge]] - 1])
+        self._old_variant_after = np.concatenate([after[nodes], before[to_nodes[is_deletion_edge]] + 1])
+        logging.info("Found %d variant and dummy nodes and %d deletion edges in graph" % (len(nodes), np.sum(is_deletion_edge)))
+
+    def _find_windows(self):
+        # Old and new variants touching the same junctions between reference bases (junction i is before base i) are
+        # put in the same window. Windows with new variants are extended to whole reference nodes, and windows
+        # sharing reference nodes are merged. Returns the first and last linear ref node index of each window and
+        # the window of every old and new variant (-1 if not in a window)
+        n_old = len(self._old_variant_nodes)
+        if len(self._new_variant_before) == 0:
+            no_windows = np.zeros(0, dtype=np.int64)
+            return no_windows, no_windows, np.full(n_old, -1, dtype=np.int64), no_windows
+        starts = np.concatenate([self._old_variant_before, self._new_variant_before]) + 1
+        ends = np.concatenate([self._old_variant_after, self._new_variant_after])
+        is_new = np.arange(len(starts)) >= n_old
+        sorting = np.argsort(starts, kind="stable")
+        running_ends = np.maximum.accumulate(ends[sorting])
+        components = np.cumsum(np.concatenate([[True], starts[sorting][1:] > running_ends[:-1]])) - 1
+        component_starts = np.flatnonzero(np.concatenate([[True], np.diff(components) > 0]))
+        has_new = np.bincount(components, weights=is_new[sorting]) > 0
+
+        first_junctions = starts[sorting][component_starts][has_new]
+        last_junctions = running_ends[np.append(component_starts[1:], len(sorting)) - 1][has_new]
+        ref_starts = self._ref_starts
+        first_ref = np.searchsorted(ref_starts, first_junctions - 1, side="right") - 1
+        last_ref = np.searchsorted(ref_starts, last_junctions, side="right") - 1
+        previous_last_ref = np.maximum.accumulate(np.concatenate([[-1], last_ref[:-1]]))
+        window_of_component = np.full(len(has_new), -1, dtype=np.int64)
+        window_of_component[has_new] = np.cumsum(first_ref > previous_last_ref) - 1
+        is_first = first_ref > previous_last_ref
+        window_first_ref = first_ref[is_first]
+        window_last_ref = np.maximum.reduceat(last_ref, np.flatnonzero(is_first)) if len(last_ref) > 0 else last_ref
+
+        variant_windows = np.empty(len(starts), dtype=np.int64)
+        variant_windows[sorting] = window_of_component[components]
+        logging.info("Adding %d variants in %d windows" % (np.sum(is_new), len(window_first_ref)))
+        return window_first_ref, window_last_ref, variant_windows[:n_old], variant_windows[n_old:]
+
+    def _get_old_variant(self, node, before, after, reference, shift):
+        # A VcfVariant that makes the variant node (or deletion) in the windows graph, where ref positions are
+        # shifted by shift. None for insertion dummy nodes
+        position = before + shift + 1
+        reference_bases = numeric_to_ascii[reference[before + shift:after + shift]].tobytes().decode()
+        if node >= 0 and self.graph.nodes[node] > 0:
+            sequence = self.graph.get_nodes_sequence([node])
+            if after - before == 1:
+                return VcfVariant(self._window_chromosome, position, reference_bases[0], reference_bases[0] + sequence, type="INSERTION")
+            elif after - before == 2 and len(sequence) == 1:
+                return VcfVariant(self._window_chromosome, position + 1, reference_bases[1], sequence, type="SNP")
+            return VcfVariant(self._window_chromosome, position, reference_bases, reference_bases[0] + sequence, type="SUBSTITUTION")
+        elif after - before > 1:
+            return VcfVariant(self._window_chromosome, position, reference_bases, reference_bases[0], type="DELETION")
+        return None
+
+    @staticmethod
+    def _get_variant_key(variant):
+        # variants giving the same node (or deletion)
+        return (variant.get_reference_position_before_variant(), variant.get_reference_position_after_variant(),
+                variant.get_variant_sequence().upper(), variant.type == "DELETION")
+
+    def _get_old_variant_order(self, old_variants):
+        # Sort keys giving old variants at the same position in the order they had in the vcf. Variant nodes and dummy
+        # nodes both have ids in vcf order, so deletions are put right before the insertion with the next dummy node
+        # (insertions and their dummy nodes are paired in id order). Other deletions come last
+        nodes = self._old_variant_nodes[old_variants]
+        before = self._old_variant_before[old_variants]
+        is_insertion_span = self._old_variant_after[old_variants] - before == 1
+        is_node = nodes >= 0
+        is_dummy = is_node & (self.graph.nodes[np.maximum(nodes, 0)] == 0)
+        keys = np.where(is_node & ~is_dummy, 2.0 * nodes, np.inf)
+        sorting = np.argsort(before, kind="stable")
+        positions = np.unique(before[is_dummy & ~is_insertion_span])
+        for lo, hi in zip(np.searchsorted(before[sorting], positions, side="left"), np.searchsorted(before[sorting], positions, side="right")):
+            at_position = sorting[lo:hi]
+            insertion_nodes = np.sort(nodes[at_position][is_insertion_span[at_position] & is_node[at_position] & ~is_dummy[at_position]])
+            insertion_dummies = np.sort(nodes[at_position][is_insertion_span[at_position] & is_dummy[at_position]])[:len(insertion_nodes)]
+            deletions = at_position[~is_insertion_span[at_position] & is_dummy[at_position]]
+            next_insertion = np.searchsorted(insertion_dummies, nodes[deletions])
+            has_next = next_insertion < len(insertion_dummies)
+            keys[deletions[has_next]] = 2.0 * insertion_nodes[next_insertion[has_next]] - 1
+        return keys
+
+    def _make_windows_graph(self, window_first_ref, window_last_ref, old_variant_windows, new_variant_windows):
+        # One graph of the reference of all windows after each other, with the old and new variants in the windows.
+        # Windows are separated by one base with a SNP, so that no reference node goes over two windows
+        window_starts = self._ref_starts[window_first_ref]
+        window_lengths = self._ref_starts[window_last_ref + 1] - window_starts
+        self._window_offsets = np.cumsum(window_lengths + 1) - window_lengths - 1
+        self._window_shifts = self._window_offsets - window_starts
+        n_ref_nodes = window_last_ref - window_first_ref + 1
+        ref_node_indexes = np.arange(np.sum(n_ref_nodes)) + np.repeat(window_first_ref - (np.cumsum(n_ref_nodes) - n_ref_nodes), n_ref_nodes)
+        reference = np.insert(self.graph.get_numeric_node_sequences(self._ref_nodes[ref_node_indexes]), np.cumsum(window_lengths)[:-1], 0)
+
+        variants = []
+        order_keys = []
+        old_variant_keys = set()
+        old_variants = np.flatnonzero(old_variant_windows >= 0)
+        for old_variant, order_key in zip(old_variants, self._get_old_variant_order(old_variants)):
+            variant = self._get_old_variant(self._old_variant_nodes[old_variant], int(self._old_variant_before[old_variant]),
+                                            int(self._old_variant_after[old_variant]), reference,
+                                            int(self._window_shifts[old_variant_windows[old_variant]]))
+            # a deletion with a dummy node is also found as an edge over the deletion
+            if variant is not None and (variant.type != "DELETION" or self._get_variant_key(variant) not in old_variant_keys):
+                old_variant_keys.add(self._get_variant_key(variant))
+                variants.append(variant)
+                order_keys.append(order_key)
+
+        for new_variant, window in enumerate(new_variant_windows):
+            variant = self.variants[new_variant].copy()
+            variant.chromosome = self._window_chromosome
+            variant.position = int(variant.position + self._new_variant_offsets[new_variant] + self._window_shifts[window])
+            if self._get_variant_key(variant) in old_variant_keys:
+                logging.info("Variant %s is already in the graph" % self.variants[new_variant])
+                continue
+            variants.append(variant)
+            order_keys.append(np.inf)
+
+        for separator in self._window_offsets[1:] - 1:
+            variants.append(VcfVariant(self._window_chromosome, int(separator) + 1, "A", "C", type="SNP"))
+            order_keys.append(np.inf)
+
+        # Variants are sorted by the ref position before them (the order of indels at different positions and of
+        # variant nodes at the same position is what matters), and new variants come after old variants
+        variants = [variants[i] for i in np.lexsort((order_keys, [variant.get_reference_position_before_variant() for variant in variants]))]
+        logging.info("Making graph of %d windows with %d variants" % (len(window_starts), len(variants)))
+        return ArrayGraphConstructor(reference, VcfVariants(variants), reference_is_numeric=True).get_graph_with_dummy_nodes()
+
+    @staticmethod
+    def _get_node_key(graph, node, before, after):
+        if graph.nodes[node] == 0:
+            return int(before), int(after)
+        return int(before), int(after), graph.get_numeric_node_sequence(node).tobytes()
+
+    def _get_windows_graph_node_ids(self, windows_graph, old_nodes):
+        # New ids of the nodes in the windows graph. Reference nodes keep the id of the old reference node starting
+        # at the same position, and other nodes the id of an old node with the same ref positions (and sequence).
+        # Also returns the window of each node and the separator nodes between the windows
+        before, after = get_node_ref_intervals(windows_graph)
+        node_windows = np.searchsorted(self._window_offsets, before + 1, side="right") - 1
+        before = before - self._window_shifts[node_windows]
+        after = after - self._window_shifts[node_windows]
+        ref_nodes = windows_graph.ref_offset_to_node.nodes.astype(np.int64)
+        ref_starts = windows_graph.ref_offset_to_node.offsets[:-1].astype(np.int64)
+        separators = self._window_offsets[1:] - 1
+        is_ref = np.zeros(len(windows_graph.nodes), dtype=bool)
+        is_ref[ref_nodes] = True
+        is_separator = np.zeros(len(windows_graph.nodes), dtype=bool)
+        is_separator[ref_nodes[np.isin(ref_starts, separators)]] = True
+        is_separator[~is_ref & np.isin(before + self._window_shifts[node_windows], separators - 1)] = True
+        is_separator[0] = True
+        node_ids = np.full(len(windows_graph.nodes), -1, dtype=np.int64)
+
+        window_ref_nodes = ref_nodes[~is_separator[ref_nodes]]
+        old_ref_index = np.minimum(np.searchsorted(self._ref_starts, before[window_ref_nodes] + 1), len(self._ref_nodes) - 1)
+        is_old = self._ref_starts[old_ref_index] == before[window_ref_nodes] + 1
+        node_ids[window_ref_nodes[is_old]] = self._ref_nodes[old_ref_index[is_old]]
+
+        old_nodes_by_key = {}
+        for node in old_nodes:
+            old_nodes_by_key.setdefault(self._get_node_key(self.graph, node, self._node_before[node], self._node_after[node]), []).append(node)
+
+        for node in np.flatnonzero(~is_ref & ~is_separator):
+            matching_nodes = old_nodes_by_key.get(self._get_node_key(windows_graph, node, before[node], after[node]), [])
+            if len(matching_nodes) > 0:
+                node_ids[node] = matching_nodes.pop(0)
+
+        is_new = (node_ids == -1) & ~is_separator
+        node_ids[is_new] = np.arange(np.sum(is_new)) + self.graph.max_node_id() + 1
+        return node_ids, node_windows, is_separator, before + 1
+
+    def create_new_graph(self):
+        graph = self.graph
+        self._ref_nodes = graph.ref_offset_to_node.nodes.astype(np.int64)
+        self._ref_starts = graph.ref_offset_to_node.offsets.astype(np.int64)
+        logging.info("Finding ref positions of nodes")
+        self._node_before, self._node_after = get_node_ref_intervals(graph)
+        self._set_new_variant_arrays()
+        self._set_old_variant_arrays()
+        window_first_ref, window_last_ref, old_variant_windows, new_variant_windows = self._find_windows()
+        n_windows = len(window_first_ref)
+        if n_windows == 0:
+            self._node_remap = NodeIdRemap(np.zeros(0, dtype=np.int64), RaggedArray(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)))
+            return graph
+
+        windows_graph = self._make_windows_graph(window_first_ref, window_last_ref, old_variant_windows, new_variant_windows)
+        old_nodes = self._old_variant_nodes[old_variant_windows >= 0]
+        old_nodes = np.unique(old_nodes[old_nodes >= 0])
+        node_ids, node_windows, is_separator, node_starts = self._get_windows_graph_node_ids(windows_graph, old_nodes)
+        window_nodes = np.flatnonzero(~is_separator)
+        window_from_nodes, window_to_nodes = windows_graph.get_flat_edges()
+        is_window_edge = ~is_separator[window_from_nodes] & ~is_separator[window_to_nodes]
+
+        # the last reference node of each window goes to where the last old reference node of the window went
+        window_ref_nodes = windows_graph.ref_offset_to_node.nodes.astype(np.int64)
+        window_ref_nodes = window_ref_nodes[~is_separator[window_ref_nodes]]
+        window_ref_starts = np.searchsorted(node_windows[window_ref_nodes], np.arange(n_windows + 1))
+        last_ref_nodes = node_ids[window_ref_nodes[window_ref_starts[1:] - 1]]
+        old_last_ref_edges = graph.edges[self._ref_nodes[window_last_ref]]
+
+        # window reference nodes replace the old reference nodes of the windows in the linear reference
+        linear_ref_nodes = []
+        previous_last_ref = -1
+        for window, (first_ref, last_ref) in enumerate(zip(window_first_ref, window_last_ref)):
+            linear_ref_nodes.append(self._ref_nodes[previous_last_ref + 1:first_ref])
+            linear_ref_nodes.append(node_ids[window_ref_nodes[window_ref_starts[window]:window_ref_starts[window + 1]]])
+            previous_last_ref = last_ref
+        linear_ref_nodes.append(self._ref_nodes[previous_last_ref + 1:])
+
+        # old reference nodes are split into the window reference nodes starting inside them, and old variant and
+        # dummy nodes that are not in the windows graph are removed
+        old_ref_index = np.searchsorted(self._ref_starts, node_starts[window_ref_nodes], side="right") - 1
+        n_parts = np.bincount(old_ref_index, minlength=len(self._ref_nodes))
+        is_split = n_parts > 1
+        removed_nodes = np.setdiff1d(old_nodes, node_ids)
+        self._node_remap = NodeIdRemap(np.concatenate([self._ref_nodes[is_split], removed_nodes]),
+                                       RaggedArray(node_ids[window_ref_nodes][is_split[old_ref_index]],
+                                                   np.concatenate([n_parts[is_split], np.zeros(len(removed_nodes), dtype=np.int64)])))
+        logging.info("%d old reference nodes were split and %d old nodes were removed" % (np.sum(is_split), len(removed_nodes)))
+
+        # nodes and edges outside the windows are kept. Removed nodes are kept as empty nodes without edges
+        is_replaced = np.zeros(len(graph.nodes), dtype=bool)
+        n_window_ref_nodes = window_last_ref - window_first_ref + 1
+        is_replaced[self._ref_nodes[np.arange(np.sum(n_window_ref_nodes)) + np.repeat(
+            window_first_ref - (np.cumsum(n_window_ref_nodes) - n_window_ref_nodes), n_window_ref_nodes)]] = True
+        is_replaced[old_nodes] = True
+        kept_nodes = np.flatnonzero(~is_replaced)[1:]
+        old_from_nodes, old_to_nodes = graph.get_flat_edges()
+        is_kept_edge = ~is_replaced[old_from_nodes]
+        logging.info("Made %d new nodes" % (np.max(node_ids) - graph.max_node_id()))
+
+        node_ids_array = np.concatenate([kept_nodes, removed_nodes, node_ids[window_nodes]])
+        node_sizes = np.concatenate([graph.nodes[kept_nodes], np.zeros(len(removed_nodes), dtype=graph.nodes.dtype), windows_graph.nodes[window_nodes]])
+        sequences = np.concatenate([graph.get_numeric_node_sequences(kept_nodes), windows_graph.get_numeric_node_sequences(window_nodes)])
+        from_nodes = np.concatenate([old_from_nodes[is_kept_edge].astype(np.int64), node_ids[window_from_nodes[is_window_edge]],
+                                     np.repeat(last_ref_nodes, old_last_ref_edges.lengths)])
+        to_nodes = np.concatenate([old_to_nodes[is_kept_edge].astype(np.int64), node_ids[window_to_nodes[is_window_edge]],
+                                   old_last_ref_edges.ravel().astype(np.int64)])
+
+        new_graph = Graph.from_arrays(node_ids_array, node_sizes, sequences, from_nodes, to_nodes, np.concatenate(linear_ref_nodes),
+                                      chromosome_start_nodes=graph.chromosome_start_nodes, sequences_are_numeric=True,
+                                      pack_sequences=isinstance(graph.sequences, PackedSequences))
+        if graph.allele_frequencies is not None:
+            # new nodes get allele frequency 1.0, as set_allele_frequencies_from_variants does for nodes without variants
+            new_graph.allele_frequencies = np.ones(len(new_graph.nodes), dtype=graph.allele_frequencies.dtype)
+            new_graph.allele_frequencies[:len(graph.allele_frequencies)] = graph.allele_frequencies
+
+        return new_graph
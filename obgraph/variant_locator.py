@@ -0,0 +1,224 @@
+import logging
+import numpy as np
+from npstructures import RaggedArray
+from .variants import VcfVariant
+
+# Finds the reference and variant node of many variants at once. The common cases (SNPs, deletions and
+# insertions with a single, unambiguous node candidate) are resolved with array operations on the linear
+# ref index and the edge CSR, giving the same result as Graph.get_variant_nodes. All other variants
+# are passed on to Graph.get_variant_nodes one by one.
+
+# ascii to numeric base. n is treated as a (as in Graph.find_nodes_from_node_that_matches_sequence),
+# anything else is invalid
+_INVALID = 255
+_ascii_to_numeric = np.full(256, _INVALID, dtype=np.uint8)
+for _bases, _value in [(b"Aa", 0), (b"Cc", 1), (b"Gg", 2), (b"Tt", 3), (b"Nn", 0)]:
+    _ascii_to_numeric[np.frombuffer(_bases, dtype=np.uint8)] = _value
+
+
+def _sequences_to_numeric(sequences):
+    # returns a RaggedArray with the numeric version of each sequence
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+    buffer = np.frombuffer("".join(sequences).encode(), dtype=np.uint8)
+    return RaggedArray(_ascii_to_numeric[buffer], lengths, dtype=np.uint8)
+
+
+def _contains_n(sequences):
+    return np.array([("n" in sequence or "N" in sequence) for sequence in sequences], dtype=bool)
+
+
+def _get_neighbours(graph, nodes):
+    # all edges out of the given nodes as flat arrays (index of node in nodes, next node), in edge order
+    edges = graph.edges[nodes]
+    rows = np.repeat(np.arange(len(nodes)), edges.lengths)
+    return rows, edges.ravel()
+
+
+def _any_per_row(rows, values, n_rows):
+    return np.bincount(rows[values], minlength=n_rows) > 0
+
+
+def _count_per_row(rows, values, n_rows):
+    return np.bincount(rows[values], minlength=n_rows)
+
+
+class BatchVariantLocator:
+    def __init__(self, graph):
+        self._graph = graph
+        self._linear_ref_length = graph.linear_ref_length()
+
+    def _get_graph_ref_offsets(self, chromosomes, positions):
+        # offset of each variant position on the linear ref of the whole graph
+        # (-1 where the chromosome is not in the graph, these go to the slow path)
+        offsets = np.full(len(positions), -1, dtype=np.int64)
+        unique_chromosomes, inverse = np.unique(np.asarray(chromosomes).astype(str), return_inverse=True)
+        chromosome_keys = {str(chromosome): chromosome for chromosome in self._graph.chromosome_start_nodes}
+        for i, chromosome in enumerate(unique_chromosomes):
+            if chromosome not in chromosome_keys:
+                continue
+            start_node = self._graph.chromosome_start_nodes[chromosome_keys[chromosome]]
+            chromosome_offset = int(self._graph.get_ref_offset_at_node(start_node))
+            is_chromosome = inverse == i
+            offsets[is_chromosome] = chromosome_offset + positions[is_chromosome]
+
+        return offsets
+
+    def _nodes_at(self, ref_offsets, valid):
+        # node and offset in node at ref offsets, for the offsets where valid is True (and that are inside the linear ref)
+        valid = valid & (ref_offsets >= 0) & (ref_offsets < self._linear_ref_length)
+        nodes = np.zeros(len(ref_offsets), dtype=np.uint32)
+        node_offsets = np.full(len(ref_offsets), -1, dtype=np.int64)
+        nodes[valid] = self._graph.get_node_at_ref_offset(ref_offsets[valid])
+        node_offsets[valid] = self._graph.get_node_offset_at_ref_offset(ref_offsets[valid])
+        return nodes, node_offsets, valid
+
+    def _locate_snps(self, ref_offsets, variant_sequences):
+        # Same as Graph.get_snp_nodes when the node before the SNP has no empty nodes going out
+        # and exactly one of the next nodes has the variant base
+        graph = self._graph
+        n = len(ref_offsets)
+        numeric_sequences = _sequences_to_numeric(variant_sequences)
+        single_base = np.flatnonzero(numeric_sequences.lengths == 1)
+        variant_bases = np.full(n, _INVALID, dtype=np.uint8)
+        variant_bases[single_base] = numeric_sequences.ravel()[(np.cumsum(numeric_sequences.lengths) - 1)[single_base]]
+        ok = variant_bases != _INVALID
+
+        ref_nodes, ref_node_offsets, ok = self._nodes_at(ref_offsets, ok & (ref_offsets >= 1))
+        ok &= ref_node_offsets == 0
+        prev_nodes, _, ok = self._nodes_at(ref_offsets - 1, ok)
+
+        rows, next_nodes = _get_neighbours(graph, prev_nodes)
+        next_sizes = graph.nodes[next_nodes]
+        ok &= ~_any_per_row(rows, next_sizes == 0, n)
+
+        is_match = next_sizes == 1
+        is_match[is_match] = graph.get_numeric_node_sequences(next_nodes[is_match]) == variant_bases[rows[is_match]]
+        ok &= _count_per_row(rows, is_match, n) == 1
+
+        var_nodes = np.zeros(n, dtype=np.uint32)
+        var_nodes[rows[is_match]] = next_nodes[is_match]
+
+        # the snp node must share a next node with the ref node
+        ok &= self._shares_next_node(ref_nodes, var_nodes, ok)
+        return ref_nodes, var_nodes, ok
+
+    def _shares_next_node(self, nodes, other_nodes, valid):
+        shares = np.zeros(len(nodes), dtype=bool)
+        indexes = np.flatnonzero(valid)
+        rows, next_nodes = _get_neighbours(self._graph, other_nodes[indexes])
+        has_edge = self._graph.has_edges(nodes[indexes][rows], next_nodes)
+        shares[indexes] = _any_per_row(rows, has_edge, len(indexes))
+        return shares
+
+    def _locate_deletions(self, ref_offsets, ref_lengths):
+        # Same as Graph.get_deletion_nodes when there is exactly one empty node going out from the node before the deletion
+        graph = self._graph
+        n = len(ref_offsets)
+        deletion_lengths = ref_lengths - 1
+        ref_nodes, ref_node_offsets, ok = self._nodes_at(ref_offsets, ref_offsets >= 1)
+        ok &= ref_node_offsets == 0
+        prev_nodes, _, ok = self._nodes_at(ref_offsets - 1, ok)
+        _, next_ref_node_offsets, ok = self._nodes_at(ref_offsets + deletion_lengths, ok)
+        ok &= next_ref_node_offsets == 0
+
+        rows, next_nodes = _get_neighbours(graph, prev_nodes)
+        is_empty = graph.nodes[next_nodes] == 0
+        ok &= _count_per_row(rows, is_empty, n) == 1
+        var_nodes = np.zeros(n, dtype=np.uint32)
+        var_nodes[rows[is_empty]] = next_nodes[is_empty]
+        return ref_nodes, var_nodes, ok
+
+    def _locate_insertions(self, ref_offsets, variant_sequences):
+        # Same as Graph.get_insertion_nodes when no non-reference node going out from the node before the insertion
+        # is longer than the inserted sequence and there is exactly one empty node going to the next ref node
+        graph = self._graph
+        n = len(ref_offsets)
+        inserted_sequences = [sequence[1:] for sequence in variant_sequences]
+        inserted = _sequences_to_numeric(inserted_sequences)
+        insertion_lengths = inserted.lengths
+        ok = ~_contains_n(inserted_sequences) & (insertion_lengths > 0)
+        ok &= np.bincount(np.repeat(np.arange(n), insertion_lengths)[inserted.ravel() == _INVALID], minlength=n) == 0
+
+        nodes, node_offsets, ok = self._nodes_at(ref_offsets - 1, ok)
+        ok &= node_offsets == graph.nodes[nodes].astype(np.int64) - 1
+        next_ref_nodes, _, ok = self._nodes_at(ref_offsets, ok)
+
+        rows, next_nodes = _get_neighbours(graph, nodes)
+        next_sizes = graph.nodes[next_nodes].astype(np.int64)
+        is_candidate = (graph.linear_ref_nodes_index[next_nodes] == 0) & (next_sizes > 0)
+        ok &= ~_any_per_row(rows, is_candidate & (next_sizes > insertion_lengths[rows]), n)
+
+        # compare sequences of candidates having the same length as the insertion
+        is_candidate &= next_sizes == insertion_lengths[rows]
+        candidate_rows = rows[is_candidate]
+        candidate_sequences = graph.get_numeric_node_sequences(next_nodes[is_candidate])
+        inserted_per_candidate = inserted[candidate_rows].ravel()
+        candidate_ids = np.repeat(np.arange(len(candidate_rows)), insertion_lengths[candidate_rows])
+        n_mismatches = np.bincount(candidate_ids[candidate_sequences != inserted_per_candidate], minlength=len(candidate_rows))
+        is_match = np.zeros(len(next_nodes), dtype=bool)
+        is_match[is_candidate] = n_mismatches == 0
+        is_match[is_match] = graph.has_edges(next_nodes[is_match], next_ref_nodes[rows[is_match]])
+        ok &= _any_per_row(rows, is_match, n)
+
+        # variant node is the first matching node in edge order
+        var_nodes = np.zeros(n, dtype=np.uint32)
+        matching_rows, first = np.unique(rows[is_match], return_index=True)
+        var_nodes[matching_rows] = next_nodes[is_match][first]
+
+        is_dummy = graph.nodes[next_nodes] == 0
+        is_dummy[is_dummy] = graph.has_edges(next_nodes[is_dummy], next_ref_nodes[rows[is_dummy]])
+        ok &= _count_per_row(rows, is_dummy, n) == 1
+        dummy_nodes = np.zeros(n, dtype=np.uint32)
+        dummy_nodes[rows[is_dummy]] = next_nodes[is_dummy]
+        return dummy_nodes, var_nodes, ok
+
+    def locate(self, chromosomes, positions, types, ref_sequences, variant_sequences, variants=None):
+        """
+        Returns arrays ref_nodes, var_nodes. Input is one array/list per variant property (positions are 1-based vcf positions).
+        If variants (objects with the same properties) are given, these are used for variants that need the slow path
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        types = np.asarray(types).astype(str)
+        n = len(positions)
+        ref_nodes = np.zeros(n, dtype=np.uint32)
+        var_nodes = np.zeros(n, dtype=np.uint32)
+        is_found = np.zeros(n, dtype=bool)
+        graph_offsets = self._get_graph_ref_offsets(chromosomes, positions)
+        in_graph = graph_offsets >= 0
+
+        for type, locate_function, offset_shift, sequences in [
+                ("SNP", self._locate_snps, -1, variant_sequences),
+                ("DELETION", self._locate_deletions, 0, ref_sequences),
+                ("INSERTION", self._locate_insertions, 0, variant_sequences)]:
+            indexes = np.flatnonzero((types == type) & in_graph)
+            if len(indexes) == 0:
+                continue
+            type_sequences = [sequences[i] for i in indexes]
+            if type == "DELETION":
+                type_sequences = np.array([len(sequence) for sequence in type_sequences], dtype=np.int64)
+
+            type_ref_nodes, type_var_nodes, ok = locate_function(graph_offsets[indexes] + offset_shift, type_sequences)
+            ref_nodes[indexes[ok]] = type_ref_nodes[ok]
+            var_nodes[indexes[ok]] = type_var_nodes[ok]
+            is_found[indexes[ok]] = True
+            logging.info("Found %d of %d variants of type %s with array operations" % (np.sum(ok), len(indexes), type))
+
+        slow_path = np.flatnonzero(~is_found)
+        logging.info("%d variants will be processed one by one" % len(slow_path))
+        for i in slow_path:
+            if variants is not None:
+                variant = variants[i]
+            else:
+                variant = VcfVariant(chromosomes[i], int(positions[i]), ref_sequences[i], variant_sequences[i], type=types[i])
+            ref_nodes[i], var_nodes[i] = self._graph.get_variant_nodes(variant)
+
+        return ref_nodes, var_nodes
+
+    def locate_variants(self, variants):
+        variants = list(variants)
+        return self.locate([variant.chromosome for variant in variants],
+                           [variant.position for variant in variants],
+                           [variant.type for variant in variants],
+                           [variant.ref_sequence for variant in variants],
+                           [variant.variant_sequence for variant in variants],
+                           variants=variants)
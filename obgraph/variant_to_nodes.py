@@ -1,5 +1,6 @@
 import numpy as np
 from .graph import VariantNotFoundException
+from .variant_locator import BatchVariantLocator
 import logging
 
 
@@ -26,26 +27,17 @@ class VariantToNodes:
 
     @classmethod
     def from_graph_and_variants(cls, graph, variants):
-        n_variants = len(variants)
-        var_nodes = np.zeros(n_variants, dtype=np.uint32)
-        ref_nodes = np.zeros(n_variants, dtype=np.uint32)
+        # simple variants are found with array operations, the rest one by one
+        try:
+            ref_nodes, var_nodes = BatchVariantLocator(graph).locate_variants(variants)
+        except VariantNotFoundException as e:
+            logging.error(str(e))
+            logging.error("Could not find variant, aborting")
+            raise
 
         max_graph_node = graph.max_node_id()
-        for i, variant in enumerate(variants):
-            if i % 100000 == 0:
-                logging.info("%d variants processed" % i)
-            try:
-                ref_node, var_node = graph.get_variant_nodes(variant)
-            except VariantNotFoundException as e:
-                logging.error(str(e))
-                logging.error("Could not find variant, aborting")
-                raise
-
-            var_nodes[i] = var_node
-            ref_nodes[i] = ref_node
-
-            assert var_node <= max_graph_node
-            assert ref_node <= max_graph_node, "Found ref node %d which is not <= max graph node %d. Variant %s" % (ref_node, max_graph_node, variant)
+        assert np.all(var_nodes <= max_graph_node)
+        assert np.all(ref_nodes <= max_graph_node), "Found ref nodes %s which are not <= max graph node %d" % (ref_nodes[ref_nodes > max_graph_node], max_graph_node)
 
         return cls(ref_nodes, var_nodes)
 
@@ -4,6 +4,8 @@ import io
 import time
 import numpy as np
 import time
+import struct
+import zlib
 from .util import encode_chromosome
 
 
@@ -311,6 +313,112 @@ class VcfVariant:
             raise Exception("Not able to get ref pos after variant of type %s" % self.type)
 
 
+# Offsets of the chromosomes in a vcf, so that the lines of one chromosome can be read without reading the lines
+# before it. Offsets are byte offsets, except in bgzipped files, where they are (offset of the bgzf block,
+# offset in the uncompressed block). The lines of each chromosome are assumed to be after each other
+
+def _is_bgzf_file(vcf_file_name):
+    with open(vcf_file_name, "rb") as f:
+        header = f.read(18)
+    return len(header) == 18 and header[:4] == b"\x1f\x8b\x08\x04" and header[12:14] == b"BC"
+
+
+def _read_bgzf_blocks(f):
+    # yields the offset and uncompressed data of each bgzf block
+    block_offset = 0
+    while True:
+        header = f.read(18)
+        if len(header) == 0:
+            return
+        assert header[:4] == b"\x1f\x8b\x08\x04" and header[12:14] == b"BC", "Invalid bgzf block at offset %d" % block_offset
+        block_size = struct.unpack("<H", header[16:18])[0] + 1
+        data = f.read(block_size - 18)
+        yield block_offset, zlib.decompress(data[:-8], -15)
+        block_offset += block_size
+
+
+def _read_vcf_chunks(vcf_file_name, chunk_size=16 * 1024 * 1024):
+    # yields chunks of the uncompressed vcf, and a function giving the offset of a position in each chunk
+    if _is_bgzf_file(vcf_file_name):
+        with open(vcf_file_name, "rb") as f:
+            for block_offset, data in _read_bgzf_blocks(f):
+                yield data, lambda position, block_offset=block_offset: (block_offset, position)
+        return
+
+    if vcf_file_name.endswith(".gz"):
+        logging.warning("%s is gzipped, but not bgzipped. Chromosomes are found by decompressing the lines before them" % vcf_file_name)
+        f = gzip.open(vcf_file_name)
+    else:
+        f = open(vcf_file_name, "rb")
+
+    with f:
+        offset = 0
+        while True:
+            data = f.read(chunk_size)
+            if len(data) == 0:
+                return
+            yield data, lambda position, offset=offset: offset + position
+            offset += len(data)
+
+
+def _get_chromosome(text, line_start):
+    return text[line_start:text.find(b"\t", line_start)].decode()
+
+
+def get_vcf_chromosome_offsets(vcf_file_name, chunk_size=16 * 1024 * 1024):
+    # Returns a dict from chromosome to the offset of its first line, in the order the chromosomes are in the vcf.
+    # Chunks where the first and last line are on the current chromosome are skipped without looking at the lines
+    offsets = {}
+    current_chromosome = None
+    tail = b""
+    tail_offset = None
+    for data, get_offset in _read_vcf_chunks(vcf_file_name, chunk_size):
+        text = tail + data
+        line_starts = np.append(0, np.flatnonzero(np.frombuffer(text, dtype=np.uint8) == ord("\n")) + 1)
+        # the last line may continue in the next chunk
+        complete_line_starts = line_starts[:-1]
+        if len(complete_line_starts) > 0 and text[complete_line_starts[0]] != ord("#") and \
+                _get_chromosome(text, complete_line_starts[0]) == current_chromosome == _get_chromosome(text, complete_line_starts[-1]):
+            complete_line_starts = []
+
+        for line_start in complete_line_starts:
+            if text[line_start] == ord("#"):
+                continue
+            chromosome = _get_chromosome(text, line_start)
+            if chromosome != current_chromosome:
+                assert chromosome not in offsets, "Lines of chromosome %s are not after each other in %s" % (chromosome, vcf_file_name)
+                offsets[chromosome] = tail_offset if line_start == 0 and len(tail) > 0 else get_offset(line_start - len(tail))
+                current_chromosome = chromosome
+
+        tail_offset = tail_offset if line_starts[-1] == 0 and len(tail) > 0 else get_offset(line_starts[-1] - len(tail))
+        tail = text[line_starts[-1]:]
+
+    if len(tail.strip()) > 0 and not tail.startswith(b"#"):
+        chromosome = _get_chromosome(tail + b"\t", 0)
+        if chromosome != current_chromosome:
+            offsets[chromosome] = tail_offset
+
+    return offsets
+
+
+def _open_vcf_at_offset(vcf_file_name, offset):
+    # file object with the uncompressed lines from the offset (see get_vcf_chromosome_offsets)
+    if isinstance(offset, tuple):
+        block_offset, offset_in_block = offset
+        f = open(vcf_file_name, "rb")
+        f.seek(block_offset)
+        f = io.BufferedReader(gzip.GzipFile(fileobj=f), buffer_size=1000 * 1000 * 2)
+        f.read(offset_in_block)
+        return f
+
+    if vcf_file_name.endswith(".gz"):
+        f = io.BufferedReader(gzip.open(vcf_file_name), buffer_size=1000 * 1000 * 2)
+    else:
+        f = open(vcf_file_name)
+    f.seek(offset)
+    return f
+
+
 class VcfVariants:
     def __init__(self, variant_genotypes=[], skip_index=False, header_lines=""):
         self._header_lines = header_lines
@@ -516,7 +624,10 @@ class VcfVariants:
         return header_lines
 
     @classmethod
-    def from_vcf(cls, vcf_file_name, skip_index=False, limit_to_n_lines=None, make_generator=False, limit_to_chromosome=None, dont_encode_chromosomes=False):
+    def from_vcf(cls, vcf_file_name, skip_index=False, limit_to_n_lines=None, make_generator=False, limit_to_chromosome=None, dont_encode_chromosomes=False,
+                 file_offset=None):
+        # file_offset can be the offset of the first line of limit_to_chromosome (see get_vcf_chromosome_offsets),
+        # so that the lines before it are not read. Variants are then numbered from that line
         logging.info("Reading variants from file")
         variant_genotypes = []
 
@@ -543,6 +654,11 @@ class VcfVariants:
             f = io.BufferedReader(gz, buffer_size=1000 * 1000 * 2)  # 2 GB buffer size?
             logging.info("Made gz file object")
 
+        if file_offset is not None:
+            assert limit_to_chromosome is not None, "File offset can only be given when limiting to a chromosome"
+            f.close()
+            f = _open_vcf_at_offset(vcf_file_name, file_offset)
+
         if make_generator:
             assert limit_to_chromosome is None, "Cannot both limit to chromosome and make generator (not implemented)"
             logging.info("Returning variant generator")
@@ -574,14 +690,15 @@ class VcfVariants:
                 break
 
 
-            variant = VcfVariant.from_vcf_line(line, vcf_line_number=variant_number, dont_encode_chromosome=dont_encode_chromosomes)
-            if limit_to_chromosome is not None and variant.chromosome != limit_to_chromosome:
+            # chromosome is checked before the line is parsed, so that lines on other chromosomes are skipped quickly
+            if limit_to_chromosome is not None and line.split(None, 1)[0] != limit_to_chromosome:
                 if len(variant_genotypes) > 0:
                     logging.info("Stoppinng reading file since limiting to chromosome and now on new chromosome")
                     break
                 else:
                     continue
 
+            variant = VcfVariant.from_vcf_line(line, vcf_line_number=variant_number, dont_encode_chromosome=dont_encode_chromosomes)
             n_variants_added += 1
             variant_genotypes.append(variant)
 
@@ -1,8 +1,37 @@
 from setuptools import setup
 from distutils.core import setup
+from setuptools import Extension
 from Cython.Build import cythonize
 from Cython.Distutils import build_ext
 import numpy as np
+import os
+import tempfile
+from distutils.ccompiler import new_compiler
+from distutils.sysconfig import customize_compiler
+
+
+def get_openmp_args():
+    # OpenMP is used if the compiler supports it (not e.g. Apple clang), otherwise prange runs serially.
+    # Set OBGRAPH_NO_OPENMP=1 to build without it
+    if os.environ.get("OBGRAPH_NO_OPENMP", "0") == "1":
+        return []
+
+    compiler = new_compiler()
+    customize_compiler(compiler)
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "test_openmp.c")
+        with open(file_name, "w") as f:
+            f.write("#include <omp.h>\nint main(void) { return omp_get_num_threads() > 0 ? 0 : 1; }\n")
+        try:
+            objects = compiler.compile([file_name], output_dir=directory, extra_postargs=["-fopenmp"])
+            compiler.link_executable(objects, os.path.join(directory, "test_openmp"), extra_postargs=["-fopenmp"])
+        except Exception:
+            print("Compiler does not support OpenMP, building without it")
+            return []
+    return ["-fopenmp"]
+
+
+openmp_args = get_openmp_args()
 
 setup(name='obgraph',
       version='0.0.36',
@@ -21,7 +50,8 @@ setup(name='obgraph',
             'console_scripts': ['obgraph=obgraph.command_line_interface:main']
       },
       cmdclass = {"build_ext": build_ext},
-      ext_modules = cythonize(["obgraph/cython_traversing.pyx"]),
+      ext_modules = cythonize([Extension("obgraph.cython_traversing", ["obgraph/cython_traversing.pyx"],
+                                         extra_compile_args=openmp_args, extra_link_args=openmp_args)]),
       include_dirs=np.get_include(),
 )
 
@@ -0,0 +1,86 @@
+import random
+import pytest
+from obgraph.graph_construction import GraphConstructor
+from obgraph.variants import VcfVariants, VcfVariant
+
+# Random references, variants and graphs for the tests that compare two implementations on many random cases.
+# Each helper is given to the tests as a fixture
+
+
+def _random_sequence(length):
+    return "".join(random.choice("ACGT") for _ in range(length))
+
+
+def _random_variant(reference, position, variant_type, max_deletion_length):
+    ref_base = reference[position-1]
+    if variant_type == "SNP":
+        return VcfVariant(1, position, ref_base, random.choice([b for b in "ACGT" if b != ref_base]), type="SNP")
+    elif variant_type == "DELETION":
+        return VcfVariant(1, position, reference[position-1:position+random.randint(1, max_deletion_length)], ref_base, type="DELETION")
+    else:
+        inserted = _random_sequence(random.randint(1, 3))
+        return VcfVariant(1, position, ref_base, ref_base + inserted, type="INSERTION")
+
+
+def _random_variants(reference, n_variants, seed):
+    # variants that do not overlap
+    random.seed(seed)
+    variants = []
+    position = 2
+    while len(variants) < n_variants and position < len(reference) - 6:
+        variant = _random_variant(reference, position, random.choice(["SNP", "DELETION", "INSERTION"]), 3)
+        variants.append(variant)
+        if variant.type == "DELETION":
+            position += len(variant.ref_sequence) - 1
+        position += random.randint(1, 4)
+
+    return VcfVariants(variants)
+
+
+def _random_overlapping_variants(reference, n_variants, seed, variant_types=("SNP", "DELETION", "INSERTION")):
+    # variants at random positions, so that they can overlap and deletions can start inside other deletions
+    random.seed(seed)
+    return VcfVariants([_random_variant(reference, position, random.choice(variant_types), 5)
+                        for position in sorted(random.randint(2, len(reference) - 8) for _ in range(n_variants))])
+
+
+def _random_cases(seeds, reference_length, make_variants):
+    # yields (seed, reference, variants) for each seed. reference_length can be a function giving a random length,
+    # and make_variants is called with the reference and the seed
+    for seed in seeds:
+        random.seed(seed)
+        length = reference_length() if callable(reference_length) else reference_length
+        reference = _random_sequence(length)
+        yield seed, reference, make_variants(reference, seed)
+
+
+def _random_graphs(seeds, reference_length=200, n_variants=40):
+    # yields (seed, reference, variants, graph with dummy nodes) with variants that do not overlap
+    make_variants = lambda reference, seed: _random_variants(reference, n_variants, seed)
+    for seed, reference, variants in _random_cases(seeds, reference_length, make_variants):
+        yield seed, reference, variants, GraphConstructor(reference, variants).get_graph_with_dummy_nodes()
+
+
+@pytest.fixture
+def random_sequence():
+    return _random_sequence
+
+
+@pytest.fixture
+def random_variants():
+    return _random_variants
+
+
+@pytest.fixture
+def random_overlapping_variants():
+    return _random_overlapping_variants
+
+
+@pytest.fixture
+def random_cases():
+    return _random_cases
+
+
+@pytest.fixture
+def random_graphs():
+    return _random_graphs
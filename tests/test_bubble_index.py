@@ -0,0 +1,51 @@
+import numpy as np
+from obgraph.graph_construction import GraphConstructor
+from obgraph.cython_traversing import traverse_graph_by_following_nodes
+from obgraph.bubble_index import BubbleIndex
+from obgraph.variant_to_nodes import VariantToNodes
+
+
+def test_haplotype_path_is_same_as_traversed_path(random_graphs):
+    for seed, reference, variants, graph in random_graphs(range(10), 300, 60):
+        bubble_index = BubbleIndex.from_graph(graph)
+        variant_to_nodes = VariantToNodes.from_graph_and_variants(graph, variants)
+
+        np.random.seed(seed)
+        for i in range(10):
+            alleles = np.random.randint(0, 2, len(variants))
+            follow_nodes = variant_to_nodes.var_nodes[alleles == 1]
+            if i % 3 == 1:
+                # any nodes, not only variant nodes
+                follow_nodes = np.flatnonzero(np.random.randint(0, 2, len(graph.nodes)))
+            elif i % 3 == 2:
+                # no complex bubbles, so that the path is never traversed
+                is_chosen = (np.random.randint(0, 2, len(bubble_index)) == 1) & ~bubble_index.is_complex
+                follow_nodes = bubble_index.choice_nodes[is_chosen]
+
+            nodes_to_follow = np.zeros(len(graph.nodes), dtype=np.uint8)
+            nodes_to_follow[follow_nodes] = 1
+            expected = traverse_graph_by_following_nodes(graph, nodes_to_follow)
+            assert np.all(bubble_index.get_haplotype_path(follow_nodes) == expected)
+            if i % 3 == 0:
+                assert np.all(bubble_index.get_haplotype_path_from_alleles(variant_to_nodes, alleles) == expected)
+
+
+def test_bubble_index_to_file():
+    reference = "AATTGGCCATAGGA"
+    from obgraph.variants import VcfVariants, VcfVariant
+    variants = VcfVariants(
+        [VcfVariant(1, 2, "A", "AAA", type="INSERTION"),
+         VcfVariant(1, 4, "TGG", "T", type="DELETION"),
+         VcfVariant(1, 9, "A", "G", type="SNP")]
+    )
+    graph = GraphConstructor(reference, variants).get_graph_with_dummy_nodes()
+    bubble_index = BubbleIndex.from_graph(graph)
+    assert len(bubble_index) == 3
+    assert not np.any(bubble_index.is_complex)
+    assert list(bubble_index.get_ref_nodes(1)) == [graph.get_node_at_ref_offset(4)]
+
+    bubble_index.to_file("test_bubble_index.npz")
+    bubble_index2 = BubbleIndex.from_file("test_bubble_index.npz")
+    variant_to_nodes = VariantToNodes.from_graph_and_variants(graph, variants)
+    assert np.all(bubble_index2.get_haplotype_path_from_alleles(variant_to_nodes, [1, 0, 1]) ==
+                  bubble_index.get_haplotype_path_from_alleles(variant_to_nodes, [1, 0, 1]))
@@ -1,5 +1,7 @@
-from obgraph import Graph, DummyNodeAdder
-from obgraph.graph_construction import GraphConstructor
+import random
+import numpy as np
+from obgraph import Graph, DummyNodeAdder, ArrayDummyNodeAdder
+from obgraph.graph_construction import GraphConstructor, ArrayGraphConstructor
 from obgraph.variants import VcfVariants, VcfVariant
 
 def test_simple_insertion():
@@ -268,4 +270,27 @@ def test_two_overlapping_snps_and_indel():
     assert graph.get_edges(8) == [6]
     assert all(graph.get_edges(4) == [5, 8])
     assert graph.get_node_sequence(5) == "CT"
-    print(graph.get_edges(8))
\ No newline at end of file
+    print(graph.get_edges(8))
+
+
+def test_array_dummy_node_adder_gives_same_graph_as_dummy_node_adder(random_cases, random_overlapping_variants):
+    make_variants = lambda reference, seed: random_overlapping_variants(reference, random.randint(1, 20), seed, ["DELETION", "INSERTION"])
+    for seed, reference, variants in random_cases(range(100), lambda: random.choice([40, 200]), make_variants):
+        if seed % 3 == 0:
+            variants = VcfVariants(random.sample(list(variants), len(variants)))
+
+        try:
+            graph = ArrayGraphConstructor(reference, variants).get_graph()
+            adder = DummyNodeAdder(graph, variants)
+            correct = adder.create_new_graph_with_dummy_nodes()
+        except AssertionError:
+            # e.g. too many possible paths for a variant
+            continue
+
+        array_adder = ArrayDummyNodeAdder(graph, variants)
+        new_graph = array_adder.create_new_graph_with_dummy_nodes()
+        assert np.all(new_graph.nodes == correct.nodes)
+        assert np.all(new_graph.edges.lengths == correct.edges.lengths)
+        assert np.all(new_graph.edges.ravel() == correct.edges.ravel())
+        from_nodes, to_nodes, dummy_nodes = array_adder.get_edge_mapping()
+        assert {(int(f), int(t)): int(d) for f, t, d in zip(from_nodes, to_nodes, dummy_nodes)} == adder.get_edge_mapping()
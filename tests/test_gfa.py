@@ -1,6 +1,8 @@
 import logging
 logging.basicConfig(level=logging.INFO)
-from obgraph.gfa import create_graph_from_gfa_file
+import numpy as np
+from obgraph import Graph
+from obgraph.gfa import create_graph_from_gfa_file, create_graph_and_id_map_from_gfa_file, GfaIdMap
 
 
 def test_graph_from_gfa():
@@ -34,4 +36,93 @@ def test_graph_from_gfa():
     assert graph.is_linear_ref_node(4)
 
 
-test_graph_from_gfa()
\ No newline at end of file
+test_graph_from_gfa()
+
+def test_graph_from_gfa_with_names_in_chunks():
+    gfa_lines = [
+        "H\tVN:Z:1.0",
+        "S\tseg_a\tACT",
+        "L\tseg_a\t+\tseg_b\t+\t*",
+        "S\tseg_b\tG",
+        "S\tx\tGGGG\tLN:i:4",
+        "L\tseg_a\t+\tx\t+\t*",
+        "L\tseg_b\t+\tseg_c\t+\t*",
+        "L\tx\t+\tseg_c\t+\t*",
+        "S\tseg_c\tAAAA",
+        "P\tchr1\tseg_a+,seg_b+,seg_c+\t*",
+    ]
+
+    with open("gfa_names.tmp", "w") as f:
+        f.writelines((l + "\n" for l in gfa_lines))
+
+    # chunks smaller than the lines
+    graph, id_map = create_graph_and_id_map_from_gfa_file("gfa_names.tmp", chunk_size=7)
+
+    # ids are given in the order of the segments
+    assert [id_map.get_name(node) for node in [1, 2, 3, 4]] == ["seg_a", "seg_b", "x", "seg_c"]
+    assert list(id_map.get_nodes(["x", "seg_c", "y"])) == [3, 4, 0]
+    assert list(graph.get_edges(1)) == [2, 3]
+    assert list(graph.get_edges(2)) == [4]
+    assert list(graph.get_edges(3)) == [4]
+    assert graph.get_node_sequence(3) == "GGGG"
+    assert list(graph.ref_offset_to_node.nodes) == [1, 2, 4]
+    assert graph.chromosome_start_nodes == {"chr1": 1}
+
+    id_map.to_file("gfa_names.id_map.tmp.npz")
+    assert GfaIdMap.from_file("gfa_names.id_map.tmp").get_name(4) == "seg_c"
+
+
+def test_graph_to_gfa():
+    graph = Graph.from_arrays([1, 2, 3, 4, 5, 6, 7], [2, 1, 0, 3, 2, 1, 0], b"ACGAACGTA", [1, 1, 2, 3, 5, 5, 7], [2, 3, 4, 4, 6, 7, 6],
+                              [1, 2, 4, 5, 6], {"chr1": 1, "chr2": 5})
+    graph.to_gfa("gfa_out.tmp", chunk_size=5)
+
+    with open("gfa_out.tmp") as f:
+        lines = f.read().splitlines()
+    assert "S\t3\t*" in lines
+    assert "P\tchr1\t1+,2+,4+\t*" in lines
+    assert "P\tchr2\t5+,6+\t*" in lines
+
+    new_graph = create_graph_from_gfa_file("gfa_out.tmp")
+    assert np.all(new_graph.nodes == graph.nodes)
+    for node in range(1, 8):
+        assert list(new_graph.get_edges(node)) == list(graph.get_edges(node))
+        assert new_graph.get_node_sequence(node) == graph.get_node_sequence(node)
+    assert list(new_graph.ref_offset_to_node.nodes) == [1, 2, 4, 5, 6]
+    assert new_graph.chromosome_start_nodes == {"chr1": 1, "chr2": 5}
+
+
+def test_graph_from_gfa_with_numeric_ids_from_0():
+    # as convert_gfa_ids_to_numeric numbers segments
+    gfa_lines = ["S\t0\tACT", "S\t1\tG", "S\t2\tAA", "L\t0\t+\t1\t+\t*", "L\t1\t+\t2\t+\t*", "P\tchr1\t0+,1+,2+\t*"]
+    with open("gfa_names.tmp", "w") as f:
+        f.writelines((l + "\n" for l in gfa_lines))
+
+    graph = create_graph_from_gfa_file("gfa_names.tmp")
+    assert graph.chromosome_start_nodes == {"chr1": 0}
+    assert list(graph.get_edges(0)) == [1]
+    assert graph.get_nodes_sequence([0, 1, 2]) == "ACTGAA"
+
+
+def test_graph_with_dummy_nodes_to_gfa(random_graphs):
+    from obgraph.graph_merger import merge_graphs
+    for seed, reference, variants, graph in random_graphs(range(10)):
+        graph.chromosome_start_nodes = {"chr1": graph.get_first_node()}
+        other = next(random_graphs([seed + 100]))[3]
+        other.chromosome_start_nodes = {"chr2": other.get_first_node()}
+        graph = merge_graphs([graph, other])
+        graph.to_gfa("gfa_out.tmp", chunk_size=100)
+
+        with open("gfa_out.tmp") as f:
+            lines = [line.split("\t") for line in f.read().splitlines()]
+        links = set((line[1], line[3]) for line in lines if line[0] == "L")
+        paths = {line[1]: [step[:-1] for step in line[2].split(",")] for line in lines if line[0] == "P"}
+        assert list(paths.keys()) == ["chr1", "chr2"]
+        for path in paths.values():
+            # the reference paths go through empty dummy nodes
+            assert all((from_node, to_node) in links for from_node, to_node in zip(path, path[1:]))
+
+        new_graph = create_graph_from_gfa_file("gfa_out.tmp")
+        assert new_graph.get_nodes_sequence([int(node) for node in paths["chr1"]]) == reference
+        assert new_graph.ref_offset_to_node == graph.ref_offset_to_node
+        assert new_graph.chromosome_start_nodes == graph.chromosome_start_nodes
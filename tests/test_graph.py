@@ -79,3 +79,202 @@ def test_get_numeric_node_sequences_by_chromosome():
     assert np.all(sequences[2] == [0, 0, 0, 2])
 
 
+
+
+def test_native_file_format():
+    g = Graph.from_dicts(
+        {1: "ACTG", 2: "A", 3: "G", 4: "AAA"},
+        {1: [2, 3], 2: [4], 3: [4]},
+        [1, 2, 4],
+        chromosome_start_nodes={"chr1": 1}
+    )
+    g.to_file("test_graph_native", native=True)
+    g2 = Graph.from_file("test_graph_native", mmap=True)
+
+    assert isinstance(g2.nodes, np.memmap)
+    assert g2 == g
+    assert list(g2.get_edges(1)) == [2, 3]
+    assert g2.get_node_sequence(4) == "AAA"
+    assert g2.get_node_at_ref_offset(5) == 4
+    assert g2.chromosome_start_nodes == {"chr1": 1}
+    assert np.all(g2.linear_ref_nodes_and_dummy_nodes_index == g.linear_ref_nodes_and_dummy_nodes_index)
+
+
+def test_linear_ref_index():
+    g = Graph.from_dicts(
+        {1: "ACTG", 2: "A", 3: "G", 4: "AAA", 5: "", 6: "CC"},
+        {1: [2, 3], 2: [4], 3: [4], 4: [5], 5: [6]},
+        [1, 2, 4, 5, 6]
+    )
+    assert g.linear_ref_length() == 10
+    assert list(g.get_node_at_ref_offset(np.array([0, 3, 4, 5, 7, 8, 9]))) == [1, 1, 2, 4, 4, 6, 6]
+    assert list(g.get_node_offset_at_ref_offset(np.array([0, 3, 4, 6, 9]))) == [0, 3, 0, 1, 1]
+    assert g.linear_ref_nodes() == set([1, 2, 4, 6])
+    assert list(g.get_linear_ref_nodes_between_offsets(1, 3, 6)) == [1, 2, 4]
+
+    # old graphs storing one node per base are converted
+    per_base = g.ref_offset_to_node.to_ref_offset_to_node()
+    assert list(per_base) == [1, 1, 1, 1, 2, 4, 4, 4, 6, 6]
+    g2 = Graph(g.nodes, g.sequences, g.edges, g.node_to_ref_offset, per_base, g.chromosome_start_nodes)
+    assert g2.ref_offset_to_node == g.ref_offset_to_node
+    g2.ref_offset_to_node = per_base
+    g2.to_file("test_graph_legacy.npz")
+    g3 = Graph.from_file("test_graph_legacy.npz")
+    assert g3.ref_offset_to_node == g.ref_offset_to_node
+
+
+def test_packed_sequences():
+    node_sequences = {1: "ACTGA", 2: "A", 3: "", 4: "GGTTCAC", 5: "T"}
+    edges = {1: [2, 3], 2: [4], 3: [4], 4: [5]}
+    g = Graph.from_dicts(node_sequences, edges, [1, 2, 4, 5])
+    packed = Graph.from_dicts(node_sequences, edges, [1, 2, 4, 5], pack_sequences=True)
+
+    assert packed.sequences.packed.nbytes == 4
+    for node, sequence in node_sequences.items():
+        assert packed.get_node_sequence(node) == sequence
+        assert np.all(packed.get_numeric_node_sequence(node) == g.get_numeric_node_sequence(node))
+
+    nodes = np.array([4, 1, 3, 5])
+    assert np.all(packed.get_numeric_node_sequences(nodes) == g.get_numeric_node_sequences(nodes))
+    assert packed.get_nodes_sequence(nodes) == "GGTTCACACTGAT"
+    assert packed.sequences == g.sequences
+
+    packed.to_file("test_graph_native", native=True)
+    assert Graph.from_file("test_graph_native", mmap=True).get_nodes_sequence(nodes) == "GGTTCACACTGAT"
+
+
+def test_get_nodes_sequence_chunks():
+    g = Graph.from_dicts(
+        {1: "ACTGA", 2: "A", 3: "", 4: "GGTTCAC", 5: "T", 6: "CCAATTGGAC"},
+        {1: [2, 3], 2: [4], 3: [4], 4: [5], 5: [6]},
+        [1, 2, 4, 5, 6]
+    )
+    nodes = np.array([1, 3, 4, 5, 6])
+    sequence = g.get_nodes_sequence(nodes)
+    assert sequence == "ACTGAGGTTCACTCCAATTGGAC"
+    assert np.all(g.get_nodes_sequence_array(nodes, numeric=True) == g.get_numeric_node_sequences(nodes))
+
+    for chunk_size in [1, 3, 4, 7, 23, 100]:
+        chunks = list(g.get_nodes_sequence_chunks(nodes, chunk_size=chunk_size))
+        assert all(len(chunk) == chunk_size for chunk in chunks[:-1])
+        assert b"".join(chunk.tobytes() for chunk in chunks).decode() == sequence
+
+    assert list(g.get_nodes_sequence_chunks(np.array([3]), chunk_size=4)) == []
+
+
+def test_reverse_edges():
+    g = Graph.from_dicts(
+        {1: "ACTG", 2: "A", 3: "G", 4: "AAA", 5: "C"},
+        {1: [2, 3, 4], 2: [4], 3: [4], 4: [5]},
+        [1, 2, 4, 5]
+    )
+    assert list(g.get_reverse_edges(4)) == [1, 2, 3]
+    assert list(g.get_reverse_edges(1)) == []
+    assert list(g.reverse_edges[5]) == [4]
+    assert g.get_reverse_edges_dict() == {2: [1], 3: [1], 4: [1, 2, 3], 5: [4]}
+
+    g.to_file("test_graph_native", native=True)
+    g2 = Graph.from_file("test_graph_native", mmap=True)
+    assert isinstance(g2._reverse_edges.ravel(), np.memmap)
+    assert list(g2.get_reverse_edges(4)) == [1, 2, 3]
+
+
+def test_sharded_graph():
+    from obgraph.graph_merger import merge_graphs
+    for pack_sequences in [False, True]:
+        graphs = [Graph.from_dicts(
+            {1: sequence, 2: "A", 3: "C", 4: "ACT"},
+            {1: [2, 3], 2: [4], 3: [4]},
+            [1, 2, 4],
+            chromosome_start_nodes={chromosome: 1},
+            pack_sequences=pack_sequences
+        ) for chromosome, sequence in [("chr1", "ACTG"), ("chr2", "AAAAC"), ("chr3", "GT")]]
+        merged = merge_graphs(graphs)
+        merged.to_sharded_file("test_graph_sharded")
+
+        sharded = Graph.open("test_graph_sharded")
+        assert sharded.chromosomes == ["chr1", "chr2", "chr3"]
+
+        # the chromosome graph has the same node ids and ref offsets as the full graph
+        chr2 = sharded.chromosome("chr2")
+        assert chr2.chromosome_start_nodes == {"chr2": 6}
+        assert list(chr2.get_edges(6)) == [7, 8]
+        assert chr2.get_nodes_sequence([6, 8, 9]) == "AAAACCACT"
+        assert chr2.get_node_at_ref_offset(13) == merged.get_node_at_ref_offset(13) == 7
+        assert chr2.get_ref_offset_at_node(9) == merged.get_ref_offset_at_node(9)
+        assert chr2.linear_ref_nodes() == set([6, 7, 9])
+        assert chr2.is_linear_ref_node_or_linear_ref_dummy_node(7)
+        # nodes before the chromosome are empty
+        assert np.all(chr2.nodes[:6] == 0)
+        assert len(chr2.get_edges(1)) == 0
+
+        whole = sharded.load_all()
+        chr2_nodes = np.arange(6, 10)
+        assert np.all(chr2.nodes[chr2_nodes] == whole.nodes[chr2_nodes])
+        assert np.all(chr2.node_to_ref_offset[chr2_nodes] == whole.node_to_ref_offset[chr2_nodes])
+        assert all(list(chr2.get_edges(node)) == list(whole.get_edges(node)) for node in chr2_nodes)
+        assert chr2.get_nodes_sequence(chr2_nodes) == whole.get_nodes_sequence(chr2_nodes)
+
+        whole = Graph.from_file("test_graph_sharded")
+        assert whole == merged
+        assert whole.get_nodes_sequence(np.arange(len(merged.nodes))) == merged.get_nodes_sequence(np.arange(len(merged.nodes)))
+        assert whole.ref_offset_to_node == merged.ref_offset_to_node
+
+
+
+def test_sharded_graph_writer_gives_same_graph_as_merging():
+    from obgraph.graph_merger import merge_graphs
+    from obgraph.graph_file import ShardedGraphWriter
+    graphs = [Graph.from_dicts(
+        {1: sequence, 2: "A", 3: "C", 4: "ACT"},
+        {1: [2, 3], 2: [4], 3: [4]},
+        [1, 2, 4],
+        chromosome_start_nodes={chromosome: 1}
+    ) for chromosome, sequence in [("chr1", "ACTG"), ("chr2", "AAAAC"), ("chr3", "GT")]]
+    merged = merge_graphs(graphs)
+
+    writer = ShardedGraphWriter("test_graph_sharded_writer")
+    for graph in graphs:
+        writer.add_chromosome_graph(graph)
+    writer.close()
+
+    whole = Graph.from_file("test_graph_sharded_writer")
+    assert whole == merged
+    assert whole.chromosome_start_nodes == merged.chromosome_start_nodes
+    assert whole.ref_offset_to_node == merged.ref_offset_to_node
+    assert np.all(whole.node_to_ref_offset == merged.node_to_ref_offset)
+    chr2 = Graph.open("test_graph_sharded_writer").chromosome("chr2")
+    assert chr2.chromosome_start_nodes == {"chr2": 6}
+    assert chr2.get_nodes_sequence([6, 8, 9]) == "AAAACCACT"
+    assert all(list(chr2.get_edges(node)) == list(whole.get_edges(node)) for node in range(6, 10))
+
+    # setting an array on one chromosome only changes its shard
+    sharded = Graph.open("test_graph_sharded_writer")
+    allele_frequencies = np.zeros(len(chr2.nodes), dtype=np.float16) + 1
+    allele_frequencies[[7, 8]] = [0.25, 0.75]
+    sharded.set_chromosome_array("chr2", "allele_frequencies", allele_frequencies, default_value=1)
+    whole = Graph.from_file("test_graph_sharded_writer")
+    assert list(whole.allele_frequencies) == [1] * 7 + [0.25, 0.75] + [1] * 6
+    assert list(sharded.chromosome("chr2").allele_frequencies[6:10]) == [1, 0.25, 0.75, 1]
+
+
+def test_from_arrays():
+    g = Graph.from_dicts(
+        {1: "ACTG", 2: "A", 3: "G", 4: "AAA"},
+        {1: [2, 3], 2: [4], 3: [4]},
+        [1, 2, 4]
+    )
+
+    # unsorted node ids, edges in any order
+    g2 = Graph.from_arrays([4, 1, 3, 2], [3, 4, 1, 1], b"AAAACTGGA",
+                           [3, 1, 2, 1], [4, 2, 4, 3], [1, 2, 4])
+    assert g2 == g
+    assert list(g2.get_edges(1)) == [2, 3]
+    assert g2.chromosome_start_nodes == g.chromosome_start_nodes
+    assert g2.ref_offset_to_node == g.ref_offset_to_node
+    assert np.all(g2.node_to_ref_offset == g.node_to_ref_offset)
+
+    g3 = Graph.from_arrays([1, 2, 3, 4], [4, 1, 1, 3], np.array([0, 1, 3, 2, 0, 2, 0, 0, 0]),
+                           [1, 1, 2, 3], [2, 3, 4, 4], [1, 2, 4], sequences_are_numeric=True, pack_sequences=True)
+    assert g3.get_nodes_sequence([1, 2, 3, 4]) == "ACTGAGAAA"
+    assert g3.get_node_at_ref_offset(4) == 2
@@ -1,6 +1,8 @@
 import logging
 
-from obgraph.graph_construction import GraphConstructor as GraphConstructor
+import random
+import numpy as np
+from obgraph.graph_construction import GraphConstructor as GraphConstructor, ArrayGraphConstructor
 from obgraph.variants import VcfVariants, VcfVariant
 
 
@@ -196,3 +198,63 @@ test_insertion_with_snp_right_before_and_right_after()
 test_deletion_with_snp_right_before_and_right_after()
 test_messy_graph()
 test_deletion_with_snp_at_end()
+
+
+def test_linear_ref_dummy_node_index():
+    reference = "AATTGGCCATAGGA"
+    variants = VcfVariants(
+        [VcfVariant(1, 2, "A", "AAA", type="INSERTION"),
+         VcfVariant(1, 4, "TGG", "T", type="DELETION"),
+         VcfVariant(1, 9, "A", "G", type="SNP"),
+         VcfVariant(1, 11, "A", "ACC", type="INSERTION")]
+    )
+    graph = GraphConstructor(reference, variants).get_graph_with_dummy_nodes()
+    index = graph.linear_ref_nodes_and_dummy_nodes_index
+
+    # compare with checking each node separately
+    graph.linear_ref_nodes_and_dummy_nodes_index = None
+    slow_index = [graph.is_linear_ref_node_or_linear_ref_dummy_node(node) for node in range(len(index))]
+    assert list(index) == slow_index
+    assert sum(slow_index) > len(graph.linear_ref_nodes())
+
+
+def _assert_graphs_are_equal(graph, other):
+    assert np.all(graph.nodes == other.nodes)
+    assert np.all(graph.sequences.ravel() == other.sequences.ravel())
+    assert np.all(graph.edges.lengths == other.edges.lengths)
+    assert np.all(graph.edges.ravel() == other.edges.ravel())
+    assert np.all(graph.node_to_ref_offset == other.node_to_ref_offset)
+    assert graph.chromosome_start_nodes == other.chromosome_start_nodes
+
+
+def test_array_graph_constructor_gives_same_graph_as_graph_constructor(random_cases, random_overlapping_variants):
+    make_variants = lambda reference, seed: random_overlapping_variants(reference, random.randint(1, 40), seed)
+    for seed, reference, variants in random_cases(range(100), 40, make_variants):
+        try:
+            constructor = GraphConstructor(reference, variants)
+        except Exception:
+            # e.g. a variant node or the last reference node gets an empty sequence
+            continue
+
+        array_constructor = ArrayGraphConstructor(reference, variants)
+        _assert_graphs_are_equal(constructor._graph, array_constructor.get_graph())
+        _assert_graphs_are_equal(constructor.get_graph_with_dummy_nodes(), array_constructor.get_graph_with_dummy_nodes())
+
+
+def test_array_graph_constructor_with_numeric_reference_from_fasta():
+    from obgraph.graph_construction import read_numeric_reference_sequence
+    reference = "AATTGGCCATAGGA"
+    with open("test_reference.fa", "w") as f:
+        f.write(">chr1\nAAAACCCC\n>chr2\n" + reference[:10] + "\n" + reference[10:] + "\n")
+
+    numeric_reference = read_numeric_reference_sequence("test_reference.fa", "chr2")
+    assert list(numeric_reference) == [0, 0, 3, 3, 2, 2, 1, 1, 0, 3, 0, 2, 2, 0]
+
+    variants = VcfVariants(
+        [VcfVariant("chr2", 2, "A", "AAA", type="INSERTION"),
+         VcfVariant("chr2", 4, "TGG", "T", type="DELETION"),
+         VcfVariant("chr2", 9, "A", "G", type="SNP")]
+    )
+    graph = ArrayGraphConstructor(numeric_reference, variants, reference_is_numeric=True).get_graph_with_dummy_nodes()
+    _assert_graphs_are_equal(graph, ArrayGraphConstructor(reference, variants).get_graph_with_dummy_nodes())
+    assert graph.get_node_sequence(1) == "AA"
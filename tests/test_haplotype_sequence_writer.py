@@ -0,0 +1,64 @@
+import numpy as np
+from shared_memory_wrapper import from_file
+from obgraph.graph_construction import GraphConstructor
+from obgraph.graph_merger import merge_graphs
+from obgraph.cython_traversing import traverse_graph_by_following_nodes, traverse_graph_in_chunks, make_follow_mask
+from obgraph.haplotype_sequence_writer import HaplotypeSequenceWriter
+from obgraph.util import create_coordinate_map, fill_zeros_with_last
+
+
+def test_haplotype_sequence_writer(random_graphs):
+    graphs = []
+    for seed, reference, variants, graph in random_graphs(range(3)):
+        graph.chromosome_start_nodes = {seed + 1: graph.get_first_node()}
+        graphs.append(graph)
+    graph = merge_graphs(graphs)
+    np.random.seed(1)
+    variant_nodes = np.flatnonzero(np.random.randint(0, 2, len(graph.nodes)))
+
+    writer = HaplotypeSequenceWriter(graph, "test_haplotype_sequence", sequence_chunk_size=7)
+    current_chromosome_index = -1
+    for chromosome_index, nodes in traverse_graph_in_chunks(graph, make_follow_mask(len(graph.nodes), [variant_nodes]), chunk_size=5):
+        if chromosome_index != current_chromosome_index:
+            writer.start_chromosome(chromosome_index + 1, chromosome_index)
+            current_chromosome_index = chromosome_index
+        writer.add_nodes(nodes)
+    writer.close()
+
+    # same as when the whole path is traversed first
+    nodes_to_follow = np.zeros(len(graph.nodes), dtype=np.uint8)
+    nodes_to_follow[variant_nodes] = 1
+    path_nodes, chromosome_indexes = traverse_graph_by_following_nodes(graph, nodes_to_follow, True)
+    assert np.all(np.load("test_haplotype_sequence.nodes.npy") == path_nodes)
+
+    coordinate_maps = from_file("test_haplotype_sequence.coordinate_maps")
+    refpos_to_node_maps = from_file("test_haplotype_sequence.refpos_to_node")
+    fasta_lines = open("test_haplotype_sequence.fa").read().split("\n")
+    for chromosome_index, (start, end) in enumerate(zip(chromosome_indexes, chromosome_indexes[1:] + [len(path_nodes)])):
+        nodes = path_nodes[start:end]
+        chromosome_id = str(chromosome_index + 1)
+        assert fasta_lines[2 * chromosome_index] == ">" + chromosome_id
+        assert fasta_lines[2 * chromosome_index + 1] == graph.get_nodes_sequence(nodes)
+        assert np.all(coordinate_maps[chromosome_id] == create_coordinate_map(nodes, graph, chromosome_index))
+
+        refpos_to_node = np.zeros(np.sum(graph.nodes[nodes]), np.uint32)
+        offsets = np.cumsum(graph.nodes[nodes])
+        refpos_to_node[0] = nodes[0]
+        refpos_to_node[offsets[:-1]] = nodes[1:]
+        assert np.all(refpos_to_node_maps[chromosome_id] == fill_zeros_with_last(refpos_to_node))
+
+
+def test_haplotype_sequence_writer_without_chromosome(random_variants):
+    graph = GraphConstructor("ACGTACGT", random_variants("ACGTACGT", 2, 1)).get_graph_with_dummy_nodes()
+    writer = HaplotypeSequenceWriter(graph, "test_haplotype_sequence")
+    try:
+        writer.add_nodes([1, 2])
+    except AssertionError:
+        pass
+    else:
+        assert False, "Adding nodes before start_chromosome should fail"
+
+    # closing without any chromosomes writes empty files
+    writer.close()
+    assert len(np.load("test_haplotype_sequence.nodes.npy")) == 0
+    assert open("test_haplotype_sequence.fa").read() == ""
@@ -0,0 +1,75 @@
+import os
+import time
+import shutil
+import numpy as np
+from obgraph import Graph
+from obgraph.index_cache import IndexCache
+
+
+def _graph(sequence="ACTG"):
+    return Graph.from_dicts({1: sequence, 2: "A", 3: "G", 4: "AAA"}, {1: [2, 3], 2: [4], 3: [4]}, [1, 2, 4])
+
+
+def test_fingerprint():
+    assert _graph().fingerprint() == _graph().fingerprint()
+    assert _graph().fingerprint() != _graph("ACTT").fingerprint()
+
+
+def test_fingerprint_without_chromosomes():
+    graph = _graph()
+    graph.chromosome_start_nodes = None
+    other = _graph()
+    other.chromosome_start_nodes = {}
+    assert graph.fingerprint() == other.fingerprint() != _graph().fingerprint()
+
+
+def test_fingerprint_changes_when_graph_is_changed():
+    graph = _graph()
+    fingerprint = graph.fingerprint()
+    graph.chromosome_start_nodes = {"chr2": 1}
+    assert graph.fingerprint() != fingerprint
+    graph.chromosome_start_nodes = {1: 1}
+    assert graph.fingerprint() == fingerprint
+
+
+def test_index_cache():
+    shutil.rmtree("test_index_cache", ignore_errors=True)
+    graph = _graph()
+    reverse_edges = graph.make_reverse_edges()
+    position_id = graph.get_index("position_id")
+
+    cache = IndexCache("test_index_cache")
+    graph.use_index_cache(cache)
+    assert graph.reverse_edges == reverse_edges
+    assert cache.has(graph.fingerprint(), "reverse_edges")
+
+    # a new graph with the same content gets the indexes from the cache
+    graph = _graph()
+    graph.use_index_cache(cache)
+    assert graph.reverse_edges == reverse_edges
+    assert np.all(graph.get_index("position_id")._index == position_id._index)
+    assert cache.has(graph.fingerprint(), "position_id")
+    assert len(os.listdir("test_index_cache")) == 1
+
+    # after reopening the cache, the stored position id is loaded instead of being made again
+    graph = _graph()
+    graph.use_index_cache(IndexCache("test_index_cache"))
+    loaded_position_id = graph.get_index("position_id")
+    assert isinstance(loaded_position_id._index, np.memmap)
+    assert np.all(loaded_position_id._index == position_id._index)
+
+
+def test_index_cache_eviction():
+    shutil.rmtree("test_index_cache", ignore_errors=True)
+    cache = IndexCache("test_index_cache")
+    for i in range(3):
+        cache.store("fingerprint%d" % i, "index", {"data": np.zeros(1000, dtype=np.uint8)})
+        os.utime(os.path.join("test_index_cache", "fingerprint%d" % i, "index", "header.json"), (i, i))
+
+    # using the oldest index makes it the most recently used
+    cache.load("fingerprint0", "index")
+    cache.max_size = cache.size() - 1
+    cache.evict()
+    assert not cache.has("fingerprint1", "index")
+    assert cache.has("fingerprint0", "index")
+    assert cache.has("fingerprint2", "index")
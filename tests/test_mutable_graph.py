@@ -1,4 +1,6 @@
-from obgraph import MutableGraph
+import random
+import numpy as np
+from obgraph import Graph, MutableGraph, ArrayMutableGraph
 
 def test_create():
     graph = MutableGraph({1: 4, 2: 3, 3: 1, 4: 1}, {1: "ACTG", 2: "A", 3: "C", 4: "AAAA"}, {1: [2, 3], 3: [4], 2: [4]}, [1, 2, 4])
@@ -62,3 +64,59 @@ test_create()
 test_get_nodes_matching_sequence_single_node()
 test_get_nodes_matching_sequence_double_deletion_and_snp()
 test_get_nodes_matching_multiple_paths()
+
+
+def test_array_mutable_graph_gives_same_edges_as_mutable_graph(random_sequence):
+    random.seed(1)
+    graph = MutableGraph()
+    array_graph = ArrayMutableGraph()
+    for node in range(1, 50):
+        sequence = random_sequence(random.randint(0, 5))
+        graph.add_node(node, sequence)
+        array_graph.add_node(node, sequence)
+
+    # enough edges are removed to make the edge store compact itself
+    edges = []
+    for i in range(6000):
+        if len(edges) > 0 and random.random() < 0.45:
+            from_node, to_node = edges.pop(random.randrange(len(edges)))
+            graph.remove_edge(from_node, to_node)
+            array_graph.remove_edge(from_node, to_node)
+        else:
+            edge = (random.randint(1, 49), random.randint(1, 49))
+            edges.append(edge)
+            graph.add_edge(*edge)
+            array_graph.add_edge(*edge)
+
+    for node in range(1, 50):
+        assert array_graph.get_edges(node) == graph.get_edges(node)
+        assert sorted(array_graph.get_nodes_before(node)) == sorted(graph.get_nodes_before(node))
+        assert array_graph.get_node_sequence(node) == graph.get_node_sequence(node)
+
+    # the dicts of MutableGraph, where MutableGraph can also have nodes without edges left
+    assert array_graph.nodes == graph.nodes
+    assert array_graph.node_sequences == graph.node_sequences
+    assert array_graph.edges == {node: edges for node, edges in graph.edges.items() if len(edges) > 0}
+    assert array_graph.get_reverse_edges() == {node: edges for node, edges in graph.reverse_edges.items() if len(edges) > 0}
+    try:
+        array_graph.edges[1] = [2]
+    except TypeError:
+        pass
+    else:
+        assert False, "The edges of an ArrayMutableGraph can only be changed with add_edge and remove_edge"
+
+    frozen = Graph.from_mutable_graph(array_graph)
+    correct = Graph.from_mutable_graph(graph)
+    assert np.all(frozen.nodes == correct.nodes)
+    assert np.all(frozen.edges.ravel() == correct.edges.ravel())
+    assert np.all(frozen.edges.lengths == correct.edges.lengths)
+
+
+def test_array_mutable_graph_from_graph():
+    graph = Graph.from_dicts({1: "ACTG", 2: "A", 3: "C", 4: "AAAA"}, {1: [2, 3], 3: [4], 2: [4]}, [1, 2, 4])
+    mutable_graph = ArrayMutableGraph.from_graph(graph)
+    assert mutable_graph.get_edges(1) == [2, 3]
+    assert sorted(mutable_graph.get_nodes_before(4)) == [2, 3]
+    assert mutable_graph.get_node_sequence(4) == "AAAA"
+    assert mutable_graph.linear_ref_nodes == [1, 2, 4]
+    assert Graph.from_mutable_graph(mutable_graph) == graph
@@ -0,0 +1,70 @@
+from obgraph import Graph, MutableGraph
+from obgraph.sequence_search import find_paths_matching_sequence, find_paths_matching_sequences
+
+
+def _graph():
+    return Graph.from_dicts(
+        {1: "A", 2: "G", 3: "G", 4: "A", 5: "GG", 6: "", 7: "C"},
+        {
+            1: [2, 4, 5, 6],
+            2: [3],
+            3: [7],
+            4: [5],
+            5: [7],
+            6: [5]
+        },
+        [1, 2, 3, 7]
+    )
+
+
+def test_find_paths_matching_sequence():
+    graph = _graph()
+    one_path, paths = find_paths_matching_sequence(graph, 1, "GG")
+    assert paths == [[2, 3], [5], [6, 5]]
+    assert one_path == [6, 5]
+
+    _, paths = find_paths_matching_sequence(graph, 1, "ggc")
+    assert paths == [[2, 3, 7], [5, 7], [6, 5, 7]]
+
+    _, paths = find_paths_matching_sequence(graph, 1, "GG", max_paths=2)
+    assert paths == [[2, 3], [5]]
+
+    _, paths = find_paths_matching_sequence(graph, 1, "GG", max_depth=1)
+    assert paths == [[5]]
+
+    # the empty node matches anything
+    assert find_paths_matching_sequence(graph, 1, "T") == ([6], [])
+
+
+def test_find_paths_matching_sequence_in_mutable_graph():
+    graph = MutableGraph({1: 1, 2: 1, 3: 1, 4: 1, 5: 2}, {1: "A", 2: "G", 3: "G", 4: "A", 5: "GG"}, {1: [2, 4, 5], 2: [3], 3: [5], 4: [5]})
+    _, paths = find_paths_matching_sequence(graph, 1, "AGG")
+    assert paths == [[4, 5]]
+
+
+def test_find_paths_matching_sequences():
+    graph = _graph()
+    queries = [(1, "GG"), (1, "ggc"), (4, "GGC"), (1, "T"), (2, "")]
+    paths = find_paths_matching_sequences(graph, [node for node, _ in queries], [sequence for _, sequence in queries])
+    assert paths == [find_paths_matching_sequence(graph, node, sequence)[1] for node, sequence in queries]
+
+    # queries are not searched further when max_paths paths are found, so the paths with fewest nodes are given
+    paths = find_paths_matching_sequences(graph, [1, 1], ["GG", "GGC"], max_paths=1)
+    assert paths == [[[5]], [[5, 7]]]
+
+
+def test_find_paths_matching_long_sequence():
+    # more nodes than the recursion limit
+    n_nodes = 5000
+    graph = Graph.from_dicts({node: "A" for node in range(1, n_nodes + 1)}, {node: [node + 1] for node in range(1, n_nodes)},
+                             list(range(1, n_nodes + 1)))
+    _, paths = find_paths_matching_sequence(graph, 1, "A" * (n_nodes - 1))
+    assert paths == [list(range(2, n_nodes + 1))]
+    assert find_paths_matching_sequences(graph, [1], ["A" * (n_nodes - 1)]) == [paths]
+
+
+def test_find_paths_matching_sequence_with_empty_node_cycle():
+    graph = Graph.from_dicts({1: "A", 2: "", 3: "", 4: "G"}, {1: [2], 2: [3, 4], 3: [2]}, [1, 4])
+    _, paths = find_paths_matching_sequence(graph, 1, "G")
+    assert paths == [[2, 4]]
+    assert find_paths_matching_sequences(graph, [1], ["G"]) == [paths]
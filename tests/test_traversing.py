@@ -1,3 +1,81 @@
+import numpy as np
+from obgraph.cython_traversing import traverse_graph_by_following_nodes, traverse_graph_by_following_nodes_batch, make_follow_mask
 
 
+def test_batch_traversal_gives_same_paths_as_single_haplotype_traversal(random_graphs):
+    seed, reference, variants, graph = next(random_graphs([1], 300, 60))
+    variant_nodes = np.array([graph.get_variant_nodes(variant)[1] for variant in variants])
 
+    np.random.seed(1)
+    nodes_per_haplotype = [variant_nodes[np.random.randint(0, 2, len(variant_nodes)) == 1] for _ in range(13)]
+    follow_mask = make_follow_mask(len(graph.nodes), nodes_per_haplotype)
+    paths, chromosome_starts = traverse_graph_by_following_nodes_batch(graph, follow_mask, len(nodes_per_haplotype), True)
+
+    assert len(paths) == 13
+    for haplotype, nodes in enumerate(nodes_per_haplotype):
+        nodes_to_follow = np.zeros(len(graph.nodes), dtype=np.uint8)
+        nodes_to_follow[nodes] = 1
+        path, chromosome_indexes = traverse_graph_by_following_nodes(graph, nodes_to_follow, True)
+        assert np.all(paths[haplotype] == path)
+        assert list(chromosome_starts[haplotype]) == chromosome_indexes
+
+
+def test_traverse_many(random_graphs):
+    from obgraph.cython_traversing import traverse_many
+    from obgraph.graph_merger import merge_graphs
+    graphs = []
+    for seed, reference, variants, graph in random_graphs(range(3)):
+        graph.chromosome_start_nodes = {seed + 1: graph.get_first_node()}
+        graphs.append(graph)
+    graph = merge_graphs(graphs)
+
+    np.random.seed(2)
+    follow_mask = make_follow_mask(len(graph.nodes), [np.flatnonzero(np.random.randint(0, 2, len(graph.nodes))) for _ in range(21)])
+    paths, chromosome_starts = traverse_graph_by_following_nodes_batch(graph, follow_mask, 21, True)
+    for n_threads in [1, 4]:
+        paths2, chromosome_starts2 = traverse_many(graph, follow_mask, n_threads, n_haplotypes=21, split_into_chromosomes=True)
+        assert np.all(paths2.lengths == paths.lengths)
+        assert np.all(paths2.ravel() == paths.ravel())
+        assert np.all(chromosome_starts2 == chromosome_starts)
+
+
+def test_incremental_haplotype_path(random_graphs):
+    from obgraph.incremental_traversal import IncrementalHaplotypePath
+    for seed, reference, variants, graph in random_graphs(range(5), 300, 60):
+        np.random.seed(seed)
+        nodes_to_follow = np.random.randint(0, 2, len(graph.nodes)).astype(np.uint8)
+        path = IncrementalHaplotypePath(graph, np.flatnonzero(nodes_to_follow), block_size=7)
+
+        for i in range(20):
+            changed = np.random.choice(len(graph.nodes), np.random.randint(1, 5), replace=False)
+            added = changed[nodes_to_follow[changed] == 0]
+            removed = changed[nodes_to_follow[changed] == 1]
+            nodes_to_follow[added] = 1
+            nodes_to_follow[removed] = 0
+            path.update(added, removed)
+
+            expected = traverse_graph_by_following_nodes(graph, nodes_to_follow)
+            assert np.all(path.path == expected)
+            assert len(path) == len(expected)
+            assert np.all(path.offsets == np.cumsum(graph.nodes[expected]) - graph.nodes[expected])
+
+
+def test_traverse_graph_by_following_genotypes(random_graphs):
+    from obgraph.cython_traversing import traverse_genotype_matrix
+    from obgraph.variant_to_nodes import VariantToNodes
+    from obgraph.util import phased_genotype_matrix_to_haplotype_matrix
+    seed, reference, variants, graph = next(random_graphs([3], 300, 60))
+    variant_to_nodes = VariantToNodes.from_graph_and_variants(graph, variants)
+
+    np.random.seed(3)
+    genotype_matrix = np.random.randint(0, 4, (len(variants), 7)).astype(np.uint8)
+    haplotype_matrix = phased_genotype_matrix_to_haplotype_matrix(genotype_matrix)
+    n_haplotypes = 0
+    for first_haplotype, paths in traverse_genotype_matrix(graph, variant_to_nodes, genotype_matrix, individuals_per_block=3, n_threads=2):
+        for i in range(len(paths)):
+            nodes_to_follow = np.zeros(len(graph.nodes), dtype=np.uint8)
+            nodes_to_follow[variant_to_nodes.var_nodes[haplotype_matrix[:, first_haplotype + i] == 1]] = 1
+            assert np.all(paths[i] == traverse_graph_by_following_nodes(graph, nodes_to_follow))
+            n_haplotypes += 1
+
+    assert n_haplotypes == 14
@@ -0,0 +1,99 @@
+import random
+import numpy as np
+from npstructures import RaggedArray
+from obgraph.graph_construction import ArrayGraphConstructor
+from obgraph.variants import VcfVariants, VcfVariant
+from obgraph.haplotype_nodes import HaplotypeToNodes
+from obgraph.variant_insertion import VariantInserter, NodeIdRemap, get_node_ref_intervals
+
+
+def _random_variant(reference, position):
+    ref_base = reference[position-1]
+    r = random.random()
+    if r < 0.3:
+        return VcfVariant(1, position, reference[position-1:position+random.randint(1, 5)], ref_base, type="DELETION")
+    elif r < 0.6:
+        inserted = "".join(random.choice("ACGT") for _ in range(random.randint(1, 3)))
+        return VcfVariant(1, position, ref_base, ref_base + inserted, type="INSERTION")
+    elif r < 0.7:
+        alt = "".join(random.choice("ACGT") for _ in range(random.randint(1, 3)))
+        return VcfVariant(1, position, reference[position-1:position+random.randint(1, 3)], ref_base + alt, type="SUBSTITUTION")
+    return VcfVariant(1, position, ref_base, random.choice([b for b in "ACGT" if b != ref_base]), type="SNP")
+
+
+def _get_canonical_graph(graph):
+    # nodes as (ref positions, sequence, is linear ref), and the edges of each node in order, independent of node ids
+    before, after = get_node_ref_intervals(graph)
+    keys = {}
+    for node in range(1, len(graph.nodes)):
+        if graph.nodes[node] > 0 or len(graph.get_edges(node)) > 0 or len(graph.get_reverse_edges(node)) > 0:
+            keys[node] = (int(before[node]), int(after[node]), graph.get_numeric_node_sequence(node).tobytes(), bool(graph.linear_ref_nodes_index[node]))
+    return sorted((keys[node], [keys[int(edge)] for edge in graph.get_edges(node)]) for node in keys)
+
+
+def test_add_variants_gives_same_graph_as_making_graph_with_all_variants():
+    for seed in range(100):
+        random.seed(seed)
+        reference = "".join(random.choice("ACGT") for _ in range(random.choice([40, 200])))
+        variants = [_random_variant(reference, position) for position in sorted(random.sample(range(2, len(reference) - 8), random.randint(2, 20)))]
+        is_new = [random.random() < 0.4 for _ in variants]
+        old_variants = [variant for variant, new in zip(variants, is_new) if not new]
+        new_variants = [variant for variant, new in zip(variants, is_new) if new]
+        if len(old_variants) == 0 or len(new_variants) == 0:
+            continue
+
+        graph = ArrayGraphConstructor(reference, VcfVariants([variant.copy() for variant in old_variants])).get_graph_with_dummy_nodes()
+        # new variants are added as if they came after the old variants with the same ref position before them
+        variants = [variants[i] for i in sorted(range(len(variants)), key=lambda i: (variants[i].get_reference_position_before_variant(), is_new[i]))]
+        correct = ArrayGraphConstructor(reference, VcfVariants([variant.copy() for variant in variants])).get_graph_with_dummy_nodes()
+        inserter = VariantInserter(graph, VcfVariants(new_variants))
+        new_graph = inserter.create_new_graph()
+        assert _get_canonical_graph(new_graph) == _get_canonical_graph(correct)
+        assert new_graph.get_nodes_sequence(new_graph.ref_offset_to_node.nodes) == reference
+
+        # nodes that are not split keep their id and sequence
+        is_changed = np.isin(np.arange(len(graph.nodes)), inserter.get_node_remap().nodes)
+        assert np.all(new_graph.nodes[:len(graph.nodes)][~is_changed] == graph.nodes[~is_changed])
+
+
+def test_add_variants_splits_reference_nodes():
+    reference = "ACGTACGTACGTACGT"
+    graph = ArrayGraphConstructor(reference, VcfVariants([VcfVariant(1, 3, "G", "T", type="SNP")])).get_graph_with_dummy_nodes()
+    assert list(graph.ref_offset_to_node.nodes) == [1, 3, 4]
+
+    inserter = VariantInserter(graph, VcfVariants([VcfVariant(1, 10, "C", "A", type="SNP")]))
+    new_graph = inserter.create_new_graph()
+    # reference node 4 is split in three, and the new nodes come after the old nodes
+    assert list(new_graph.ref_offset_to_node.nodes) == [1, 3, 4, 6, 7]
+    assert new_graph.get_node_sequence(4) == "TACGTA"
+    assert new_graph.get_node_sequence(5) == "A"
+    assert list(new_graph.get_edges(4)) == [5, 6]
+    assert list(new_graph.get_edges(2)) == [4]
+
+    remap = inserter.get_node_remap()
+    assert list(remap.map_nodes([1, 2, 4])) == [1, 2, 4]
+    assert list(remap.expand_nodes([1, 3, 4])[0]) == [1, 3, 4, 6, 7]
+
+    haplotype_to_nodes = remap.update_haplotype_to_nodes(HaplotypeToNodes(np.array([0, 2]), np.array([2, 2]), np.array([1, 4, 2, 4])))
+    assert list(haplotype_to_nodes.get_nodes(0)) == [1, 4, 6, 7]
+    assert list(haplotype_to_nodes.get_nodes(1)) == [2, 4, 6, 7]
+
+
+def test_node_id_remap_removed_nodes():
+    remap = NodeIdRemap(np.array([8, 3]), RaggedArray([3, 10, 11], [0, 3]))
+    assert list(remap.map_nodes([1, 3, 8])) == [1, 3, -1]
+    nodes, n_new_nodes = remap.expand_nodes([3, 8, 5])
+    assert list(nodes) == [3, 10, 11, 5]
+    assert list(n_new_nodes) == [3, 0, 1]
+
+
+def test_add_variants_on_chromosome_not_in_graph():
+    graph = ArrayGraphConstructor("ACGTACGTACGTACGT", VcfVariants([VcfVariant(1, 3, "G", "T", type="SNP")])).get_graph_with_dummy_nodes()
+    graph.chromosome_start_nodes = {"1": graph.chromosome_start_nodes[list(graph.chromosome_start_nodes.keys())[0]]}
+    assert len(VariantInserter(graph, VcfVariants([VcfVariant(1, 10, "C", "A", type="SNP")])).create_new_graph().nodes) > len(graph.nodes)
+
+    try:
+        VariantInserter(graph, VcfVariants([VcfVariant("2", 10, "C", "A", type="SNP")])).create_new_graph()
+        assert False, "Variants on chromosome 2 should not be added to a chromosome 1 graph"
+    except KeyError:
+        pass
@@ -0,0 +1,26 @@
+import numpy as np
+from obgraph.graph_construction import GraphConstructor
+from obgraph.variants import VcfVariants, VcfVariant
+from obgraph.variant_locator import BatchVariantLocator
+
+
+def test_batch_locator_gives_same_nodes_as_get_variant_nodes(random_graphs):
+    for seed, reference, variants, graph in random_graphs(range(10)):
+        ref_nodes, var_nodes = BatchVariantLocator(graph).locate_variants(variants)
+        for variant, ref_node, var_node in zip(variants, ref_nodes, var_nodes):
+            assert graph.get_variant_nodes(variant) == (ref_node, var_node), variant
+
+
+def test_batch_locator_columns():
+    reference = "AATTGGCCATAGGA"
+    variants = VcfVariants(
+        [VcfVariant(1, 2, "A", "AAA", type="INSERTION"),
+         VcfVariant(1, 4, "TGG", "T", type="DELETION"),
+         VcfVariant(1, 9, "A", "G", type="SNP")]
+    )
+    graph = GraphConstructor(reference, variants).get_graph_with_dummy_nodes()
+    ref_nodes, var_nodes = BatchVariantLocator(graph).locate(
+        np.array([1, 1, 1]), [2, 4, 9], ["INSERTION", "DELETION", "SNP"], ["A", "TGG", "A"], ["AAA", "T", "G"])
+
+    expected = [graph.get_variant_nodes(variant) for variant in variants]
+    assert list(zip(ref_nodes, var_nodes)) == expected
@@ -1,5 +1,8 @@
+import gzip
+import struct
+import zlib
 from obgraph import Graph
-from obgraph.variants import VcfVariants, VcfVariant
+from obgraph.variants import VcfVariants, VcfVariant, get_vcf_chromosome_offsets
 
 def test_find_insertion_nodes():
     g = Graph.from_dicts(
@@ -42,3 +45,35 @@ def test_position_index():
     v = variants.get_variants_in_region(1, 4, 8)
     print(v)
 
+
+
+def _write_bgzf(file_name, text, block_size):
+    # bgzf blocks are gzip members with the size of the block in an extra field
+    with open(file_name, "wb") as f:
+        for start in range(0, len(text) + 1, block_size):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            data = text[start:start + block_size]
+            compressed = compressor.compress(data) + compressor.flush()
+            f.write(b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00" + struct.pack("<H", len(compressed) + 25) +
+                    compressed + struct.pack("<II", zlib.crc32(data), len(data)))
+
+
+def test_vcf_chromosome_offsets():
+    lines = ["##fileformat=VCFv4.2", "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO"]
+    for chromosome, n_variants in [("chr1", 30), ("chr2", 1), ("chr10", 12)]:
+        lines.extend("%s\t%d\t.\tA\tC\t.\tPASS\t." % (chromosome, position) for position in range(1, n_variants + 1))
+    text = ("\n".join(lines) + "\n").encode()
+
+    with open("variants_offsets.tmp.vcf", "wb") as f:
+        f.write(text)
+    with gzip.open("variants_offsets.tmp.vcf.gz", "wb") as f:
+        f.write(text)
+    _write_bgzf("variants_offsets_bgzf.tmp.vcf.gz", text, 37)
+
+    for file_name in ["variants_offsets.tmp.vcf", "variants_offsets.tmp.vcf.gz", "variants_offsets_bgzf.tmp.vcf.gz"]:
+        offsets = get_vcf_chromosome_offsets(file_name, chunk_size=50)
+        assert list(offsets) == ["chr1", "chr2", "chr10"]
+        for chromosome, n_variants in [("chr1", 30), ("chr2", 1), ("chr10", 12)]:
+            variants = VcfVariants.from_vcf(file_name, limit_to_chromosome=chromosome, dont_encode_chromosomes=True, file_offset=offsets[chromosome])
+            assert [variant.position for variant in variants] == list(range(1, n_variants + 1))
+            assert all(variant.chromosome == chromosome for variant in variants)